@@ -0,0 +1,119 @@
+# artifact.py
+"""
+Memory-mappable model artifact.
+
+An artifact is a directory:
+    manifest.json     version, model_version, engine parameters, feature
+                      order and the categorical encoder tables
+    <array>.npy       FlatTreeEnsemble node arrays (feature, threshold,
+                      left, right, value, missing_left, roots)
+
+The arrays are opened with mmap_mode="r", so loading costs a JSON parse
+and every process serving the same artifact shares one copy of the trees
+in the page cache.
+
+    python artifact.py export [final_model.pkl] [le_dict.pkl] [model_artifact]
+"""
+import hashlib
+import json
+import os
+import pickle
+import sys
+import warnings
+
+import numpy as np
+
+from encoders import CategoricalEncoder
+from tree_engine import FlatTreeEnsemble, build_engine
+
+ARTIFACT_VERSION = 1
+ARRAYS = {"feature": np.int32, "threshold": np.float64, "left": np.int32, "right": np.int32,
+          "value": np.float64, "missing_left": np.bool_, "roots": np.int32}
+
+MODEL_PATH = os.environ.get("MODEL_PATH", "final_model.pkl")
+LE_DICT_PATH = os.environ.get("LE_DICT_PATH", "le_dict.pkl")
+ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", "model_artifact")
+
+
+def file_version(path: str) -> str:
+    """Short content hash used as model_version for pickles."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def export_artifact(model, le_dict: dict, path: str, model_version: str) -> str:
+    """
+    Write `model` (any ensemble FlatTreeEnsemble supports) and `le_dict`
+    as an artifact; raises TypeError for other models.
+    """
+    engine = FlatTreeEnsemble.from_model(model)
+    encoder = CategoricalEncoder.from_le_dict(le_dict)
+    os.makedirs(path, exist_ok=True)
+    for name, dtype in ARRAYS.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(engine, name), dtype=dtype))
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "model_version": model_version,
+        "source": engine.source,
+        "max_depth": engine.max_depth,
+        "base_score": engine.base_score,
+        "divisor": engine.divisor,
+        "strict_less": engine.strict_less,
+        "feature_names": [str(name) for name in engine.feature_names_in_],
+        "encoder": {col: values.tolist() for col, values in encoder.classes.items()}
+    }
+    # manifest last: a directory without one is never picked up half-written
+    tmp = os.path.join(path, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(path, "manifest.json"))
+    return path
+
+
+def load_artifact(path: str) -> tuple:
+    """(FlatTreeEnsemble over read-only memory maps, CategoricalEncoder, manifest)."""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"{path}: unsupported artifact version {manifest.get('version')}")
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+    engine = FlatTreeEnsemble(**arrays, max_depth=manifest["max_depth"], base_score=manifest["base_score"],
+                              divisor=manifest["divisor"], feature_names=manifest["feature_names"],
+                              strict_less=manifest["strict_less"], source=manifest["source"])
+    return engine, CategoricalEncoder(manifest["encoder"]), manifest
+
+
+def load_model(engine: str = "native", artifact_dir: str = ARTIFACT_DIR,
+               model_path: str = MODEL_PATH, le_dict_path: str = LE_DICT_PATH) -> tuple:
+    """
+    (predictor, encoder, model_version) for serving.
+
+    engine="native" prefers the artifact, unless it is missing or was
+    exported from a different `model_path`; otherwise (and for
+    engine="sklearn") the pickles are loaded as before.
+    """
+    if engine == "native" and os.path.exists(os.path.join(artifact_dir, "manifest.json")):
+        pickled_version = file_version(model_path) if os.path.exists(model_path) else None
+        predictor, encoder, manifest = load_artifact(artifact_dir)
+        if pickled_version in (None, manifest["model_version"]):
+            return predictor, encoder, manifest["model_version"]
+        warnings.warn(f"{artifact_dir} was exported from another model than {model_path}; "
+                      f"loading the pickle (re-run `python artifact.py export`)")
+
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    with open(le_dict_path, "rb") as f:
+        le_dict = pickle.load(f)
+    return build_engine(model, engine), CategoricalEncoder.from_le_dict(le_dict), file_version(model_path)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["export"]:
+        sys.exit(__doc__)
+    model_path, le_dict_path, out = (sys.argv[2:] + [MODEL_PATH, LE_DICT_PATH, ARTIFACT_DIR][len(sys.argv[2:]):])[:3]
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    with open(le_dict_path, "rb") as f:
+        le_dict = pickle.load(f)
+    export_artifact(model, le_dict, out, file_version(model_path))
+    print(f"exported {type(model).__name__} to {out}/")
@@ -0,0 +1,290 @@
+# benchmark.py
+"""
+Offline benchmark of the simulation pipeline.
+
+Synthetic trains are built from synthetic_dataset.csv rows and served by
+SyntheticProvider (schedules, stations and Open-Meteo-shaped weather
+responses, no network). Reports per-stage latency and variants/sec for
+`simulate_all_variants`, and requests/sec of the Flask
+/api/ml/simulate endpoint under concurrent load, as JSON:
+
+    python benchmark.py --stations 10,50,100,200 --output bench.json
+
+Compare two runs' JSON files to spot regressions between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import ml_core
+from artifact import load_model
+from providers import DataProvider, WEATHER_FIELDS, _decode_minutely_15, _window_bounds
+from timing import collect_stages
+
+BASE_TIME = pd.Timestamp("2030-01-07T00:00:00Z")
+WEATHER_DAYS_BEFORE, WEATHER_DAYS_AFTER = 1, 10
+SLOT_SECONDS = 900
+
+
+# --- Open-Meteo SDK look-alikes, so decoding is measured on the real code path
+class _Variable:
+    def __init__(self, values):
+        self._values = values
+
+    def ValuesAsNumpy(self):
+        return self._values
+
+class _Minutely15:
+    def __init__(self, start: int, values: np.ndarray):
+        self._start, self._values = start, values
+
+    def Time(self):
+        return self._start
+
+    def TimeEnd(self):
+        return self._start + SLOT_SECONDS * self._values.shape[1]
+
+    def Interval(self):
+        return SLOT_SECONDS
+
+    def Variables(self, i):
+        return _Variable(self._values[i])
+
+class _Response:
+    def __init__(self, start: int, values: np.ndarray):
+        self._m15 = _Minutely15(start, values)
+
+    def Minutely15(self):
+        return self._m15
+
+
+class SyntheticProvider(DataProvider):
+    """
+    Deterministic trains of `n` stations (train number = `n`, or any
+    number registered with `add_train`) drawn from dataset rows, their
+    stations' `forecasts`, and smooth per-location weather.
+    """
+
+    def __init__(self, dataset: pd.DataFrame, seed: int = 0):
+        self.dataset = dataset.dropna(subset=["lat", "lon"]).reset_index(drop=True)
+        self.seed = seed
+        self._trains, self._stations = {}, {}
+        self._weather_start = int((BASE_TIME - pd.Timedelta(days=WEATHER_DAYS_BEFORE)).value // 10**9)
+        self._weather_slots = (WEATHER_DAYS_BEFORE + WEATHER_DAYS_AFTER) * 86400 // SLOT_SECONDS
+
+    def add_train(self, train_number: int, n_stations: int):
+        rng = np.random.default_rng(self.seed + train_number)
+        rows = self.dataset.iloc[rng.choice(len(self.dataset), n_stations, replace=False)]
+        arrival = BASE_TIME + pd.Timedelta(hours=6)
+        schedule = []
+        for i, row in enumerate(rows.itertuples(index=False)):
+            code = f"SYN{train_number}_{i:03d}"
+            schedule.append({
+                "station_code": code,
+                "station_name": f"Synthetic {train_number}/{i}",
+                "lat": float(row.lat), "lon": float(row.lon), "altitude": float(row.altitude),
+                "day_of_week": row.day_of_week,
+                "day_of_journey": 1 + i * 3 // max(n_stations, 1),
+                "scheduled_arrival": arrival.isoformat()
+            })
+            forecast_times = pd.date_range(arrival - pd.Timedelta(hours=6), periods=48, freq="1h")
+            self._stations[code] = {
+                "station_code": code,
+                "forecasts": [{
+                    "timestamp": t.isoformat(),
+                    "tracks_on_route": int(rng.integers(1, 9)),
+                    "trains_nearby": int(rng.integers(0, 10)),
+                    "maintenance_type": "None"
+                } for t in forecast_times]
+            }
+            arrival += pd.Timedelta(minutes=int(rng.integers(20, 60)))
+        self._trains[train_number] = {"train_number": train_number,
+                                      "train_name": f"Synthetic {n_stations}",
+                                      "schedule": schedule}
+
+    def train_schedule(self, train_number: int) -> dict:
+        if train_number not in self._trains:
+            self.add_train(train_number, train_number)
+        return self._trains[train_number]
+
+    def station(self, station_code: str) -> dict:
+        return self._stations[station_code]
+
+    def _weather_values(self, lat: float, lon: float) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(f"{lat:.4f},{lon:.4f}".encode()) + self.seed)
+        t = np.arange(self._weather_slots) / 96.0                 # days
+        daily = np.sin(2 * np.pi * (t + rng.uniform()))
+        noise = lambda scale: rng.normal(0, scale, self._weather_slots)
+        values = np.stack([
+            22 + 6 * daily + noise(0.5),                           # temp
+            23 + 7 * daily + noise(0.5),                           # feels_like
+            np.clip(65 - 20 * daily + noise(3), 5, 100),           # humidity
+            1008 + 6 * np.sin(2 * np.pi * t / 3) + noise(0.3),     # pressure
+            np.abs(12 + 6 * daily + noise(2)),                     # wind_speed
+            rng.uniform(0, 360) + 30 * daily,                      # wind_deg
+            np.clip(9000 + 3000 * daily + noise(500), 200, 24000), # visibility
+            np.clip(50 - 40 * daily + noise(10), 0, 100),          # clouds
+            14 + 3 * daily + noise(0.5),                           # dew_point
+            rng.choice([0, 1, 2, 3, 45, 51, 61, 80, 95], self._weather_slots)  # weather_code
+        ])
+        return values.astype(np.float32)
+
+    def weather(self, lat: float, lon: float) -> tuple[np.ndarray, dict]:
+        return _decode_minutely_15(_Response(self._weather_start, self._weather_values(lat, lon)))
+
+    def weather_batch(self, coords: list, start, end) -> list:
+        if start is None:
+            return [self.weather(lat, lon) for lat, lon in coords]
+        start, end = _window_bounds(start, end)
+        lo = max(0, (int(start.value // 10**9) - self._weather_start) // SLOT_SECONDS)
+        hi = min(self._weather_slots, (int(end.value // 10**9) - self._weather_start) // SLOT_SECONDS + 1)
+        return [_decode_minutely_15(_Response(self._weather_start + lo * SLOT_SECONDS,
+                                              self._weather_values(lat, lon)[:, lo:hi]))
+                for lat, lon in coords]
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(samples))}
+
+
+def bench_simulate(stations: list, modes: list, model, encoder, repeat: int,
+                   interval_minutes: float, total_hours: float, strategy: str) -> list:
+    """Cold runs (fresh stores, so fetch + decode are included) per train size and mode."""
+    rows = []
+    for n in stations:
+        for mode in modes:
+            walls, stages, result = [], [], None
+            for _ in range(repeat):
+                weather_store, station_store = ml_core.WeatherForecastStore(), ml_core.StationContextStore()
+                with collect_stages() as times:
+                    start = time.perf_counter()
+                    result = ml_core.simulate_all_variants(
+                        n, model, encoder, interval_minutes=interval_minutes, total_hours=total_hours,
+                        weather_store=weather_store, station_store=station_store,
+                        mode=mode, strategy=strategy)
+                    walls.append(time.perf_counter() - start)
+                stages.append(times.to_dict())
+            variants = result["search"]["variants_evaluated"]
+            best = min(range(repeat), key=walls.__getitem__)
+            rows.append({
+                "stations": n,
+                "mode": mode,
+                "strategy": strategy,
+                "variants": variants,
+                "wall_seconds": {"best": walls[best], "mean": float(np.mean(walls))},
+                "variants_per_second": variants / walls[best],
+                "stages": stages[best],
+                "total_delay": result["best_variant"]["total_delay"] if result["best_variant"] else None
+            })
+            print(f"  {n:>4} stations  {mode:<10} {walls[best] * 1000:8.1f} ms  "
+                  f"{rows[-1]['variants_per_second']:8.1f} variants/s", file=sys.stderr)
+    return rows
+
+
+def bench_api(provider: SyntheticProvider, stations: int, requests_total: int, concurrency: int) -> list:
+    """POST /api/ml/simulate from `concurrency` threads; distinct trains miss the cache, repeats hit it."""
+    import ml_api
+
+    client = ml_api.app.test_client()
+    rows = []
+    for scenario in ("distinct", "repeat"):
+        ml_api.SIM_CACHE.clear()
+        train_numbers = [10_000 + i if scenario == "distinct" else 10_000 for i in range(requests_total)]
+        for number in set(train_numbers):
+            provider.add_train(number, stations)
+
+        def call(number):
+            start = time.perf_counter()
+            response = client.post("/api/ml/simulate", json={"train_number": number})
+            return response.status_code, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(call, train_numbers))
+        wall = time.perf_counter() - start
+        latencies = [seconds for _, seconds in outcomes]
+        rows.append({
+            "scenario": scenario,
+            "stations": stations,
+            "requests": requests_total,
+            "concurrency": concurrency,
+            "errors": sum(1 for status, _ in outcomes if status != 200),
+            "wall_seconds": wall,
+            "requests_per_second": requests_total / wall,
+            "latency_seconds": _percentiles(latencies)
+        })
+        print(f"  api {scenario:<8} {rows[-1]['requests_per_second']:8.1f} req/s", file=sys.stderr)
+    return rows
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stations", default="10,50,100,200", help="comma-separated train sizes")
+    parser.add_argument("--modes", default="lockstep,surface", help="simulation modes to compare")
+    parser.add_argument("--strategy", default="grid", choices=ml_core.SEARCH_STRATEGIES)
+    parser.add_argument("--interval-minutes", type=float, default=15)
+    parser.add_argument("--total-hours", type=float, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", default=os.environ.get("INFERENCE_ENGINE", "native"))
+    parser.add_argument("--dataset", default="synthetic_dataset.csv")
+    parser.add_argument("--api-requests", type=int, default=32, help="0 skips the Flask benchmark")
+    parser.add_argument("--api-concurrency", type=int, default=8)
+    parser.add_argument("--api-stations", type=int, default=50)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    provider = SyntheticProvider(pd.read_csv(args.dataset))
+    ml_core.set_provider(provider)
+    model, encoder, model_version = load_model(args.engine)
+
+    stations = [int(n) for n in args.stations.split(",") if n]
+    modes = [m for m in args.modes.split(",") if m]
+    print("simulate_all_variants", file=sys.stderr)
+    report = {
+        "meta": {
+            "git_revision": _git_revision(),
+            "timestamp": pd.Timestamp.now(tz="UTC").isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "engine": args.engine,
+            "model": type(model).__name__,
+            "model_version": model_version,
+            "weather_fields": WEATHER_FIELDS,
+            "args": vars(args)
+        },
+        "simulate": bench_simulate(stations, modes, model, encoder, args.repeat,
+                                   args.interval_minutes, args.total_hours, args.strategy)
+    }
+    if args.api_requests > 0:
+        print("flask /api/ml/simulate", file=sys.stderr)
+        report["api"] = bench_api(provider, args.api_stations, args.api_requests, args.api_concurrency)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
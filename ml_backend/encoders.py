@@ -0,0 +1,45 @@
+# encoders.py
+import numpy as np
+import pandas as pd
+
+
+class CategoricalEncoder:
+    """
+    String -> int lookup tables compiled from a fitted `le_dict`.
+
+    Encodes whole columns in one hashed lookup instead of a per-cell
+    `LabelEncoder.transform`; values not seen at fit time map to -1, same
+    as the old `x in le.classes_` fallback.
+    """
+
+    def __init__(self, classes: dict):
+        self.classes = {col: np.asarray(values).astype(str) for col, values in classes.items()}
+        self._tables = {col: pd.Index(values) for col, values in self.classes.items()}
+
+    @classmethod
+    def from_le_dict(cls, le_dict: dict) -> "CategoricalEncoder":
+        return cls({col: le.classes_ for col, le in le_dict.items()})
+
+    @classmethod
+    def coerce(cls, encoder) -> "CategoricalEncoder":
+        """Accept either a CategoricalEncoder or a plain `le_dict`."""
+        if isinstance(encoder, cls):
+            return encoder
+        return cls.from_le_dict(encoder)
+
+    def __contains__(self, col) -> bool:
+        return col in self._tables
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def encode(self, col: str, values) -> np.ndarray:
+        values = pd.Series(values, copy=False).astype(str)
+        return self._tables[col].get_indexer(values).astype(np.int64)
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        for col in df.columns:
+            if col in self._tables:
+                df[col] = self.encode(col, df[col])
+        return df
@@ -0,0 +1,229 @@
+# forecast_warmer.py
+"""
+Background refresh of the inputs simulations read, so user requests find
+them cached instead of paying the Node API / Open-Meteo round trips
+inline.
+
+Station cycle (every FORECAST_WARMER_STATION_SECONDS, jittered): page
+through the Node API's /stations and /trains listings. Stations already
+in ml_core's station store get their station-load forecasts replaced
+before the store's TTL runs out; others are not added, so the warmer
+never evicts the contexts live simulations are using. The coordinates
+of every station and scheduled stop become the set of weather cells to
+keep warm.
+
+Weather cycle (once per forecast run, see weather_cache.py): at a random
+point in the last FORECAST_WARMER_LEAD_MINUTES of a run, the cells are
+fetched for the *next* run in multi-location batches spread over half
+the lead window, at most FORECAST_WARMER_RPS requests per second. When
+the run rolls over, everything is already cached. Other processes on
+the host read those cells from the shared L2.
+
+`start_from_env()` starts a warmer when FORECAST_WARMER=on, in one
+process per host: gunicorn.conf.py calls it in every worker, and the
+first to take an exclusive lock on forecast_warmer.lock in
+WEATHER_CACHE_DIR runs it. Without fcntl (Windows) every process warms.
+The station cycle only refreshes the elected worker's own station store.
+"""
+import os
+import random
+import sys
+import threading
+import traceback
+from time import monotonic, time
+
+import ml_core
+from timing import count, span
+from weather_cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:              # not POSIX: no election
+    fcntl = None
+
+FORECAST_WARMER = os.environ.get("FORECAST_WARMER", "off")
+STATION_SECONDS = float(os.environ.get("FORECAST_WARMER_STATION_SECONDS",
+                                       str(0.8 * ml_core._station_store.ttl)))
+LEAD_MINUTES = float(os.environ.get("FORECAST_WARMER_LEAD_MINUTES", "10"))
+MAX_RPS = float(os.environ.get("FORECAST_WARMER_RPS", "2"))
+PAGE_SIZE = int(os.environ.get("FORECAST_WARMER_PAGE_SIZE", "100"))
+JITTER = 0.1                     # +-10% on every station-cycle interval
+
+
+class _RateLimiter:
+    """Spaces calls at least `interval` seconds apart; `wait` returns False once `stop` is set."""
+
+    def __init__(self, interval: float, stop: threading.Event):
+        self.interval = interval
+        self.stop = stop
+        self._next = monotonic()
+
+    def wait(self) -> bool:
+        delay = self._next - monotonic()
+        if delay > 0 and self.stop.wait(delay):
+            return False
+        self._next = max(self._next, monotonic()) + self.interval
+        return not self.stop.is_set()
+
+
+class ForecastWarmer:
+    def __init__(self, station_store=None, station_seconds: float = STATION_SECONDS,
+                 lead_minutes: float = LEAD_MINUTES, max_rps: float = MAX_RPS,
+                 page_size: int = PAGE_SIZE, rng: random.Random | None = None):
+        self.station_store = station_store or ml_core._station_store
+        self.station_seconds = station_seconds
+        self.lead_seconds = lead_minutes * 60
+        self.min_interval = 1 / max_rps
+        self.page_size = page_size
+        self.rng = rng or random.Random()
+        self._stop = threading.Event()
+        self._thread = None
+        self._coords = []
+        self._warmed_run = None
+        self._weather_due = None
+        self.state = {"stations": 0, "cells": 0, "warmed_run": None, "cells_fetched": 0,
+                      "last_station_refresh": None, "last_weather_refresh": None,
+                      "errors": 0, "last_error": None}
+
+    # --- station cycle
+    def _pages(self, list_page, key: str):
+        limiter = _RateLimiter(self.min_interval, self._stop)
+        page, pages = 1, 1
+        while page <= pages and limiter.wait():
+            payload = list_page(page, self.page_size)
+            pages = int(payload.get("totalPages") or 0)
+            yield from payload.get(key) or []
+            page += 1
+
+    def refresh_stations(self):
+        """Re-read every station, refreshing the cached ones, and collect the coordinates to warm."""
+        provider = ml_core.get_provider()
+        coords, stations = {}, 0
+        with span("warm_stations"):
+            for station in self._pages(provider.list_stations, "stations"):
+                code = station.get("station_code")
+                if code and self.station_store.refresh(code, ml_core.StationContext.from_station_data(station)):
+                    stations += 1
+                if station.get("lat") is not None and station.get("lon") is not None:
+                    coords[(float(station["lat"]), float(station["lon"]))] = None
+            for train in self._pages(provider.list_trains, "trains"):
+                for stop in train.get("schedule") or []:
+                    if stop.get("lat") is not None and stop.get("lon") is not None:
+                        coords[(float(stop["lat"]), float(stop["lon"]))] = None
+        count("warmer_refreshes", stations, kind="station")
+        self._coords = list(coords)
+        self.state.update(stations=stations, last_station_refresh=time())
+
+    # --- weather cycle
+    def warm_weather(self, run: int, spread_seconds: float = 0.0):
+        """Fetch the uncached cells for `run`, batches spread over `spread_seconds`."""
+        provider = ml_core.get_provider()
+        if not hasattr(provider, "warm"):
+            return                   # WEATHER_CACHE=off: nothing to warm into
+        with span("warm_weather"):
+            cells = provider.uncached(self._coords, run)
+            batches = [cells[i:i + ml_core.WEATHER_BATCH_SIZE]
+                       for i in range(0, len(cells), ml_core.WEATHER_BATCH_SIZE)]
+            interval = max(self.min_interval, spread_seconds / max(len(batches), 1))
+            limiter = _RateLimiter(interval, self._stop)
+            fetched = 0
+            for batch in batches:
+                if not limiter.wait():
+                    return
+                fetched += provider.warm(batch, run)
+        count("warmer_refreshes", fetched, kind="weather_cell")
+        self.state.update(cells=len(self._coords), warmed_run=run, last_weather_refresh=time(),
+                          cells_fetched=self.state["cells_fetched"] + fetched)
+
+    def _weather_step(self, now: float) -> float | None:
+        """Warm whatever is due; returns the wall-clock time the next weather pass is due."""
+        provider = ml_core.get_provider()
+        cache = getattr(provider, "cache", None)
+        if cache is None or not self._coords:
+            return None
+        current = cache.run()
+        if self._warmed_run is None or self._warmed_run < current:
+            # cold start (or a missed window): fill the current run right away
+            self.warm_weather(current)
+            self._warmed_run = current
+            self._weather_due = None
+        elif self._warmed_run == current and self._weather_due is not None and now >= self._weather_due:
+            self.warm_weather(current + 1, spread_seconds=self.lead_seconds / 2)
+            self._warmed_run = current + 1
+            self._weather_due = None
+        if self._weather_due is None and self._warmed_run == current:
+            next_start = cache.run_start(current + 1)
+            # a random start in the first half of the lead window; batches fill the second half
+            self._weather_due = next_start - self.lead_seconds + self.rng.uniform(0, self.lead_seconds / 2)
+        return self._weather_due if self._warmed_run == current else cache.run_start(current + 1)
+
+    # --- loop
+    def _guarded(self, step, *args):
+        try:
+            return step(*args)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            self.state.update(errors=self.state["errors"] + 1, last_error=str(e))
+            return None
+
+    def _run(self):
+        next_stations = monotonic()
+        while not self._stop.is_set():
+            if monotonic() >= next_stations:
+                self._guarded(self.refresh_stations)
+                jitter = self.rng.uniform(1 - JITTER, 1 + JITTER)
+                next_stations = monotonic() + self.station_seconds * jitter
+            weather_due = self._guarded(self._weather_step, time())
+            sleep = next_stations - monotonic()
+            if weather_due is not None:
+                sleep = min(sleep, weather_due - time())
+            self._stop.wait(min(max(sleep, 1.0), 60.0))
+
+    def start(self) -> "ForecastWarmer":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="forecast-warmer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> dict:
+        return dict(self.state, running=self._thread is not None and self._thread.is_alive())
+
+
+_warmer = None
+_lock_file = None                # held open for the life of the elected process
+
+def _elect(lock_dir: str = CACHE_DIR) -> bool:
+    """True if this process holds (or just took) the host's warmer lock."""
+    global _lock_file
+    if fcntl is None or _lock_file is not None:
+        return True
+    os.makedirs(lock_dir, exist_ok=True)
+    f = open(os.path.join(lock_dir, "forecast_warmer.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+def start_from_env() -> ForecastWarmer | None:
+    """Start the host's warmer here if FORECAST_WARMER=on and no other process runs it (idempotent)."""
+    global _warmer
+    if os.environ.get("FORECAST_WARMER", FORECAST_WARMER) != "on" or not _elect():
+        return None
+    if _warmer is None:
+        _warmer = ForecastWarmer()
+    return _warmer.start()
+
+def status() -> dict:
+    if _warmer is not None:
+        return _warmer.status()
+    # another worker may hold the lock: this one just does not run it
+    return {"running": False, "elected": _lock_file is not None}
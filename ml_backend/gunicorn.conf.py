@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+#
+# Production entry point for the ML service:
+#
+#     gunicorn -c gunicorn.conf.py ml_api:app
+#
+# The app (model, encoder tables, warm-up) is loaded once in the master
+# and forked into the workers, which share those pages. Simulations spend
+# most of their time waiting on the Node API and Open-Meteo, so each
+# worker runs several threads.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '7001')}"
+# jobs run in the worker that accepted them, but their state is written to JOB_STATE_DIR
+# (ml_api.py), so any worker of the host can answer or cancel /api/ml/jobs/<id>; no sticky
+# routing is needed. Incremental-simulation sessions stay per worker: a refresh landing on
+# another worker recomputes the train in full.
+workers = int(os.environ.get("ML_WORKERS", os.environ.get("WEB_CONCURRENCY", str(min(4, os.cpu_count() or 1)))))
+worker_class = "gthread"
+threads = int(os.environ.get("ML_THREADS", "8"))
+# a blocking /api/ml/simulate of a long train can take minutes
+timeout = int(os.environ.get("ML_TIMEOUT", "180"))
+graceful_timeout = int(os.environ.get("ML_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# recycle workers now and then so per-process caches do not grow forever
+max_requests = int(os.environ.get("ML_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+# warm up in the master before forking, so every worker starts ready
+os.environ.setdefault("ML_WARMUP", "sync")
+# keep weather and station-load forecasts refreshed in the background (forecast_warmer.py)
+os.environ.setdefault("FORECAST_WARMER", "on")
+
+
+def post_fork(server, worker):
+    # threads do not survive fork, so the warmer starts in a worker: the first
+    # to take the host's lock runs it, the others read its weather from the L2
+    import forecast_warmer
+    forecast_warmer.start_from_env()
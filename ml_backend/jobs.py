@@ -0,0 +1,222 @@
+# jobs.py
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, time
+
+from ml_core import SimulationCancelled
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at its depth limit."""
+
+
+class SimulationJob:
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+    def __init__(self, params: dict):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = self.QUEUED
+        self.created_at = time()
+        self.finished_at = None
+        self.variants = {}             # variant_index -> [stations_done, stations_total]
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, variant_index: int, stations_done: int, stations_total: int):
+        with self._lock:
+            self.variants[variant_index] = [stations_done, stations_total]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED, self.CANCELLED)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            variants = [
+                {"variant": v, "stations_done": done, "stations_total": total}
+                for v, (done, total) in sorted(self.variants.items())
+            ]
+        payload = {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "progress": {
+                "variants_total": len(variants),
+                "variants_done": sum(1 for v in variants if v["stations_done"] == v["stations_total"]),
+                "variants": variants
+            }
+        }
+        if self.status == self.DONE:
+            payload["result"] = self.result
+        if self.error is not None:
+            payload["error"] = self.error
+        return payload
+
+
+class StoredJob:
+    """Another process's job, as last written to the shared state directory."""
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.id = payload["job_id"]
+        self.status = payload["status"]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (SimulationJob.DONE, SimulationJob.FAILED, SimulationJob.CANCELLED)
+
+    def to_dict(self) -> dict:
+        return self.payload
+
+
+class JobManager:
+    """
+    Runs simulations on a bounded worker pool so slow upstream calls tie up
+    pool threads instead of request threads.
+
+    `run(params, progress, cancel_event)` does the work. At most
+    `max_workers` jobs run at once and at most `max_queue` more wait;
+    finished jobs are forgotten after `retention` seconds.
+
+    With a `state_dir`, every process sharing that directory (the gunicorn
+    workers of one host) can see and cancel every job: a job's `to_dict()`
+    is written to <state_dir>/<job_id>.json (encoded by `dumps`) as its
+    status changes and at most every `sync_seconds` while it reports
+    progress, and cancelling a job another process owns leaves a
+    <job_id>.cancel marker that the owner picks up at its next report.
+    """
+
+    def __init__(self, run, max_workers: int = 2, max_queue: int = 16, retention: float = 600.0,
+                 state_dir: str | None = None, dumps=None, sync_seconds: float = 1.0):
+        self.run = run
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retention = retention
+        self.state_dir = state_dir
+        self.dumps = dumps or (lambda payload: json.dumps(payload, default=str))
+        self.sync_seconds = sync_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sim-job")
+        self._jobs = {}
+        self._finished_at = {}
+        self._synced_at = {}
+        self._lock = threading.Lock()
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    # --- shared state
+    def _state_file(self, job_id: str, suffix: str = ".json") -> str | None:
+        # ids come from URLs: only ever turn our own uuid hex format into a path
+        if not self.state_dir or not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+        return os.path.join(self.state_dir, job_id + suffix)
+
+    def _save(self, job: SimulationJob):
+        path = self._state_file(job.id)
+        if path is None:
+            return
+        self._synced_at[job.id] = monotonic()
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.dumps(job.to_dict()))
+        os.replace(tmp, path)
+
+    def _load(self, job_id: str) -> StoredJob | None:
+        path = self._state_file(job_id)
+        try:
+            with open(path) as f:
+                return StoredJob(json.load(f))
+        except (TypeError, OSError, ValueError):
+            return None
+
+    def _cancel_requested(self, job: SimulationJob) -> bool:
+        path = self._state_file(job.id, ".cancel")
+        return path is not None and os.path.exists(path)
+
+    def _forget(self, job_id: str):
+        self._synced_at.pop(job_id, None)
+        for suffix in (".json", ".cancel"):
+            path = self._state_file(job_id, suffix)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def _progress(self, job: SimulationJob):
+        """`job.report`, plus the periodic state write and cancel-marker check."""
+        def report(variant_index: int, stations_done: int, stations_total: int):
+            job.report(variant_index, stations_done, stations_total)
+            if self.state_dir and monotonic() - self._synced_at.get(job.id, 0.0) >= self.sync_seconds:
+                if self._cancel_requested(job):
+                    job.cancel_event.set()
+                self._save(job)
+        return report
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _purge(self):
+        cutoff = monotonic() - self.retention
+        for job_id in [j for j, t in self._finished_at.items() if t < cutoff]:
+            self._jobs.pop(job_id, None)
+            self._finished_at.pop(job_id, None)
+            self._forget(job_id)
+
+    def submit(self, params: dict) -> SimulationJob:
+        with self._lock:
+            self._purge()
+            if self._pending() >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"simulation queue is full ({self.max_queue} waiting)")
+            job = SimulationJob(params)
+            self._jobs[job.id] = job
+        self._save(job)
+        self._pool.submit(self._execute, job)
+        return job
+
+    def _execute(self, job: SimulationJob):
+        if job.cancel_event.is_set() or self._cancel_requested(job):
+            if not job.finished:
+                self._finish(job, SimulationJob.CANCELLED)
+            return
+        job.status = SimulationJob.RUNNING
+        self._save(job)
+        try:
+            job.result = self.run(job.params, self._progress(job), job.cancel_event)
+            self._finish(job, SimulationJob.DONE)
+        except SimulationCancelled:
+            self._finish(job, SimulationJob.CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, SimulationJob.FAILED)
+
+    def _finish(self, job: SimulationJob, status: str):
+        job.status = status
+        job.finished_at = time()
+        with self._lock:
+            self._finished_at[job.id] = monotonic()
+        self._save(job)
+
+    def get(self, job_id: str) -> SimulationJob | StoredJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def cancel(self, job_id: str) -> SimulationJob | StoredJob | None:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        if isinstance(job, StoredJob):
+            # owned by another process: it sees the marker at its next progress report
+            with open(self._state_file(job_id, ".cancel"), "w"):
+                pass
+            return job
+        job.cancel_event.set()
+        if job.status == SimulationJob.QUEUED:
+            self._finish(job, SimulationJob.CANCELLED)
+        return job
@@ -1,259 +1,236 @@
-import pandas as pd
-import numpy as np
-import requests
-from datetime import timedelta
-from sklearn.preprocessing import LabelEncoder
-from sklearn.ensemble import RandomForestRegressor
-import openmeteo_requests
-import requests_cache
-from retry_requests import retry
-import pickle
-
-# -------------------- CONFIG --------------------
-TRAIN_NUMBER = 15938  # Replace with your train number
-MODEL_PATH = "final_model.pkl"  
-LE_DICT_PATH = "le_dict.pkl"    
-
-# -------------------- INITIAL SETUP --------------------
-cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-openmeteo = openmeteo_requests.Client(session=retry_session)
-
-with open(MODEL_PATH, "rb") as f:
-    final_model = pickle.load(f)
-
-with open(LE_DICT_PATH, "rb") as f:
-    le_dict = pickle.load(f)
-
-# -------------------- HELPER FUNCTIONS --------------------
-def fetch_train_schedule(train_number):
-    url = f"https://railway-rescheduling-automation-system.onrender.com/api/trains/{train_number}"
-    r = requests.get(url)
-    r.raise_for_status()
-    df = pd.DataFrame(r.json()['schedule'])
-    return df
-
-def fetch_station_data(station_code):
-    url = f"https://railway-rescheduling-automation-system.onrender.com/api/stations/{station_code}"
-    r = requests.get(url)
-    r.raise_for_status()
-    return r.json()
-
-def get_weather_15min_for_station(lat, lon, time):
-    try:
-        scheduled_time = pd.to_datetime(time)
-        if scheduled_time.tzinfo is None:
-            scheduled_time = scheduled_time.tz_localize("Asia/Kolkata")
-        else:
-            scheduled_time = scheduled_time.tz_convert("Asia/Kolkata")
-
-        print(f"Fetching weather for lat={lat}, lon={lon}, time={scheduled_time}")
-
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "minutely_15": [
-                "temperature_2m","apparent_temperature","relative_humidity_2m",
-                "pressure_msl","windspeed_10m","winddirection_10m",
-                "visibility","cloudcover","dew_point_2m","weathercode"
-            ],
-            "timezone": "auto"
-        }
-
-        responses = openmeteo.weather_api(url, params=params)
-        response = responses[0]
-        minutely_15 = response.Minutely15()
-        df = pd.DataFrame({
-            "time": pd.to_datetime(minutely_15.Time(), unit="s", utc=True),
-            "temp": minutely_15.Variables(0).ValuesAsNumpy(),
-            "feels_like": minutely_15.Variables(1).ValuesAsNumpy(),
-            "humidity": minutely_15.Variables(2).ValuesAsNumpy(),
-            "pressure": minutely_15.Variables(3).ValuesAsNumpy(),
-            "wind_speed": minutely_15.Variables(4).ValuesAsNumpy(),
-            "wind_deg": minutely_15.Variables(5).ValuesAsNumpy(),
-            "visibility": minutely_15.Variables(6).ValuesAsNumpy(),
-            "clouds": minutely_15.Variables(7).ValuesAsNumpy(),
-            "dew_point": minutely_15.Variables(8).ValuesAsNumpy(),
-            "weather_code": minutely_15.Variables(9).ValuesAsNumpy(),
-        })
-
-        if df["time"].dt.tz is None:
-            df["time"] = df["time"].dt.tz_localize("UTC").dt.tz_convert("Asia/Kolkata")
-        else:
-            df["time"] = df["time"].dt.tz_convert("Asia/Kolkata")
+# main.py
+"""
+Offline batch rescheduling: simulate every start-time variant of many
+trains and write the results as partitioned Parquet.
+
+    python main.py 15938
+    python main.py 12001-12100 15938 --workers 4 --out batch_results
+    python main.py --all --run-date 2026-10-17
+
+Trains run in a process pool. Each worker loads the model once
+(artifact.load_model: memory-mapped when the artifact exists) and keeps
+its weather/station stores between trains. Only weather is shared: it
+goes through the L2 of weather_cache.py, so a cell one worker fetched is
+not fetched again by the others. Station contexts are per worker, and a
+station on the routes of trains in different workers is requested from
+the Node API once by each of them.
+
+Output, one file per train in Hive-style partitions:
+    <out>/variants/run_date=<date>/train_<n>.parquet   every evaluated variant
+    <out>/stations/run_date=<date>/train_<n>.parquet   per-station detail of the best one
+    <out>/_checkpoint/run_date=<date>.jsonl            one line per finished train
+
+Files are written under a temporary name and renamed, and a train is
+logged as done only once its files exist: rerunning the same command
+after an interruption skips finished trains. Without pyarrow/fastparquet
+the files are pickled DataFrames (.pkl) instead.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-        row = df.iloc[(df["time"] - scheduled_time).abs().argsort()[:1]].copy()
-
-        def classify_weather(code):
-            if code in [0, 1]: return "Clear"
-            elif code in [2, 3]: return "Clouds"
-            elif code in [45, 48]: return "Fog"
-            elif code in [51, 53, 55]: return "Drizzle"
-            elif code in [61, 63, 65, 80, 81, 82, 95, 96, 99]: return "Rain"
-            elif code in [56, 57]: return "Mist"
-            else: return "Clear"
+import pandas as pd
 
-        row["weather_main"] = row["weather_code"].apply(classify_weather)
-        row.drop(columns=["weather_code"], inplace=True)
-        row["sea_level"] = row["pressure"]
+import ml_core
+from artifact import load_model
+from providers import provider_from_env
+from training_data import _parquet_engine
+
+# set in each worker by _init_worker
+_MODEL = _ENCODER = _MODEL_VERSION = None
+
+
+# --- train selection
+def parse_trains(specs: list) -> list:
+    """Train numbers from "15938", "12001-12100" and comma-separated lists of those, deduplicated in order."""
+    trains = []
+    for spec in specs:
+        for part in str(spec).split(","):
+            part = part.strip()
+            if not part or part.startswith("#"):
+                continue
+            if "-" in part:
+                first, last = (int(x) for x in part.split("-", 1))
+                trains.extend(range(first, last + 1))
+            else:
+                trains.append(int(part))
+    return list(dict.fromkeys(trains))
+
+def read_trains_file(path: str) -> list:
+    with open(path) as f:
+        return [line.split("#", 1)[0].strip() for line in f]
+
+def all_trains(page_size: int = 100) -> list:
+    """Every train number in the Node API's /trains listing."""
+    provider, trains, page, pages = ml_core.get_provider(), [], 1, 1
+    while page <= pages:
+        payload = provider.list_trains(page, page_size)
+        pages = int(payload.get("totalPages") or 0)
+        trains.extend(int(t["train_number"]) for t in payload.get("trains") or [])
+        page += 1
+    return list(dict.fromkeys(trains))
+
+
+# --- output
+class BatchOutput:
+    """Partition paths, atomic file writes and the checkpoint log of one run date."""
+
+    def __init__(self, root: str, run_date: str):
+        self.root = root
+        self.run_date = run_date
+        self.engine = _parquet_engine()
+        self.ext = ".parquet" if self.engine else ".pkl"
+        self.checkpoint = os.path.join(root, "_checkpoint", f"run_date={run_date}.jsonl")
+
+    def path(self, table: str, train_number: int) -> str:
+        return os.path.join(self.root, table, f"run_date={self.run_date}", f"train_{train_number}{self.ext}")
+
+    def write(self, table: str, train_number: int, df: pd.DataFrame) -> str:
+        path = self.path(table, train_number)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if self.engine:
+            df.to_parquet(tmp, engine=self.engine, index=False)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, path)
+        return path
+
+    def finished(self) -> set:
+        """Trains logged as done whose files are still there."""
+        done = set()
+        if not os.path.exists(self.checkpoint):
+            return done
+        with open(self.checkpoint) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue             # a line cut short by a crash
+                if entry.get("status") == "done" and os.path.exists(self.path("variants", entry["train_number"])):
+                    done.add(entry["train_number"])
+        return done
+
+    def log(self, entry: dict):
+        os.makedirs(os.path.dirname(self.checkpoint), exist_ok=True)
+        with open(self.checkpoint, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# --- workers
+def _init_worker(engine: str):
+    global _MODEL, _ENCODER, _MODEL_VERSION
+    # a fresh provider per process: HTTP connection pools must not be shared across fork
+    ml_core.set_provider(provider_from_env(pool_maxsize=ml_core.PREFETCH_WORKERS))
+    _MODEL, _ENCODER, _MODEL_VERSION = load_model(engine)
+
+def simulate_train(train_number: int, params: dict, output: BatchOutput) -> dict:
+    """Simulate one train and write its partitions; never raises, the outcome is in the returned entry."""
+    start = time.perf_counter()
+    entry = {"train_number": train_number, "model_version": _MODEL_VERSION}
+    try:
+        result = ml_core.simulate_all_variants(train_number, _MODEL, _ENCODER, **params)
+        variants = pd.DataFrame(result["all_variants"], columns=["start_time_variant", "total_delay"])
+        variants.insert(0, "train_number", train_number)
+        variants["rank"] = range(1, len(variants) + 1)
+        variants["model_version"] = _MODEL_VERSION
+        detail = result["best_detail"] if result["best_detail"] is not None else pd.DataFrame()
+        detail.insert(0, "train_number", train_number)
+        output.write("stations", train_number, detail)
+        # variants last: its file is what marks the train as written
+        output.write("variants", train_number, variants)
+        best = result["best_variant"] or {}
+        entry.update(status="done", variants=len(variants),
+                     best_start=best.get("start_time_variant"), best_total_delay=best.get("total_delay"))
+    except Exception as e:
+        entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+# --- driver
+def run(trains: list, params: dict, output: BatchOutput, workers: int, engine: str) -> list:
+    done = output.finished()
+    pending = [t for t in trains if t not in done]
+    print(f"{len(trains)} trains, {len(trains) - len(pending)} already done, {len(pending)} to simulate "
+          f"({f'{workers} worker process' + ('es' if workers > 1 else '') if workers > 0 else 'in this process'})", file=sys.stderr)
+
+    entries, start = [], time.perf_counter()
+
+    def record(entry: dict):
+        output.log(entry)
+        entries.append(entry)
+        elapsed = time.perf_counter() - start
+        rate = len(entries) / elapsed * 60
+        remaining = (len(pending) - len(entries)) / rate if rate else 0
+        print(f"[{len(entries)}/{len(pending)}] train {entry['train_number']} {entry['status']} "
+              f"in {entry['seconds']:.1f}s | {rate:.1f} trains/min | ~{remaining:.0f} min left"
+              + (f" | {entry['error']}" if entry["status"] == "failed" else ""), file=sys.stderr)
+
+    if workers <= 0:
+        _init_worker(engine)
+        for train_number in pending:
+            record(simulate_train(train_number, params, output))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,)) as pool:
+            futures = [pool.submit(simulate_train, t, params, output) for t in pending]
+            try:
+                for future in as_completed(futures):
+                    record(future.result())
+            except KeyboardInterrupt:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for e in entries if e["status"] == "failed")
+    print(f"simulated {len(entries)} trains ({failed} failed) in {elapsed:.1f}s: "
+          f"{len(entries) / elapsed * 60 if elapsed else 0:.1f} trains/min", file=sys.stderr)
+    return entries
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trains", nargs="*", help="train numbers or ranges (12001-12100), comma-separated or not")
+    parser.add_argument("--trains-file", help="file with one train number or range per line (# comments)")
+    parser.add_argument("--all", action="store_true", help="every train in the Node API")
+    parser.add_argument("--out", default="batch_results", help="output root directory")
+    parser.add_argument("--run-date", default=pd.Timestamp.now(tz="Asia/Kolkata").date().isoformat(),
+                        help="partition (and checkpoint) to write; rerun with the same one to resume")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="0 = run in this process")
+    parser.add_argument("--engine", default=os.environ.get("INFERENCE_ENGINE", "native"))
+    parser.add_argument("--mode", default="lockstep", choices=["lockstep", "surface", "sequential"])
+    parser.add_argument("--strategy", default="grid", choices=ml_core.SEARCH_STRATEGIES)
+    parser.add_argument("--prune", default="bound", choices=ml_core.PRUNE_MODES)
+    parser.add_argument("--interval-minutes", type=float, default=15)
+    parser.add_argument("--total-hours", type=float, default=4)
+    args = parser.parse_args(argv)
+
+    specs = list(args.trains) + (read_trains_file(args.trains_file) if args.trains_file else [])
+    trains = parse_trains(specs)
+    if args.all:
+        trains = list(dict.fromkeys(trains + all_trains()))
+    if not trains:
+        parser.error("no trains given (train numbers, --trains-file or --all)")
+
+    params = {"interval_minutes": args.interval_minutes, "total_hours": args.total_hours,
+              "mode": args.mode, "strategy": args.strategy, "prune": args.prune}
+    output = BatchOutput(args.out, args.run_date)
+    try:
+        entries = run(trains, params, output, args.workers, args.engine)
+    except KeyboardInterrupt:
+        print(f"interrupted; rerun with --run-date {args.run_date} to resume", file=sys.stderr)
+        return 130
 
-        return row.iloc[0].to_dict()
+    for entry in entries:
+        if entry["status"] == "done":
+            print(f"{entry['train_number']}\t{entry['best_start']}\t{entry['best_total_delay']}")
+    return 1 if any(e["status"] == "failed" for e in entries) else 0
 
-    except Exception as e:
-        print(f"Weather fetch failed for {lat},{lon}: {e}")
-        return None
-
-def get_tracks_trains_nearby(station_data, target_time):
-    forecasts = station_data.get("forecasts", [])
-    if not forecasts:
-        return {"tracks_on_route": 1, "trains_nearby": 0}
-    df_f = pd.DataFrame(forecasts)
-    df_f['timestamp'] = pd.to_datetime(df_f['timestamp'], utc=True).dt.tz_convert('Asia/Kolkata')
-    closest = df_f.iloc[(df_f["timestamp"] - target_time).abs().argsort()[:1]]
-    return {
-        "tracks_on_route": int(closest["tracks_on_route"].values[0]),
-        "trains_nearby": int(closest["trains_nearby"].values[0])
-    }
-
-# -------------------- LOAD TRAIN SCHEDULE --------------------
-train_schedule = fetch_train_schedule(TRAIN_NUMBER)
-train_schedule["scheduled_arrival"] = pd.to_datetime(train_schedule["scheduled_arrival"])
-
-# -------------------- SIMULATION FUNCTION --------------------
-def simulate_schedule_variant(shifted_schedule, original_schedule):
-    """
-    Simulate one schedule variant (shifted start time) with cumulative delay and weather fetch.
-    """
-    start_time_variant = pd.to_datetime(
-        shifted_schedule["scheduled_arrival"].dropna().iloc[0]
-    )
-    
-    print("\n" + "=" * 60)
-    print(f"Simulating Schedule Variant starting at: {start_time_variant}")
-    print("=" * 60)
-
-    cumulative_delay = 0
-    weather_records_sim = []
-
-    for i, row in shifted_schedule.iterrows():
-        if pd.isna(row["scheduled_arrival"]):
-            continue
-
-        # Shifted scheduled arrival
-        sched_arr = pd.to_datetime(row["scheduled_arrival"])
-        if sched_arr.tzinfo is None:
-            sched_arr = sched_arr.tz_localize("Asia/Kolkata")
-        else:
-            sched_arr = sched_arr.tz_convert("Asia/Kolkata")
 
-        # Original scheduled arrival
-        original_arr = pd.to_datetime(original_schedule.loc[i, "scheduled_arrival"])
-        if original_arr.tzinfo is None:
-            original_arr = original_arr.tz_localize("Asia/Kolkata")
-        else:
-            original_arr = original_arr.tz_convert("Asia/Kolkata")
-
-        # Forecast time adjusted for cumulative delay
-        forecast_time = sched_arr + timedelta(minutes=cumulative_delay)
-
-        # Fetch station info & weather
-        station_info = fetch_station_data(row["station_code"])
-        weather = get_weather_15min_for_station(row["lat"], row["lon"], forecast_time)
-        if weather is None:
-            print(f"No weather data for station {row['station_code']} at {forecast_time}")
-            continue
-
-        # Get tracks/trains nearby
-        tracks_trains = get_tracks_trains_nearby(station_info, forecast_time)
-        weather.update(tracks_trains)
-
-        # Prepare model input
-        X_row = pd.DataFrame([{
-            'temp': weather['temp'] + 273.15,
-            'feels_like': weather['feels_like'] + 273.15,
-            'humidity': weather['humidity'],
-            'pressure': weather['pressure'],
-            'wind_speed': weather['wind_speed'],
-            'wind_deg': weather['wind_deg'],
-            'visibility': weather['visibility'],
-            'clouds': weather['clouds'],
-            'dew_point': weather['dew_point'] + 273.15,
-            'weather_main': weather['weather_main'],
-            'lat': row['lat'],
-            'lon': row['lon'],
-            'altitude': row['altitude'],
-            'sea_level': weather['sea_level'],
-            'day_of_week': row['day_of_week'],
-            'day_of_journey': row['day_of_journey'],
-            'tracks_on_route': weather['tracks_on_route'],
-            'trains_nearby': weather['trains_nearby']
-        }])
-
-        # Encode categorical columns
-        for col in X_row.columns:
-            if col in le_dict:
-                X_row[col] = X_row[col].astype(str).apply(
-                    lambda x: le_dict[col].transform([x])[0] if x in le_dict[col].classes_ else -1
-                )
-
-        # Align columns and predict
-        X_row = X_row.reindex(columns=final_model.feature_names_in_, fill_value=0)
-        delay_pred = float(final_model.predict(X_row)[0])
-        cumulative_delay += delay_pred
-        actual_arr = sched_arr + timedelta(minutes=cumulative_delay)
-
-        # Record step
-        weather_records_sim.append({
-            "station_index": i,
-            "station_code": row["station_code"],
-            "station_name": row["station_name"],
-            "original_scheduled_arrival": original_arr,
-            "scheduled_arrival_shifted": sched_arr,
-            "forecast_time": forecast_time,
-            "predicted_delay": delay_pred,
-            "cumulative_delay": cumulative_delay,
-            "actual_arrival_predicted": actual_arr,
-            "start_time_variant": start_time_variant
-        })
-
-        print(f"Station {row['station_code']}: Original = {original_arr.strftime('%H:%M')}, "
-              f"Shifted = {sched_arr.strftime('%H:%M')}, "
-              f"Predicted Delay = {delay_pred:.2f} min | Cumulative = {cumulative_delay:.2f} min | ETA = {actual_arr.strftime('%H:%M')}")
-
-    # Convert to DataFrame
-    sim_df = pd.DataFrame(weather_records_sim)
-    total_delay_sim = sim_df["cumulative_delay"].iloc[-1] if not sim_df.empty else None
-
-    print(f"\nTotal Cumulative Delay for Variant ({start_time_variant}) = {total_delay_sim:.2f} minutes\n")
-
-    return {
-        "start_time_variant": start_time_variant,
-        "total_delay": total_delay_sim,
-        "detail_df": sim_df
-    }
-
-# -------------------- RUN SIMULATION FOR ALL START TIMES --------------------
-interval = timedelta(minutes=15)
-total_shift_duration = timedelta(hours=4)
-base_start_time = train_schedule["scheduled_arrival"].dropna().iloc[0]
-num_intervals = int(total_shift_duration.total_seconds() // interval.total_seconds())
-shift_times = [base_start_time + i * interval for i in range(num_intervals + 1)]
-
-sim_results = []
-for start_time in shift_times:
-    # Shift the entire schedule by the difference from base start time
-    shift_minutes = (start_time - base_start_time).total_seconds() / 60
-    shifted_schedule = train_schedule.copy()
-    shifted_schedule["scheduled_arrival"] = shifted_schedule["scheduled_arrival"] + timedelta(minutes=shift_minutes)
-
-    # Simulate this variant
-    result = simulate_schedule_variant(shifted_schedule, train_schedule)  # <-- pass original schedule
-    sim_results.append(result)
-
-# Summary
-summary_df = pd.DataFrame([{"start_time_variant": r["start_time_variant"], "total_delay": r["total_delay"]} 
-                           for r in sim_results if r["total_delay"] is not None]).sort_values("total_delay")
-
-print("\n=== Summary of total delays for alternative schedules ===")
-print(summary_df)
+if __name__ == "__main__":
+    sys.exit(main())
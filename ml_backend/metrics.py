@@ -0,0 +1,123 @@
+# metrics.py
+"""
+In-process counters and histograms rendered in the Prometheus text
+exposition format (version 0.0.4). `install()` feeds every timing span
+into `ml_stage_seconds{stage=...}` and every timing counter into
+`ml_<counter>_total{...}`.
+
+Values are per process; with several gunicorn workers each one reports
+its own series.
+"""
+import bisect
+import threading
+
+import timing
+
+# seconds; stage spans are milliseconds, whole requests can take minutes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help = name, help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels_text(key)} {value}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}              # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(key)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels_text(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help_text: str):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text)
+            return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name: str, help_text: str = "") -> Histogram:
+        return self._get(Histogram, name, help_text)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return "\n".join(line for _, metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_installed = False
+_install_lock = threading.Lock()
+
+def install(registry: Registry = REGISTRY, prefix: str = "ml"):
+    """Route timing spans and counters into `registry` (idempotent)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+    stages = registry.histogram(f"{prefix}_stage_seconds", "Time spent per pipeline stage.")
+
+    def on_count(counter: str, n: int, labels: dict):
+        registry.counter(f"{prefix}_{counter}_total", f"Pipeline {counter} events.").inc(n, **labels)
+
+    timing.add_sink(lambda stage, seconds: stages.observe(seconds, stage=stage), on_count)
@@ -1,57 +1,360 @@
 # ml_api.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import pandas as pd
-import pickle
 import os
+import time
+import json
+import threading
+from collections import OrderedDict
 
-from ml_core import simulate_all_variants
+from ml_core import (simulate_all_variants, iter_variant_results, IncrementalSimulation,
+                     SEARCH_STRATEGIES, PRUNE_MODES, _predict_rows, get_provider)
+from artifact import load_model
+from result_cache import SingleFlightCache
+from jobs import JobManager, QueueFullError
+from timing import collect_stages, count
+import metrics
+import forecast_warmer
 
 # ---- config / model paths
 MODEL_PATH = os.environ.get("MODEL_PATH", "final_model.pkl")
 LE_DICT_PATH = os.environ.get("LE_DICT_PATH", "le_dict.pkl")
+# memory-mapped export of the same model (see artifact.py); used by the native engine when present
+MODEL_ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", "model_artifact")
+# "native" = flat NumPy tree engine (falls back to sklearn for non-tree models)
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "native")
+# "surface" = per-station delay lookup tables, "lockstep" = one predict per station (same results),
+# "auto" = surface for grid searches of at least SURFACE_MIN_VARIANTS variants, lockstep otherwise
+SIM_MODE = os.environ.get("SIM_MODE", "auto")
+# below this many grid variants the surface's up-front batch costs more than lockstep saves
+# (benchmark.py break-even); adaptive searches are always faster in lockstep
+SURFACE_MIN_VARIANTS = int(os.environ.get("SURFACE_MIN_VARIANTS", "145"))
+SIM_CACHE_TTL = float(os.environ.get("SIM_CACHE_TTL", "900"))
+SIM_CACHE_SIZE = int(os.environ.get("SIM_CACHE_SIZE", "256"))
+FORECAST_BUCKET_SECONDS = 15 * 60
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "16"))
+# job state shared by the workers of one host, so any of them can answer /api/ml/jobs/<id>
+# ("" = per-process only)
+JOB_STATE_DIR = os.environ.get("JOB_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jobs"))
+# variants simulated together per streamed batch (1 = emit each as soon as it is done)
+STREAM_GROUP_SIZE = int(os.environ.get("STREAM_GROUP_SIZE", "1"))
+# limits on the client-chosen search window
+MAX_SIM_HOURS = float(os.environ.get("MAX_SIM_HOURS", "24"))
+MIN_INTERVAL_MINUTES = float(os.environ.get("MIN_INTERVAL_MINUTES", "1"))
+# trains whose last grid run is kept for incremental refreshes (surface mode, grid strategy)
+INCREMENTAL_SESSIONS = int(os.environ.get("INCREMENTAL_SESSIONS", "64"))
+# clients may send this header to get a per-stage timing breakdown in /api/ml/simulate
+DEBUG_TIMINGS_HEADER = "X-Debug-Timings"
+ALLOW_DEBUG_TIMINGS = os.environ.get("ALLOW_DEBUG_TIMINGS", "1") == "1"
+DEFAULT_SIM_PARAMS = {"interval_minutes": 15, "total_hours": 4, "strategy": "grid", "prune": "bound"}
+# "sync" = warm up at import (gunicorn.conf.py sets this so it happens before forking),
+# "background" = warm up in a thread while already serving, "off" = never (always ready)
+ML_WARMUP = os.environ.get("ML_WARMUP", "background")
+WARMUP_ROWS = 64
 
 # ---- load once
-with open(MODEL_PATH, "rb") as f:
-    FINAL_MODEL = pickle.load(f)
-with open(LE_DICT_PATH, "rb") as f:
-    LE_DICT = pickle.load(f)
+PREDICTOR, ENCODER, MODEL_VERSION = load_model(INFERENCE_ENGINE, MODEL_ARTIFACT_DIR, MODEL_PATH, LE_DICT_PATH)
+
+# ---- warm-up: one batch through encode + predict so first requests skip lazy init and page faults
+READY = threading.Event()
+WARMUP_STATE = {"status": "pending", "seconds": None, "error": None}
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        rows = []
+        for i in range(WARMUP_ROWS):
+            row = {name: float(i % 7) for name in PREDICTOR.feature_names_in_}
+            for col in ENCODER:
+                classes = ENCODER.classes[col]
+                row[col] = str(classes[i % len(classes)]) if len(classes) else "NA"
+            rows.append(row)
+        _predict_rows(rows, PREDICTOR, ENCODER)
+        if hasattr(PREDICTOR, "lower_bound"):
+            PREDICTOR.lower_bound(ENCODER.transform(pd.DataFrame(rows))
+                                  .reindex(columns=PREDICTOR.feature_names_in_, fill_value=0))
+        WARMUP_STATE.update(status="done", seconds=time.perf_counter() - start)
+    except Exception as e:
+        # a failed warm-up only costs latency; serve anyway
+        import traceback; traceback.print_exc()
+        WARMUP_STATE.update(status="failed", seconds=time.perf_counter() - start, error=str(e))
+    READY.set()
+
+if ML_WARMUP == "sync":
+    warm_up()
+elif ML_WARMUP == "background":
+    threading.Thread(target=warm_up, name="ml-warmup", daemon=True).start()
+else:
+    WARMUP_STATE["status"] = "skipped"
+    READY.set()
+
+# ---- simulation results, keyed per train / params / model / 15-min forecast bucket
+SIM_CACHE = SingleFlightCache(ttl=SIM_CACHE_TTL, max_entries=SIM_CACHE_SIZE)
 
 app = Flask(__name__)
 # If browser calls Flask directly; harmless if proxied by Node:
 CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
 
+# ---- metrics: pipeline spans/counters plus per-endpoint request counts and latency
+metrics.install()
+HTTP_REQUESTS = metrics.REGISTRY.counter("ml_http_requests_total", "HTTP requests by endpoint and status.")
+HTTP_SECONDS = metrics.REGISTRY.histogram(
+    "ml_http_request_seconds", "Time to response headers by endpoint (streams keep running after).")
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if "request_start" in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+# ---- health: liveness is unconditional, readiness waits for the model warm-up
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    body = {"ready": READY.is_set(), "model_version": MODEL_VERSION,
+            "engine": type(PREDICTOR).__name__, "warmup": WARMUP_STATE}
+    return jsonify(body), 200 if body["ready"] else 503
+
+
+# ---- weather cache hit rates (this process's L1, and its view of the shared L2) and warmer state
+@app.route("/api/ml/cache/weather", methods=["GET"])
+def weather_cache_stats():
+    cache = getattr(get_provider(), "cache", None)
+    if cache is None:
+        return jsonify({"enabled": False, "warmer": forecast_warmer.status()})
+    return jsonify({"enabled": True, **cache.stats(), "warmer": forecast_warmer.status()})
+
+
+def _serialize_detail(detail_df) -> list:
+    df = detail_df.copy() if detail_df is not None else pd.DataFrame()
+    for col in ["original_scheduled_arrival","scheduled_arrival_shifted",
+                "forecast_time","actual_arrival_predicted","start_time_variant"]:
+        if col in df.columns:
+            df[col] = df[col].apply(lambda x: x.isoformat() if pd.notna(x) else None)
+    return df.to_dict(orient="records")
+
+def _simulation_params(data: dict) -> dict:
+    """Search parameters from a request body; raises ValueError when out of range."""
+    params = {key: data.get(key, default) for key, default in DEFAULT_SIM_PARAMS.items()}
+    params["interval_minutes"] = float(params["interval_minutes"])
+    params["total_hours"] = float(params["total_hours"])
+    if not MIN_INTERVAL_MINUTES <= params["interval_minutes"] <= 24 * 60:
+        raise ValueError(f"interval_minutes must be between {MIN_INTERVAL_MINUTES:g} and 1440")
+    if not 0 <= params["total_hours"] <= MAX_SIM_HOURS:
+        raise ValueError(f"total_hours must be between 0 and {MAX_SIM_HOURS:g}")
+    if params["strategy"] not in SEARCH_STRATEGIES:
+        raise ValueError(f"strategy must be one of {', '.join(SEARCH_STRATEGIES)}")
+    if params["prune"] not in PRUNE_MODES:
+        raise ValueError(f"prune must be one of {', '.join(PRUNE_MODES)}")
+    return params
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def _incremental_session(train_number: int, params: dict) -> IncrementalSimulation:
+    key = (train_number, params["interval_minutes"], params["total_hours"])
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = IncrementalSimulation(
+                train_number, PREDICTOR, ENCODER,
+                interval_minutes=params["interval_minutes"], total_hours=params["total_hours"])
+        _sessions.move_to_end(key)
+        while len(_sessions) > INCREMENTAL_SESSIONS:
+            _sessions.popitem(last=False)
+    return session
+
+def _simulation_mode(params: dict) -> str:
+    if SIM_MODE != "auto":
+        return SIM_MODE
+    variants = int(params["total_hours"] * 60 // params["interval_minutes"]) + 1
+    return "surface" if params["strategy"] == "grid" and variants >= SURFACE_MIN_VARIANTS else "lockstep"
+
+def _run_simulation(train_number: int, params: dict, progress=None, cancel_event=None) -> dict:
+    mode = _simulation_mode(params)
+    if params["strategy"] == "grid" and mode == "surface" and INCREMENTAL_SESSIONS > 0:
+        result = _incremental_session(train_number, params).run(progress, cancel_event)
+    else:
+        result = simulate_all_variants(train_number, PREDICTOR, ENCODER, **params, mode=mode,
+                                       progress=progress, cancel_event=cancel_event)
+    return {
+        "train_number": result["train_number"],
+        "best_variant": result["best_variant"],
+        "all_variants": result["all_variants"],
+        "detail_df": _serialize_detail(result["best_detail"]),
+        "search": result["search"],
+        "diff": result.get("diff")
+    }
+
+def _simulation_key(train_number: int, params: dict) -> tuple:
+    forecast_bucket = int(time.time() // FORECAST_BUCKET_SECONDS)
+    return (train_number, *sorted(params.items()), MODEL_VERSION, INFERENCE_ENGINE, forecast_bucket)
+
 
-@app.route("/api/ml/simulate", methods=["POST"])
 @app.route("/api/ml/simulate", methods=["POST"])
 def simulate():
     data = request.get_json(silent=True) or {}
     train_number = data.get("train_number")
     if not train_number:
         return jsonify({"error": "train_number is required"}), 400
+    try:
+        params = _simulation_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        result = simulate_all_variants(int(train_number), FINAL_MODEL, LE_DICT)
+        train_number = int(train_number)
+        start = time.perf_counter()
+        with collect_stages() as times:
+            payload, cache_status = SIM_CACHE.get_or_compute(
+                _simulation_key(train_number, params), lambda: _run_simulation(train_number, params))
+            count("cache_lookups", cache="result", result=cache_status.lower())
+        if ALLOW_DEBUG_TIMINGS and request.headers.get(DEBUG_TIMINGS_HEADER):
+            payload = {**payload, "timings": {
+                "total_seconds": time.perf_counter() - start,
+                "cache": cache_status,
+                "stages": times.to_dict(),
+                "counters": times.counters_dict()
+            }}
+        response = jsonify(payload)
+        response.headers["X-Cache"] = cache_status
+        return response
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 
-        # serialize best variant detail_df
-        df = result["best_detail"].copy() if result["best_detail"] is not None else pd.DataFrame()
-        for col in ["original_scheduled_arrival","scheduled_arrival_shifted",
-                    "forecast_time","actual_arrival_predicted","start_time_variant"]:
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: x.isoformat() if pd.notna(x) else None)
+# ---- streaming: one line/event per finished variant, best detail at the end
+def _iso(ts):
+    return ts.isoformat() if pd.notna(ts) else None
 
-        payload = {
-            "train_number": result["train_number"],
-            "best_variant": result["best_variant"],
-            "all_variants": result["all_variants"],
-            "detail_df": df.to_dict(orient="records")
+def _stream_simulation(train_number: int, params: dict):
+    best, best_detail, variants, search = None, None, [], {}
+    try:
+        for index, variant_count, result in iter_variant_results(train_number, PREDICTOR, ENCODER, **params,
+                                                         group_size=STREAM_GROUP_SIZE, stats=search,
+                                                         mode=_simulation_mode(params)):
+            variant = {"start_time_variant": _iso(result["start_time_variant"]),
+                       "total_delay": result["total_delay"]}
+            if result["total_delay"] is not None:
+                variants.append(variant)
+                if best is None or result["total_delay"] < best["total_delay"]:
+                    best, best_detail = variant, result.detail_df()
+            yield "variant", {"variant": index, "variant_count": variant_count,
+                              **variant, "best_so_far": best}
+
+        yield "done", {
+            "train_number": train_number,
+            "best_variant": best,
+            "all_variants": sorted(variants, key=lambda v: v["total_delay"]),
+            "detail_df": _serialize_detail(best_detail),
+            "search": search
         }
-        return jsonify(payload)
     except Exception as e:
         import traceback; traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        yield "error", {"error": str(e)}
+
+
+@app.route("/api/ml/simulate/stream", methods=["POST"])
+def simulate_stream():
+    """NDJSON by default; Server-Sent Events when the client accepts text/event-stream."""
+    data = request.get_json(silent=True) or {}
+    train_number = data.get("train_number")
+    if not train_number:
+        return jsonify({"error": "train_number is required"}), 400
+    try:
+        params = _simulation_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        train_number = int(train_number)
+    except (TypeError, ValueError):
+        return jsonify({"error": "train_number must be an integer"}), 400
+    sse = "text/event-stream" in request.headers.get("Accept", "")
+
+    def generate():
+        for event, body in _stream_simulation(train_number, params):
+            line = json.dumps({"type": event, **body}, default=str)
+            yield f"event: {event}\ndata: {line}\n\n" if sse else line + "\n"
+
+    mimetype = "text/event-stream" if sse else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---- asynchronous jobs: POST enqueues, GET polls, DELETE cancels
+def _run_job(params: dict, progress, cancel_event) -> dict:
+    # Jobs carry their own progress and cancel event, so they never join (or lead) a
+    # single-flight computation: a cancelled job must not fail the requests waiting on it.
+    # They only reuse finished results and store their own.
+    train_number, sim_params = params["train_number"], params["search"]
+    key = _simulation_key(train_number, sim_params)
+    payload = SIM_CACHE.get(key)
+    count("cache_lookups", cache="result", result="hit" if payload is not None else "miss")
+    if payload is None:
+        payload = _run_simulation(train_number, sim_params, progress, cancel_event)
+        SIM_CACHE.put(key, payload)
+    return payload
+
+JOBS = JobManager(_run_job, max_workers=JOB_WORKERS, max_queue=JOB_QUEUE_DEPTH,
+                  state_dir=JOB_STATE_DIR or None, dumps=app.json.dumps)
+
+
+@app.route("/api/ml/jobs", methods=["POST"])
+def create_job():
+    data = request.get_json(silent=True) or {}
+    train_number = data.get("train_number")
+    if not train_number:
+        return jsonify({"error": "train_number is required"}), 400
+    try:
+        params = _simulation_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        train_number = int(train_number)
+    except (TypeError, ValueError):
+        return jsonify({"error": "train_number must be an integer"}), 400
+    try:
+        job = JOBS.submit({"train_number": train_number, "search": params})
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+
+@app.route("/api/ml/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/ml/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = JOBS.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify({"job_id": job.id, "status": job.status})
 
 
 if __name__ == "__main__":
-    # Run this service alongside your Node API
-    app.run(host="0.0.0.0", port=7001, debug=True)
+    # Development server. In production run: gunicorn -c gunicorn.conf.py ml_api:app
+    forecast_warmer.start_from_env()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "7001")),
+            debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
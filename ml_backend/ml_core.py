@@ -1,30 +1,60 @@
 # ml_core.py
 import pandas as pd
 import numpy as np
-import requests
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
 from datetime import timedelta
-import openmeteo_requests
-import requests_cache
-from retry_requests import retry
+from functools import partial
 
-# --- Open-Meteo client (cached + retries)
-_cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-_retry_session = retry(_cache_session, retries=5, backoff_factor=0.2)
-_openmeteo = openmeteo_requests.Client(session=_retry_session)
+from encoders import CategoricalEncoder
+from tree_engine import FlatTreeEnsemble
+from providers import BundleUnavailable, DataProvider, WEATHER_FIELDS, provider_from_env
+from timing import span, count, propagate
 
-def fetch_train_schedule(train_number: int) -> pd.DataFrame:
-    url = f"https://railway-rescheduling-automation-system.onrender.com/api/trains/{train_number}"
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-    df = pd.DataFrame(r.json()["schedule"])
+# --- data provider (schedules, stations, weather); see providers.py
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "8"))
+_provider = provider_from_env(pool_maxsize=PREFETCH_WORKERS)
+
+def get_provider() -> DataProvider:
+    return _provider
+
+def set_provider(provider: DataProvider) -> DataProvider:
+    """Route all fetches through `provider`; returns the previous one."""
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
+
+def _schedule_frame(payload: dict) -> pd.DataFrame:
+    df = pd.DataFrame(payload["schedule"])
     df["scheduled_arrival"] = pd.to_datetime(df["scheduled_arrival"])
     return df
 
+def fetch_train_schedule(train_number: int) -> pd.DataFrame:
+    with span("fetch_schedule"):
+        payload = _provider.train_schedule(train_number)
+    return _schedule_frame(payload)
+
+def fetch_train_bundle(train_number: int, after_minutes: float) -> tuple:
+    """
+    A train's schedule and the StationData of all its stops in one request,
+    station forecasts trimmed to [first arrival, last arrival +
+    after_minutes]. Returns (train_schedule, [station payloads],
+    (start_ns, end_ns) or None); BundleUnavailable when the provider has
+    no bulk path.
+    """
+    with span("fetch_bundle"):
+        payload = _provider.train_bundle(train_number, after_minutes)
+    window = payload.get("window")
+    if window:
+        window = (pd.Timestamp(window["from"]).value, pd.Timestamp(window["to"]).value)
+    return _schedule_frame(payload["train"]), payload.get("stations") or [], window
+
 def fetch_station_data(station_code: str) -> dict:
-    url = f"https://railway-rescheduling-automation-system.onrender.com/api/stations/{station_code}"
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-    return r.json()
+    with span("fetch_station"):
+        return _provider.station(station_code)
 
 def _classify_weather(code: int) -> str:
     if code in [0, 1]: return "Clear"
@@ -35,139 +65,413 @@ def _classify_weather(code: int) -> str:
     if code in [56, 57]: return "Mist"
     return "Clear"
 
-def get_weather_15min_for_station(lat: float, lon: float, time) -> dict | None:
+def _to_ist(time) -> pd.Timestamp:
+    ts = pd.to_datetime(time)
+    if ts.tzinfo is None:
+        return ts.tz_localize("Asia/Kolkata")
+    return ts.tz_convert("Asia/Kolkata")
+
+def _nearest_index(sorted_epochs: np.ndarray, target) -> np.ndarray:
+    """Index of the closest entry in `sorted_epochs` (ties go to the earlier one)."""
+    target = np.asarray(target, dtype=np.int64)
+    j = np.searchsorted(sorted_epochs, target, side="left")
+    j = np.clip(j, 1, max(len(sorted_epochs) - 1, 1))
+    left = sorted_epochs[j - 1]
+    right = sorted_epochs[np.minimum(j, len(sorted_epochs) - 1)]
+    return np.where(target - left <= right - target, j - 1, j)
+
+WEATHER_BATCH_SIZE = 50          # locations per multi-location request
+MAX_PLAUSIBLE_DELAY_MINUTES = float(os.environ.get("MAX_PLAUSIBLE_DELAY_MINUTES", "720"))
+
+def _fetch_minutely_15(lat: float, lon: float) -> tuple[np.ndarray, dict]:
+    with span("fetch_weather"):
+        return _provider.weather(lat, lon)
+
+def fetch_weather_batch(coords: list, start, end) -> list:
+    """
+    Fetch minutely_15 forecasts for several (lat, lon) pairs in one request,
+    limited to the [start, end] window. Returns (epoch_ns, values) per
+    coordinate, in the same order.
+    """
+    with span("fetch_weather"):
+        return _provider.weather_batch(coords, start, end)
+
+def simulation_time_window(train_schedule: pd.DataFrame, total_hours: float) -> tuple:
+    """Time span the shifted schedule can reach, incl. the maximum plausible delay."""
+    arrivals = train_schedule["scheduled_arrival"].dropna()
+    start = _to_ist(arrivals.min())
+    end = _to_ist(arrivals.max()) + timedelta(hours=total_hours, minutes=MAX_PLAUSIBLE_DELAY_MINUTES)
+    return start, end
+
+class WeatherForecastStore:
+    """
+    Decoded minutely_15 forecasts keyed by station coordinates.
+
+    Each location is fetched once per `ttl` seconds and kept as sorted
+    epoch/value arrays, so picking the 15-min slot nearest to a time is a
+    binary search instead of a fresh request + DataFrame per lookup.
+
+    `prefetch` fills many locations at once with time-windowed batch
+    requests; a lookup that falls outside a windowed entry refetches that
+    location's full horizon, so results never depend on the window.
+    """
+
+    def __init__(self, ttl: float = 900.0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(lat: float, lon: float) -> tuple:
+        return round(float(lat), 4), round(float(lon), 4)
+
+    def _valid(self, entry, now: float, target_ns=None) -> bool:
+        if entry is None or now - entry[0] >= self.ttl:
+            return False
+        fetched_at, (epochs, _), windowed = entry
+        if not windowed or target_ns is None:
+            return True
+        return len(epochs) > 0 and epochs[0] <= target_ns <= epochs[-1]
+
+    def series(self, lat: float, lon: float, target_ns=None) -> tuple[np.ndarray, dict] | None:
+        key = self._key(lat, lon)
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if self._valid(entry, now, target_ns):
+            count("cache_lookups", cache="weather", result="hit")
+            return entry[1]
+        count("cache_lookups", cache="weather", result="miss")
+        try:
+            series = _fetch_minutely_15(lat, lon)
+        except Exception:
+            return None
+        with self._lock:
+            self._entries[key] = (now, series, False)
+        return series
+
+    def missing(self, coords) -> list:
+        """Keys among `coords` that have no fresh entry."""
+        now = monotonic()
+        with self._lock:
+            keys = dict.fromkeys(self._key(lat, lon) for lat, lon in coords)
+            return [key for key in keys if not self._valid(self._entries.get(key), now)]
+
+    def load_window(self, coords: list, start, end) -> None:
+        """Batch-fetch `coords` for the [start, end] window in one request."""
+        now = monotonic()
+        fetched = fetch_weather_batch(coords, start, end)
+        with self._lock:
+            for (lat, lon), series in zip(coords, fetched):
+                self._entries[self._key(lat, lon)] = (now, series, True)
+
+    def nearest(self, lat: float, lon: float, time) -> dict | None:
+        target_ns = _to_ist(time).value
+        series = self.series(lat, lon, target_ns)
+        if series is None or len(series[0]) == 0:
+            return None
+        epochs, values = series
+        idx = int(_nearest_index(epochs, target_ns))
+
+        row = {"time": pd.Timestamp(epochs[idx], tz="UTC").tz_convert("Asia/Kolkata")}
+        for name in WEATHER_FIELDS[:-1]:
+            row[name] = values[name][idx]
+        row["weather_main"] = _classify_weather(values["weather_code"][idx])
+        row["sea_level"] = row["pressure"]
+        return row
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_weather_store = WeatherForecastStore()
+
+def get_weather_15min_for_station(lat: float, lon: float, time,
+                                  store: WeatherForecastStore | None = None) -> dict | None:
     try:
-        scheduled_time = pd.to_datetime(time)
-        if scheduled_time.tzinfo is None:
-            scheduled_time = scheduled_time.tz_localize("Asia/Kolkata")
-        else:
-            scheduled_time = scheduled_time.tz_convert("Asia/Kolkata")
-
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": lat, "longitude": lon,
-            "minutely_15": [
-                "temperature_2m","apparent_temperature","relative_humidity_2m",
-                "pressure_msl","windspeed_10m","winddirection_10m",
-                "visibility","cloudcover","dew_point_2m","weathercode"
-            ],
-            "timezone": "auto"
+        return (store or _weather_store).nearest(lat, lon, time)
+    except Exception:
+        return None
+
+class StationContext:
+    """
+    A station's `forecasts`, parsed once into sorted parallel arrays.
+
+    `window` = (start_ns, end_ns) of the times `nearest` answers exactly,
+    or None for all times. The bulk loader trims forecasts to a window
+    but keeps the closest one on either side of it, so the exact range
+    reaches out to those two.
+    """
+
+    def __init__(self, epochs: np.ndarray, tracks_on_route: np.ndarray, trains_nearby: np.ndarray,
+                 window: tuple | None = None):
+        self.epochs = epochs
+        self.tracks_on_route = tracks_on_route
+        self.trains_nearby = trains_nearby
+        self.window = window
+
+    @classmethod
+    def from_station_data(cls, station_data: dict, window: tuple | None = None) -> "StationContext":
+        forecasts = station_data.get("forecasts", [])
+        if not forecasts:
+            # trimmed to nothing means there were no forecasts at all
+            empty = np.empty(0)
+            return cls(empty.astype(np.int64), empty, empty)
+        epochs = pd.to_datetime([f.get("timestamp") for f in forecasts], utc=True).as_unit("ns").asi8
+        order = np.argsort(epochs, kind="stable")
+        tracks = np.array([f.get("tracks_on_route", np.nan) for f in forecasts], dtype=float)
+        trains = np.array([f.get("trains_nearby", np.nan) for f in forecasts], dtype=float)
+        epochs = epochs[order]
+        if window is not None:
+            # nothing before (after) the window at all: exact on that side forever
+            lo = int(epochs[0]) if epochs[0] < window[0] else np.iinfo(np.int64).min
+            hi = int(epochs[-1]) if epochs[-1] > window[1] else np.iinfo(np.int64).max
+            window = (lo, hi)
+        return cls(epochs, tracks[order], trains[order], window)
+
+    def slots(self, target_ns) -> np.ndarray:
+        """Index of the entry nearest to each time in `target_ns` (ns); 0 without forecasts."""
+        target_ns = np.asarray(target_ns, dtype=np.int64)
+        if len(self.epochs) == 0:
+            return np.zeros(target_ns.shape, dtype=np.int64)
+        return _nearest_index(self.epochs, target_ns)
+
+    def at(self, c: np.ndarray) -> tuple:
+        """
+        (tracks_on_route, trains_nearby) of entries `c`, truncated like the
+        int() of `nearest`; 1 and 0 when the station has no forecasts.
+        """
+        if len(self.epochs) == 0:
+            return np.ones(len(c)), np.zeros(len(c))
+        tracks, trains = self.tracks_on_route[c], self.trains_nearby[c]
+        if np.isnan(tracks).any() or np.isnan(trains).any():
+            raise ValueError("cannot convert float NaN to integer")
+        return np.trunc(tracks), np.trunc(trains)
+
+    def covers(self, target_ns) -> np.ndarray:
+        """Per time in `target_ns` (ns), whether `nearest` is exact there."""
+        target_ns = np.asarray(target_ns)
+        if self.window is None:
+            return np.ones(target_ns.shape, dtype=bool)
+        return (self.window[0] <= target_ns) & (target_ns <= self.window[1])
+
+    def nearest(self, target_time) -> dict:
+        if len(self.epochs) == 0:
+            return {"tracks_on_route": 1, "trains_nearby": 0}
+        idx = int(_nearest_index(self.epochs, _to_ist(target_time).value))
+        return {
+            "tracks_on_route": int(self.tracks_on_route[idx]),
+            "trains_nearby": int(self.trains_nearby[idx])
         }
-        responses = _openmeteo.weather_api(url, params=params)
-        response = responses[0]
-        m15 = response.Minutely15()
-
-        df = pd.DataFrame({
-            "time": pd.to_datetime(m15.Time(), unit="s", utc=True),
-            "temp": m15.Variables(0).ValuesAsNumpy(),
-            "feels_like": m15.Variables(1).ValuesAsNumpy(),
-            "humidity": m15.Variables(2).ValuesAsNumpy(),
-            "pressure": m15.Variables(3).ValuesAsNumpy(),
-            "wind_speed": m15.Variables(4).ValuesAsNumpy(),
-            "wind_deg": m15.Variables(5).ValuesAsNumpy(),
-            "visibility": m15.Variables(6).ValuesAsNumpy(),
-            "clouds": m15.Variables(7).ValuesAsNumpy(),
-            "dew_point": m15.Variables(8).ValuesAsNumpy(),
-            "weather_code": m15.Variables(9).ValuesAsNumpy(),
-        })
 
-        if df["time"].dt.tz is None:
-            df["time"] = df["time"].dt.tz_localize("UTC").dt.tz_convert("Asia/Kolkata")
-        else:
-            df["time"] = df["time"].dt.tz_convert("Asia/Kolkata")
+class StationContextStore:
+    """
+    TTL + LRU cache of StationContext by station code, so each station is
+    requested from the Node API once per simulation instead of once per
+    variant. A lookup with `target_ns` outside a trimmed context's window
+    refetches the complete station document.
+    """
 
-        row = df.iloc[(df["time"] - scheduled_time).abs().argsort()[:1]].copy()
-        row["weather_main"] = row["weather_code"].apply(_classify_weather)
-        row.drop(columns=["weather_code"], inplace=True)
-        row["sea_level"] = row["pressure"]
+    def __init__(self, ttl: float = 300.0, max_entries: int = 512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, station_code: str, target_ns=None) -> StationContext:
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(station_code)
+            if (entry is not None and now - entry[0] < self.ttl
+                    and (target_ns is None or entry[1].covers(target_ns).all())):
+                self._entries.move_to_end(station_code)
+                count("cache_lookups", cache="station", result="hit")
+                return entry[1]
+        count("cache_lookups", cache="station", result="miss")
+        context = StationContext.from_station_data(fetch_station_data(station_code))
+        self.put(station_code, context, now)
+        return context
+
+    def put(self, station_code: str, context: StationContext, fetched_at: float | None = None):
+        with self._lock:
+            self._entries[station_code] = (monotonic() if fetched_at is None else fetched_at, context)
+            self._entries.move_to_end(station_code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, station_code: str, context: StationContext) -> bool:
+        """Replace a cached entry in place (LRU order unchanged); False if the station is not cached."""
+        with self._lock:
+            if station_code not in self._entries:
+                return False
+            self._entries[station_code] = (monotonic(), context)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_station_store = StationContextStore()
+
+def get_tracks_trains_nearby(station_data, target_time) -> dict:
+    if not isinstance(station_data, StationContext):
+        station_data = StationContext.from_station_data(station_data)
+    return station_data.nearest(target_time)
+
+def prefetch_simulation_inputs(train_schedule: pd.DataFrame,
+                               weather_store: WeatherForecastStore | None = None,
+                               station_store: StationContextStore | None = None,
+                               max_workers: int = PREFETCH_WORKERS,
+                               window: tuple | None = None) -> None:
+    """
+    Warm the stores for every distinct station code and coordinate of the
+    schedule concurrently, so the simulation loop itself only reads memory
+    and total latency is roughly the slowest fetch instead of their sum.
+
+    With a (start, end) `window`, weather is requested for all locations
+    in a few multi-location calls bounded to that window; locations a
+    batch fails for fall back to single full-horizon requests. Failures
+    are left for the simulation to surface.
+    """
+    weather_store = weather_store or _weather_store
+    station_store = station_store or _station_store
+    stops = train_schedule[train_schedule["scheduled_arrival"].notna()]
+    codes = stops["station_code"].dropna().unique()
+    coords = list(stops[["lat", "lon"]].dropna().drop_duplicates().itertuples(index=False, name=None))
+
+    def wait(futures):
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        station_futures = [pool.submit(propagate(station_store.get), code) for code in codes]
+        if window is not None:
+            missing = weather_store.missing(coords)
+            wait([pool.submit(propagate(weather_store.load_window), missing[i:i + WEATHER_BATCH_SIZE], *window)
+                  for i in range(0, len(missing), WEATHER_BATCH_SIZE)])
+            coords = weather_store.missing(coords)
+        wait([pool.submit(propagate(weather_store.series), lat, lon) for lat, lon in coords])
+        wait(station_futures)
 
-        return row.iloc[0].to_dict()
+class SimulationCancelled(Exception):
+    """Raised inside a simulation once its cancel event is set."""
+
+def _check_cancel(cancel_event: threading.Event | None):
+    if cancel_event is not None and cancel_event.is_set():
+        raise SimulationCancelled()
+
+# --- Model features
+# taken from the schedule row vs. those that depend on the forecast time
+_SCHEDULE_FEATURES = ["lat", "lon", "altitude", "day_of_week", "day_of_journey"]
+_FORECAST_FEATURES = ["temp", "feels_like", "humidity", "pressure", "wind_speed", "wind_deg",
+                      "visibility", "clouds", "dew_point", "weather_main", "sea_level",
+                      "tracks_on_route", "trains_nearby"]
+
+def _weather_slots(weather_store: WeatherForecastStore, lat: float, lon: float,
+                   targets: np.ndarray) -> tuple | None:
+    """(forecast values, nearest 15-min slot per target time in ns) at a location; None without weather."""
+    try:
+        # the same refetch rule as one `nearest` per target: a windowed
+        # entry is replaced once any target falls outside it
+        series = weather_store.series(lat, lon, int(targets.min()))
+        if series is not None and len(targets) > 1:
+            series = weather_store.series(lat, lon, int(targets.max())) or series
     except Exception:
+        series = None
+    if series is None or len(series[0]) == 0:
         return None
+    return series[1], _nearest_index(series[0], targets)
 
-def get_tracks_trains_nearby(station_data: dict, target_time) -> dict:
-    forecasts = station_data.get("forecasts", [])
-    if not forecasts:
-        return {"tracks_on_route": 1, "trains_nearby": 0}
-    df_f = pd.DataFrame(forecasts)
-    df_f["timestamp"] = pd.to_datetime(df_f["timestamp"], utc=True).dt.tz_convert("Asia/Kolkata")
-    closest = df_f.iloc[(df_f["timestamp"] - target_time).abs().argsort()[:1]]
+def _forecast_features(weather: dict, w: np.ndarray, tracks_on_route: np.ndarray,
+                       trains_nearby: np.ndarray, weather_main=None) -> dict:
+    """
+    The _FORECAST_FEATURES columns for weather slots `w` and the station
+    context values of the same rows. `weather_main` replaces the classified
+    weather codes (ScheduleArrays passes them already encoded).
+    """
+    if weather_main is None:
+        weather_main = [_classify_weather(code) for code in weather['weather_code'][w]]
     return {
-        "tracks_on_route": int(closest["tracks_on_route"].values[0]),
-        "trains_nearby": int(closest["trains_nearby"].values[0])
+        'temp': weather['temp'][w] + 273.15,             # float32, like the decoded forecast
+        'feels_like': weather['feels_like'][w] + 273.15,
+        'humidity': weather['humidity'][w],
+        'pressure': weather['pressure'][w],
+        'wind_speed': weather['wind_speed'][w],
+        'wind_deg': weather['wind_deg'][w],
+        'visibility': weather['visibility'][w],
+        'clouds': weather['clouds'][w],
+        'dew_point': weather['dew_point'][w] + 273.15,
+        'weather_main': weather_main,
+        'sea_level': weather['pressure'][w],
+        'tracks_on_route': tracks_on_route,
+        'trains_nearby': trains_nearby
     }
 
+def _feature_frame(row, weather: dict, w: np.ndarray, tracks_on_route: np.ndarray,
+                   trains_nearby: np.ndarray) -> pd.DataFrame:
+    """Unencoded feature rows of one stop: its schedule fields plus `_forecast_features`."""
+    columns = _forecast_features(weather, w, tracks_on_route, trains_nearby)
+    columns.update({name: [row[name]] * len(w) for name in _SCHEDULE_FEATURES})
+    return pd.DataFrame(columns)
+
+def _predict_rows(feature_rows: list, final_model, encoder: CategoricalEncoder) -> np.ndarray:
+    with span("feature_build"):
+        X = pd.DataFrame(feature_rows)
+
+    with span("encode"):
+        # Safe label encoding (unseen -> -1)
+        X = encoder.transform(X)
+
+        # Align with model
+        X = X.reindex(columns=final_model.feature_names_in_, fill_value=0)
+    with span("predict"):
+        return np.asarray(final_model.predict(X), dtype=float)
+
 def simulate_schedule_variant(shifted_schedule: pd.DataFrame,
                               original_schedule: pd.DataFrame,
                               final_model,
-                              le_dict) -> dict:
+                              le_dict,
+                              weather_store: WeatherForecastStore | None = None,
+                              station_store: StationContextStore | None = None,
+                              progress=None,
+                              cancel_event: threading.Event | None = None) -> dict:
+    """
+    `progress(stations_done, stations_total)` is called after every station;
+    setting `cancel_event` aborts with SimulationCancelled.
+    """
+    weather_store = weather_store or _weather_store
+    station_store = station_store or _station_store
+    encoder = CategoricalEncoder.coerce(le_dict)
     start_time_variant = pd.to_datetime(shifted_schedule["scheduled_arrival"].dropna().iloc[0])
+    stops = shifted_schedule[shifted_schedule["scheduled_arrival"].notna()]
 
     cumulative_delay = 0.0
     weather_records_sim = []
 
-    for i, row in shifted_schedule.iterrows():
-        if pd.isna(row["scheduled_arrival"]):
-            continue
-
-        # Shifted
-        sched_arr = pd.to_datetime(row["scheduled_arrival"])
-        if sched_arr.tzinfo is None:
-            sched_arr = sched_arr.tz_localize("Asia/Kolkata")
-        else:
-            sched_arr = sched_arr.tz_convert("Asia/Kolkata")
-
-        # Original
-        original_arr = pd.to_datetime(original_schedule.loc[i, "scheduled_arrival"])
-        if original_arr.tzinfo is None:
-            original_arr = original_arr.tz_localize("Asia/Kolkata")
-        else:
-            original_arr = original_arr.tz_convert("Asia/Kolkata")
+    for stations_done, (i, row) in enumerate(stops.iterrows()):
+        _check_cancel(cancel_event)
+        if progress is not None:
+            progress(stations_done, len(stops))
 
+        sched_arr = _to_ist(row["scheduled_arrival"])                      # shifted
+        original_arr = _to_ist(original_schedule.loc[i, "scheduled_arrival"])
         forecast_time = sched_arr + timedelta(minutes=cumulative_delay)
 
         # Weather + station context
-        station_info = fetch_station_data(row["station_code"])
-        weather = get_weather_15min_for_station(row["lat"], row["lon"], forecast_time)
-        if weather is None:
+        with span("feature_build"):
+            target = np.array([forecast_time.value])
+            station_info = station_store.get(row["station_code"], target[0])
+            found = _weather_slots(weather_store, row["lat"], row["lon"], target)
+            if found is not None:
+                features = _feature_frame(row, *found, *station_info.at(station_info.slots(target)))
+        if found is None:
             continue
-        weather.update(get_tracks_trains_nearby(station_info, forecast_time))
-
-        # Build feature row for model
-        import pandas as _pd
-        X_row = _pd.DataFrame([{
-            'temp': weather['temp'] + 273.15,
-            'feels_like': weather['feels_like'] + 273.15,
-            'humidity': weather['humidity'],
-            'pressure': weather['pressure'],
-            'wind_speed': weather['wind_speed'],
-            'wind_deg': weather['wind_deg'],
-            'visibility': weather['visibility'],
-            'clouds': weather['clouds'],
-            'dew_point': weather['dew_point'] + 273.15,
-            'weather_main': weather['weather_main'],
-            'lat': row['lat'],
-            'lon': row['lon'],
-            'altitude': row['altitude'],
-            'sea_level': weather['sea_level'],
-            'day_of_week': row['day_of_week'],
-            'day_of_journey': row['day_of_journey'],
-            'tracks_on_route': weather['tracks_on_route'],
-            'trains_nearby': weather['trains_nearby']
-        }])
-
-        # Safe label encoding
-        for col in X_row.columns:
-            if col in le_dict:
-                X_row[col] = X_row[col].astype(str).apply(
-                    lambda x: le_dict[col].transform([x])[0] if x in le_dict[col].classes_ else -1
-                )
-
-        # Align with model
-        X_row = X_row.reindex(columns=final_model.feature_names_in_, fill_value=0)
 
         # Predict & accumulate
-        delay_pred = float(final_model.predict(X_row)[0])
+        delay_pred = float(_predict_rows(features, final_model, encoder)[0])
         cumulative_delay += delay_pred
         actual_arr = sched_arr + timedelta(minutes=cumulative_delay)
 
@@ -184,39 +488,773 @@ def simulate_schedule_variant(shifted_schedule: pd.DataFrame,
             "start_time_variant": start_time_variant
         })
 
+    if progress is not None:
+        progress(len(stops), len(stops))
     sim_df = pd.DataFrame(weather_records_sim)
-    total_delay_sim = float(sim_df["cumulative_delay"].iloc[-1]) if not sim_df.empty else None
+    return VariantResult(lambda: sim_df,
+                         start_time_variant=start_time_variant,
+                         total_delay=float(sim_df["cumulative_delay"].iloc[-1]) if not sim_df.empty else None,
+                         stations_evaluated=len(weather_records_sim),
+                         abandoned=False)
 
-    return {
-        "start_time_variant": start_time_variant,
-        "total_delay": total_delay_sim,
-        "detail_df": sim_df
-    }
+class VariantResult(dict):
+    """
+    One simulated variant: `start_time_variant`, `total_delay` (None when
+    abandoned or nothing could be predicted), `stations_evaluated` and
+    `abandoned`. The per-station frame is built by `detail_df()` on first
+    call; the batched paths only keep per-stop delays until then.
+    """
 
-def simulate_all_variants(train_number: int, final_model, le_dict,
-                          interval_minutes: int = 15,
-                          total_hours: int = 4) -> dict:
+    def __init__(self, build_detail, **fields):
+        super().__init__(**fields)
+        self._build_detail = build_detail
+        self._detail = None
+
+    def detail_df(self) -> pd.DataFrame:
+        if self._detail is None:
+            self._detail = self._build_detail()
+        return self._detail
+
+def _shift_schedule(train_schedule: pd.DataFrame, shift_minutes: float) -> pd.DataFrame:
+    shifted_schedule = train_schedule.copy()
+    shifted_schedule["scheduled_arrival"] = shifted_schedule["scheduled_arrival"] + timedelta(minutes=shift_minutes)
+    return shifted_schedule
+
+class ScheduleArrays:
     """
-    Simulate all 15-min schedule variants over a 4-hour window and 
-    return the one with the least cumulative delay, plus summary of all.
+    A schedule's stops converted once for the numeric simulation core:
+    IST arrival epochs (int64 ns) and a float matrix of the per-stop
+    constant features (lat, lon, altitude, day_of_week, day_of_journey),
+    already encoded and in `feature_names_in_` order. Columns the old
+    per-row frames never set stay 0, like `reindex(fill_value=0)`.
     """
-    train_schedule = fetch_train_schedule(train_number)
+
+    def __init__(self, train_schedule: pd.DataFrame, final_model, encoder: CategoricalEncoder):
+        self.stops = train_schedule[train_schedule["scheduled_arrival"].notna()]
+        self.encoder = encoder
+        self.columns = {name: j for j, name in enumerate(final_model.feature_names_in_)}
+        self.sched_ns = np.array([_to_ist(t).value for t in self.stops["scheduled_arrival"]], dtype=np.int64)
+        self.codes = self.stops["station_code"].tolist()
+        self.coords = list(zip(self.stops["lat"], self.stops["lon"]))
+        self.static = np.zeros((len(self.stops), len(self.columns)))
+        for name in _SCHEDULE_FEATURES:
+            if name in self.columns:
+                self.static[:, self.columns[name]] = self._column(name, self.stops[name].tolist())
+        self._weather_main = {}
+
+    def _column(self, name: str, values: list) -> np.ndarray:
+        if name in self.encoder:
+            return self.encoder.encode(name, values).astype(float)
+        return np.array([np.nan if pd.isna(v) else float(v) for v in values])
+
+    def weather_main(self, codes: np.ndarray) -> np.ndarray:
+        """Encoded `_classify_weather` of each weather code (memoized per code)."""
+        out = np.empty(len(codes))
+        for j, code in enumerate(codes.tolist()):
+            encoded = self._weather_main.get(code)
+            if encoded is None:
+                encoded = self._weather_main[code] = float(self._column("weather_main", [_classify_weather(code)])[0])
+            out[j] = encoded
+        return out
+
+    def features(self, k: int, targets: np.ndarray, context: StationContext,
+                 weather_store: WeatherForecastStore, out: np.ndarray) -> bool:
+        """
+        Write stop `k`'s feature rows for forecast times `targets` (ns) into
+        `out[:len(targets)]`; False when the stop has no weather.
+        """
+        found = _weather_slots(weather_store, *self.coords[k], targets)
+        if found is None:
+            return False
+        weather, w = found
+        columns = _forecast_features(weather, w, *context.at(context.slots(targets)),
+                                     weather_main=self.weather_main(weather["weather_code"][w]))
+        rows = out[:len(targets)]
+        rows[:] = self.static[k]
+        for name, values in columns.items():
+            if name in self.columns:
+                rows[:, self.columns[name]] = values
+        return True
+
+def _predict_matrix(final_model, X: np.ndarray) -> np.ndarray:
+    """Predict an already encoded feature matrix in `feature_names_in_` order."""
+    with span("predict"):
+        if isinstance(final_model, FlatTreeEnsemble):
+            return final_model.predict(X)
+        return np.asarray(final_model.predict(pd.DataFrame(X, columns=final_model.feature_names_in_)),
+                          dtype=float)
+
+def _variant_detail(train_schedule: pd.DataFrame, shift_minutes: float, delays: np.ndarray) -> pd.DataFrame:
+    """Replay one variant's per-stop delays (NaN = skipped) into the usual detail frame."""
+    stops = train_schedule[train_schedule["scheduled_arrival"].notna()]
+    shifted = _shift_schedule(train_schedule, shift_minutes)["scheduled_arrival"]
+    start_time_variant = pd.to_datetime(shifted.dropna().iloc[0])
+    cumulative, records = 0.0, []
+    for (i, row), delay_pred in zip(stops.iterrows(), delays):
+        if np.isnan(delay_pred):
+            continue
+        sched_arr = _to_ist(shifted[i])
+        forecast_time = sched_arr + timedelta(minutes=cumulative)
+        cumulative += float(delay_pred)
+        records.append({
+            "station_index": int(i),
+            "station_code": row["station_code"],
+            "station_name": row["station_name"],
+            "original_scheduled_arrival": _to_ist(row["scheduled_arrival"]),
+            "scheduled_arrival_shifted": sched_arr,
+            "forecast_time": forecast_time,
+            "predicted_delay": float(delay_pred),
+            "cumulative_delay": cumulative,
+            "actual_arrival_predicted": sched_arr + timedelta(minutes=cumulative),
+            "start_time_variant": start_time_variant
+        })
+    return pd.DataFrame(records)
+
+def _advance_variants(sched_ns: np.ndarray,
+                      shift_minutes: list,
+                      step,
+                      progress=None,
+                      cancel_event: threading.Event | None = None,
+                      prune_above: float | None = None,
+                      station_floors: np.ndarray | None = None,
+                      resume: tuple | None = None) -> dict:
+    """
+    Advance all variants stop by stop: the loop shared by the lockstep
+    and surface simulations. `step(k, live, targets)` returns the delays
+    of variants `live` at stop `k` for forecast times `targets` (ns); NaN,
+    or None for all of them, means the stop is skipped.
+
+    Returns (n_stops, n_variants) arrays `forecast` (ns) and `delays`
+    (NaN = skipped) plus the final `cumulative` and `abandoned_at`
+    (-1 = completed). With `prune_above`, a variant is abandoned as soon
+    as its cumulative delay plus the remaining `station_floors` exceeds
+    it. `resume=(first_stop, prior)` copies each variant's stops before
+    `first_stop[v]` from the `prior` result instead of stepping them.
+    """
+    n_variants, n_stops = len(shift_minutes), len(sched_ns)
+    offsets = np.array([_offset_ns(m) for m in shift_minutes], dtype=np.int64)
+    cumulative = np.zeros(n_variants)
+    forecast = np.zeros((n_stops, n_variants), dtype=np.int64)
+    delays = np.full((n_stops, n_variants), np.nan)
+    abandoned_at = np.full(n_variants, -1)
+    first_stop = np.zeros(n_variants, dtype=np.int64) if resume is None else resume[0]
+    if prune_above is not None:
+        floors = np.zeros(n_stops) if station_floors is None else np.asarray(station_floors, dtype=float)
+        # remaining[k] = least delay stops k.. can still add
+        remaining = np.append(np.cumsum(floors[::-1])[::-1], 0.0)
+
+    def report(stations_done):
+        if progress is not None:
+            for v in range(n_variants):
+                progress(v, stations_done, n_stops)
+
+    for k in range(n_stops):
+        _check_cancel(cancel_event)
+        report(k)
+        if resume is not None:
+            kept = np.flatnonzero(first_stop > k)
+            forecast[k, kept] = resume[1]["forecast"][k, kept]
+            delays[k, kept] = resume[1]["delays"][k, kept]
+            recorded = kept[~np.isnan(delays[k, kept])]
+            cumulative[recorded] += delays[k, recorded]
+        if prune_above is not None:
+            abandoned_at[(abandoned_at < 0) & (cumulative + remaining[k] > prune_above)] = k
+        live = np.flatnonzero((abandoned_at < 0) & (first_stop <= k))
+        if len(live) == 0:
+            continue
+
+        forecast[k, live] = sched_ns[k] + offsets[live] + np.array(
+            [_offset_ns(c) for c in cumulative[live]], dtype=np.int64)
+        result = step(k, live, forecast[k, live])
+        if result is None:
+            continue
+        recorded = ~np.isnan(result)
+        delays[k, live[recorded]] = result[recorded]
+        cumulative[live[recorded]] += result[recorded]
+
+    report(n_stops)
+    return {"forecast": forecast, "delays": delays, "cumulative": cumulative, "abandoned_at": abandoned_at}
+
+def _variant_results(train_schedule: pd.DataFrame, shift_minutes: list, scan: dict) -> list:
+    """VariantResults of an `_advance_variants` run; details are replayed from the per-stop delays."""
+    first_arrival = pd.to_datetime(train_schedule["scheduled_arrival"].dropna().iloc[0])
+    n_stops = len(scan["delays"])
+    results = []
+    for v, m in enumerate(shift_minutes):
+        delays = scan["delays"][:, v]
+        abandoned = scan["abandoned_at"][v] >= 0
+        results.append(VariantResult(
+            partial(_variant_detail, train_schedule, m, delays.copy()),
+            start_time_variant=pd.to_datetime(first_arrival + timedelta(minutes=m)),
+            total_delay=None if abandoned or np.isnan(delays).all() else float(scan["cumulative"][v]),
+            stations_evaluated=int(scan["abandoned_at"][v]) if abandoned else n_stops,
+            abandoned=bool(abandoned)
+        ))
+    return results
+
+def simulate_variants_lockstep(train_schedule: pd.DataFrame,
+                               shift_minutes: list,
+                               final_model,
+                               le_dict,
+                               weather_store: WeatherForecastStore | None = None,
+                               station_store: StationContextStore | None = None,
+                               progress=None,
+                               cancel_event: threading.Event | None = None,
+                               prune_above: float | None = None,
+                               station_floors: np.ndarray | None = None) -> list:
+    """
+    Simulate several shifted variants of `train_schedule` together.
+
+    Variants are independent of each other; only the cumulative delay is
+    sequential along stations. So all variants advance one station at a
+    time and each station costs a single `predict` over one row per
+    variant. The schedule is converted once into ScheduleArrays; per
+    station, feature rows are written into one preallocated matrix and
+    delays into a (stops, variants) array, so the loop builds no
+    DataFrames or Timestamps. A result's `detail_df()` is replayed from
+    those delays when first called. Results are identical to calling
+    `simulate_schedule_variant` on each shifted schedule.
+
+    `progress(variant_index, stations_done, stations_total)` is called for
+    every variant after each station.
+
+    With `prune_above`, a variant is abandoned (total_delay None,
+    abandoned True) as soon as its cumulative delay plus the remaining
+    `station_floors` (per-stop lower bounds, zeros if omitted) exceeds it.
+    """
+    weather_store = weather_store or _weather_store
+    station_store = station_store or _station_store
+    encoder = CategoricalEncoder.coerce(le_dict)
+    arrays = ScheduleArrays(train_schedule, final_model, encoder)
+    X = np.zeros((len(shift_minutes), len(arrays.columns)))
+
+    def step(k, live, targets):
+        with span("feature_build"):
+            context = station_store.get(arrays.codes[k], targets)
+            found = arrays.features(k, targets, context, weather_store, X)
+        return _predict_matrix(final_model, X[:len(live)]) if found else None
+
+    scan = _advance_variants(arrays.sched_ns, shift_minutes, step, progress, cancel_event,
+                             prune_above, station_floors)
+    return _variant_results(train_schedule, shift_minutes, scan)
+
+# --- Delay response surfaces
+_ONE_US = timedelta(microseconds=1)
+
+def _offset_ns(minutes) -> int:
+    """`timedelta(minutes=...)` in ns, with the same microsecond rounding."""
+    return (timedelta(minutes=minutes) // _ONE_US) * 1000
+
+def _slot_boundaries(epochs: np.ndarray, start: int, end: int) -> np.ndarray:
+    """First instants in [start, end] at which `_nearest_index` moves to the next slot."""
+    if len(epochs) < 2:
+        return np.empty(0, dtype=np.int64)
+    first_later = (epochs[:-1] + epochs[1:]) // 2 + 1
+    return first_later[(first_later > start) & (first_later <= end)]
+
+def _matching_slots(new_epochs, new_inputs, old_epochs, old_inputs) -> tuple:
+    """Positions (new, old) of slots present in both with identical inputs."""
+    if len(new_epochs) == 0 and len(old_epochs) == 0:
+        same = np.array_equal(new_inputs, old_inputs)
+        return (np.array([0]), np.array([0])) if same else (np.empty(0, int), np.empty(0, int))
+    pos = np.searchsorted(old_epochs, new_epochs)
+    found = pos < len(old_epochs)
+    found[found] = old_epochs[pos[found]] == new_epochs[found]
+    new_idx, old_idx = np.flatnonzero(found), pos[found]
+    same = (new_inputs[new_idx] == old_inputs[old_idx]).all(axis=1)
+    return new_idx[same], old_idx[same]
+
+class DelaySurface:
+    """
+    Per-stop lookup tables of predicted delay for one train schedule.
+
+    A stop's features vary with forecast time only through the nearest
+    15-min weather slot and the nearest station `forecasts` entry, so the
+    model is evaluated once per reachable (weather slot, context slot)
+    pair. The pairs any of `shift_minutes` can reach within
+    MAX_PLAUSIBLE_DELAY_MINUTES are predicted in one batch up front;
+    others are predicted on first use (all of them when `shift_minutes`
+    is None, for searches that visit only some offsets). `simulate` then advances all
+    variants stop by stop with array lookups, using the same rounding and
+    nearest-slot rules as `simulate_variants_lockstep`, so results are
+    identical. Targets outside a stop's loaded forecast take the regular
+    per-row path.
+
+    The tables snapshot the stores at construction; build a new surface
+    when forecasts are refreshed. Passing the old one as `previous`
+    carries over every cell whose weather and context inputs are
+    unchanged, so only those are predicted again.
+    """
+
+    def __init__(self, train_schedule: pd.DataFrame,
+                 shift_minutes: list | None,
+                 final_model,
+                 le_dict,
+                 weather_store: WeatherForecastStore | None = None,
+                 station_store: StationContextStore | None = None,
+                 previous: "DelaySurface | None" = None):
+        self.train_schedule = train_schedule
+        self.final_model = final_model
+        self.encoder = CategoricalEncoder.coerce(le_dict)
+        self.weather_store = weather_store or _weather_store
+        self.station_store = station_store or _station_store
+        self.stops = train_schedule[train_schedule["scheduled_arrival"].notna()]
+        self.rows_predicted = 0
+        self._stops = [self._load_stop(row) for _, row in self.stops.iterrows()]
+        if previous is not None:
+            self._reuse(previous)
+        if shift_minutes is not None:
+            self._prefill(shift_minutes)
+
+    def _prefill(self, shift_minutes: list):
+        """Predict every cell `shift_minutes` can reach, in one batch."""
+        offsets = [_offset_ns(m) for m in shift_minutes] or [0]
+        horizon = _offset_ns(MAX_PLAUSIBLE_DELAY_MINUTES)
+        pending = []
+        for k, stop in enumerate(self._stops):
+            if stop["table"] is None:
+                continue
+            start = stop["sched_ns"] + min(offsets)
+            end = stop["sched_ns"] + max(offsets) + horizon
+            targets = np.concatenate([[start],
+                                      _slot_boundaries(stop["weather_epochs"], start, end),
+                                      _slot_boundaries(stop["context"].epochs, start, end)])
+            pending.append((k, *self._slots(stop, targets.astype(np.int64))))
+        self._fill(pending)
+
+    def _load_stop(self, row) -> dict:
+        stop = {"row": row, "sched_ns": _to_ist(row["scheduled_arrival"]).value, "table": None}
+        context = self.station_store.get(row["station_code"])
+        stop["context"] = context
+        try:
+            series = self.weather_store.series(row["lat"], row["lon"])
+        except Exception:
+            series = None
+        if series is None or len(series[0]) == 0:
+            return stop
+        if np.isnan(context.tracks_on_route).any() or np.isnan(context.trains_nearby).any():
+            return stop
+        stop["weather_epochs"], stop["weather"] = series
+        # time-varying model inputs per slot, used to tell whether a cell is still valid
+        stop["weather_inputs"] = np.column_stack([series[1][name] for name in WEATHER_FIELDS]).astype(float)
+        if len(context.epochs):
+            stop["context_inputs"] = np.column_stack([context.tracks_on_route, context.trains_nearby])
+        else:
+            stop["context_inputs"] = np.array([[1.0, 0.0]])
+        stop["table"] = np.full((len(series[0]), max(len(context.epochs), 1)), np.nan)
+        return stop
+
+    def _reuse(self, previous: "DelaySurface"):
+        if len(previous._stops) != len(self._stops):
+            return
+        for stop, old in zip(self._stops, previous._stops):
+            if stop["table"] is None or old["table"] is None or not stop["row"].equals(old["row"]):
+                continue
+            w_new, w_old = _matching_slots(stop["weather_epochs"], stop["weather_inputs"],
+                                           old["weather_epochs"], old["weather_inputs"])
+            c_new, c_old = _matching_slots(stop["context"].epochs, stop["context_inputs"],
+                                           old["context"].epochs, old["context_inputs"])
+            if len(w_new) and len(c_new):
+                stop["table"][np.ix_(w_new, c_new)] = old["table"][np.ix_(w_old, c_old)]
+
+    @staticmethod
+    def _slots(stop: dict, targets: np.ndarray) -> tuple:
+        return _nearest_index(stop["weather_epochs"], targets), stop["context"].slots(targets)
+
+    def _fill(self, pending: list):
+        """Predict the unknown (weather slot, context slot) pairs of [(stop, w, c), ...]."""
+        frames, cells = [], []
+        for k, w, c in pending:
+            stop = self._stops[k]
+            unknown = np.isnan(stop["table"][w, c])
+            if not unknown.any():
+                continue
+            w, c = np.unique(np.stack([w[unknown], c[unknown]]), axis=1)
+            with span("feature_build"):
+                frames.append(_feature_frame(stop["row"], stop["weather"], w, *stop["context"].at(c)))
+            cells.append((stop["table"], w, c))
+        if not frames:
+            return
+        delays = _predict_rows(pd.concat(frames, ignore_index=True), self.final_model, self.encoder)
+        self.rows_predicted += len(delays)
+        start = 0
+        for table, w, c in cells:
+            table[w, c] = delays[start:start + len(w)]
+            start += len(w)
+
+    def _predict_fallback(self, stop: dict, forecast_ns: np.ndarray) -> np.ndarray:
+        """Regular per-row path; NaN where no weather is available."""
+        row = stop["row"]
+        delays = np.full(len(forecast_ns), np.nan)
+        found, slots, context_values = [], [], []
+        # one lookup per target, so each may refetch like the per-row path
+        for j in range(len(forecast_ns)):
+            target = forecast_ns[j:j + 1]
+            slot = _weather_slots(self.weather_store, row["lat"], row["lon"], target)
+            if slot is None:
+                continue
+            context = self.station_store.get(row["station_code"], int(target[0]))
+            found.append(j)
+            slots.append(slot)
+            context_values.append(context.at(context.slots(target)))
+        if found:
+            weather = {name: np.concatenate([values[name][w] for values, w in slots]) for name in WEATHER_FIELDS}
+            tracks, trains = (np.concatenate(v) for v in zip(*context_values))
+            X = _feature_frame(row, weather, np.arange(len(found)), tracks, trains)
+            delays[found] = _predict_rows(X, self.final_model, self.encoder)
+            self.rows_predicted += len(found)
+        return delays
+
+    def _scan(self, shift_minutes: list,
+              progress=None,
+              cancel_event: threading.Event | None = None,
+              prune_above: float | None = None,
+              station_floors: np.ndarray | None = None,
+              resume: tuple | None = None) -> dict:
+        """
+        `_advance_variants` over the tables. Adds `inputs`, the
+        (n_stops, n_variants) time-varying model inputs each delay was
+        looked up with (NaN where unknown).
+
+        `resume=(first_stop, prior)` copies each variant's stops before
+        `first_stop[v]` from the `prior` scan instead of looking them up
+        again.
+        """
+        n_variants, n_stops = len(shift_minutes), len(self._stops)
+        inputs = np.full((n_stops, n_variants, len(WEATHER_FIELDS) + 2), np.nan)
+
+        def step(k, live, targets):
+            stop = self._stops[k]
+            if stop["table"] is not None:
+                epochs = stop["weather_epochs"]
+                inside = (targets >= epochs[0]) & (targets <= epochs[-1]) & stop["context"].covers(targets)
+            else:
+                inside = np.zeros(len(live), dtype=bool)
+            delays = np.full(len(live), np.nan)
+            if inside.any():
+                w, c = self._slots(stop, targets[inside])
+                self._fill([(k, w, c)])
+                delays[inside] = stop["table"][w, c]
+                inputs[k, live[inside]] = np.hstack([stop["weather_inputs"][w], stop["context_inputs"][c]])
+            if not inside.all():
+                delays[~inside] = self._predict_fallback(stop, targets[~inside])
+            return delays
+
+        sched_ns = np.array([stop["sched_ns"] for stop in self._stops], dtype=np.int64)
+        scan = _advance_variants(sched_ns, shift_minutes, step, progress, cancel_event,
+                                 prune_above, station_floors, resume)
+        if resume is not None:
+            kept = np.arange(n_stops)[:, None] < resume[0][None, :]
+            inputs[kept] = resume[1]["inputs"][kept]
+        scan["inputs"] = inputs
+        return scan
+
+    def inputs_at(self, k: int, forecast_ns: np.ndarray) -> np.ndarray:
+        """Time-varying model inputs of stop `k` at `forecast_ns` (NaN rows outside the loaded forecast)."""
+        stop = self._stops[k]
+        out = np.full((len(forecast_ns), len(WEATHER_FIELDS) + 2), np.nan)
+        if stop["table"] is None or len(forecast_ns) == 0:
+            return out
+        epochs = stop["weather_epochs"]
+        inside = (forecast_ns >= epochs[0]) & (forecast_ns <= epochs[-1]) & stop["context"].covers(forecast_ns)
+        if inside.any():
+            w, c = self._slots(stop, forecast_ns[inside])
+            out[inside] = np.hstack([stop["weather_inputs"][w], stop["context_inputs"][c]])
+        return out
+
+    def results(self, shift_minutes: list, scan: dict) -> list:
+        """VariantResults from a `_scan`."""
+        return _variant_results(self.train_schedule, shift_minutes, scan)
+
+    def simulate(self, shift_minutes: list,
+                 progress=None,
+                 cancel_event: threading.Event | None = None,
+                 prune_above: float | None = None,
+                 station_floors: np.ndarray | None = None) -> list:
+        """Same contract and results as `simulate_variants_lockstep`."""
+        scan = self._scan(shift_minutes, progress, cancel_event, prune_above, station_floors)
+        return self.results(shift_minutes, scan)
+
+def _prepare_simulation(train_number: int, interval_minutes: float, total_hours: float,
+                        weather_store: WeatherForecastStore, station_store: StationContextStore,
+                        cancel_event: threading.Event | None = None) -> tuple:
+    """Fetch + prefetch a train's inputs; returns (train_schedule, shift_minutes)."""
+    try:
+        # schedule + every stop's station document in one request
+        train_schedule, stations, window = fetch_train_bundle(
+            train_number, total_hours * 60 + MAX_PLAUSIBLE_DELAY_MINUTES)
+        for station in stations:
+            station_store.put(station["station_code"], StationContext.from_station_data(station, window))
+    except BundleUnavailable:
+        train_schedule = fetch_train_schedule(train_number)
+    prefetch_simulation_inputs(train_schedule, weather_store, station_store,
+                               window=simulation_time_window(train_schedule, total_hours))
+    _check_cancel(cancel_event)
     base_start_time = pd.to_datetime(train_schedule["scheduled_arrival"].dropna().iloc[0])
 
     interval = timedelta(minutes=interval_minutes)
     total_shift_duration = timedelta(hours=total_hours)
     num_intervals = int(total_shift_duration.total_seconds() // interval.total_seconds())
     shift_times = [base_start_time + i * interval for i in range(num_intervals + 1)]
+    shift_minutes = [(start_time - base_start_time).total_seconds() / 60 for start_time in shift_times]
+    return train_schedule, shift_minutes
 
-    results = []
-    for start_time in shift_times:
-        shift_minutes = (start_time - base_start_time).total_seconds() / 60
-        shifted_schedule = train_schedule.copy()
-        shifted_schedule["scheduled_arrival"] = shifted_schedule["scheduled_arrival"] + timedelta(minutes=shift_minutes)
+# --- Start-time search
+SEARCH_STRATEGIES = ("grid", "adaptive")
+PRUNE_MODES = ("bound", "partial", "none")
+ADAPTIVE_COARSE_POINTS = int(os.environ.get("ADAPTIVE_COARSE_POINTS", "16"))
+ADAPTIVE_BEAM = int(os.environ.get("ADAPTIVE_BEAM", "3"))
 
-        result = simulate_schedule_variant(shifted_schedule, train_schedule, final_model, le_dict)
-        results.append(result)
+def station_delay_floors(stops: pd.DataFrame, final_model, encoder: CategoricalEncoder) -> np.ndarray | None:
+    """
+    Per-stop lower bound on the predicted delay over every possible
+    weather/station context; None when the model is not a supported tree
+    ensemble.
+    """
+    engine = final_model
+    if not hasattr(engine, "lower_bound"):
+        try:
+            engine = FlatTreeEnsemble.from_model(final_model)
+        except TypeError:
+            return None
+    X = encoder.transform(stops[_SCHEDULE_FEATURES].reset_index(drop=True))
+    X = X.reindex(columns=engine.feature_names_in_, fill_value=0).astype(float)
+    X[[c for c in _FORECAST_FEATURES if c in X.columns]] = np.nan
+    return engine.lower_bound(X)
+
+def _adaptive_rounds(num_intervals: int, coarse_points: int):
+    """Yield grid steps (in intervals) from the coarse pass down to 1."""
+    step = 1
+    while num_intervals // step > max(1, coarse_points):
+        step *= 2
+    yield step
+    while step > 1:
+        step //= 2
+        yield step
 
+def iter_search_variants(train_schedule: pd.DataFrame,
+                         shift_minutes: list,
+                         final_model,
+                         le_dict,
+                         weather_store: WeatherForecastStore | None = None,
+                         station_store: StationContextStore | None = None,
+                         strategy: str = "grid",
+                         prune: str = "bound",
+                         group_size: int | None = None,
+                         progress=None,
+                         cancel_event: threading.Event | None = None,
+                         stats: dict | None = None,
+                         surface: "DelaySurface | None" = None):
+    """
+    Yield (variant_index, result) for the start offsets a strategy visits.
+
+    strategy="grid" simulates every offset in lockstep groups of
+    `group_size` (all at once by default).
+
+    strategy="adaptive" simulates a coarse grid of about
+    ADAPTIVE_COARSE_POINTS offsets, then repeatedly halves the step around
+    the ADAPTIVE_BEAM best offsets found so far. Variants of the refining
+    passes are abandoned once they cannot beat the best total:
+      prune="bound"   - cumulative delay + per-stop model lower bounds
+                        (never drops a variant that could have won)
+      prune="partial" - cumulative delay alone, i.e. assumes delays >= 0
+      prune="none"    - no early abandonment
+    The adaptive search assumes total delay varies smoothly with the
+    start time; it can miss a narrow minimum between coarse offsets.
+
+    Variants are simulated with `surface` when given, otherwise with
+    `simulate_variants_lockstep`. If given, `stats` is filled with the
+    evaluation counts. `model_rows_predicted` is the actual model cost:
+    one row per evaluated station in lockstep, the surface's predicted
+    cells otherwise, so `model_rows_saved` (against one row per station
+    of every grid variant) can be negative for a surface.
+    """
+    if strategy not in SEARCH_STRATEGIES:
+        raise ValueError(f"Unknown search strategy: {strategy}")
+    if prune not in PRUNE_MODES:
+        raise ValueError(f"Unknown prune mode: {prune}")
+    station_store = station_store or _station_store
+    encoder = CategoricalEncoder.coerce(le_dict)
+    stops = train_schedule[train_schedule["scheduled_arrival"].notna()]
+    stats = {} if stats is None else stats
+    full_grid = len(shift_minutes) * len(stops)
+    rows_predicted = 0 if surface is None else surface.rows_predicted
+    stats.update({
+        "strategy": strategy,
+        "prune": prune if strategy == "adaptive" else "none",
+        "variants_total": len(shift_minutes),
+        "variants_evaluated": 0,
+        "variants_abandoned": 0,
+        "station_evaluations": 0,
+        "full_grid_station_evaluations": full_grid,
+        "station_evaluations_saved": full_grid,
+        "model_rows_predicted": rows_predicted,
+        "model_rows_saved": full_grid - rows_predicted,
+    })
+
+    def run(indices, prune_above=None, floors=None):
+        mapped = None if progress is None else (lambda v, done, total: progress(indices[v], done, total))
+        offsets = [shift_minutes[k] for k in indices]
+        if surface is not None:
+            results = surface.simulate(offsets, mapped, cancel_event, prune_above, floors)
+        else:
+            results = simulate_variants_lockstep(train_schedule, offsets, final_model, encoder,
+                                                 weather_store, station_store,
+                                                 mapped, cancel_event, prune_above, floors)
+        for k, result in zip(indices, results):
+            stats["variants_evaluated"] += 1
+            stats["variants_abandoned"] += int(result["abandoned"])
+            stats["station_evaluations"] += result["stations_evaluated"]
+        stats["station_evaluations_saved"] = full_grid - stats["station_evaluations"]
+        stats["model_rows_predicted"] = (stats["station_evaluations"] if surface is None
+                                         else surface.rows_predicted)
+        stats["model_rows_saved"] = full_grid - stats["model_rows_predicted"]
+        return list(zip(indices, results))
+
+    if strategy == "grid":
+        group_size = max(1, group_size or len(shift_minutes))
+        for start in range(0, len(shift_minutes), group_size):
+            yield from run(list(range(start, min(start + group_size, len(shift_minutes)))))
+        return
+
+    floors = None
+    if prune == "bound":
+        floors = station_delay_floors(stops, final_model, encoder)
+        if floors is None:
+            prune = stats["prune"] = "none"
+    elif prune == "partial":
+        floors = np.zeros(len(stops))
+
+    last = len(shift_minutes) - 1
+    totals = {}                    # variant_index -> total delay of completed variants
+    visited = set()
+    for round_no, step in enumerate(_adaptive_rounds(last, ADAPTIVE_COARSE_POINTS)):
+        if round_no == 0:
+            indices = sorted(set(range(0, last + 1, step)) | {last})
+        else:
+            leaders = sorted(totals, key=lambda k: (totals[k], k))[:ADAPTIVE_BEAM]
+            indices = sorted({k + d for k in leaders for d in (-step, step)
+                              if 0 <= k + d <= last} - visited)
+        if not indices:
+            continue
+        visited.update(indices)
+        best = min(totals.values()) if totals and prune != "none" else None
+        for k, result in run(indices, best, floors):
+            if result["total_delay"] is not None:
+                totals[k] = result["total_delay"]
+            yield k, result
+
+SIMULATION_MODES = ("lockstep", "surface", "sequential")
+
+def _build_surface(mode: str, train_schedule, shift_minutes, final_model, le_dict,
+                   weather_store, station_store, strategy: str = "grid") -> DelaySurface | None:
+    if mode == "surface":
+        # the adaptive search visits a fraction of the offsets: predict only the cells it reaches
+        return DelaySurface(train_schedule, shift_minutes if strategy == "grid" else None,
+                            final_model, le_dict, weather_store, station_store)
+    if mode == "lockstep":
+        return None
+    raise ValueError(f"Unknown simulation mode: {mode}")
+
+def iter_variant_results(train_number: int, final_model, le_dict,
+                         interval_minutes: int = 15,
+                         total_hours: int = 4,
+                         weather_store: WeatherForecastStore | None = None,
+                         station_store: StationContextStore | None = None,
+                         group_size: int = 1,
+                         cancel_event: threading.Event | None = None,
+                         strategy: str = "grid",
+                         prune: str = "bound",
+                         stats: dict | None = None,
+                         mode: str = "lockstep"):
+    """
+    Yield (variant_index, variant_count, result) as each variant finishes.
+
+    Variants are simulated in groups of `group_size` (grid) or per
+    refining pass (adaptive), so the first result arrives early; the
+    caller decides which `detail_df()`s to build. `mode` is "lockstep" or
+    "surface" as in `simulate_all_variants`.
+    """
+    weather_store = weather_store or _weather_store
+    station_store = station_store or _station_store
+    train_schedule, shift_minutes = _prepare_simulation(train_number, interval_minutes, total_hours,
+                                                        weather_store, station_store, cancel_event)
+    surface = _build_surface(mode, train_schedule, shift_minutes, final_model, le_dict,
+                             weather_store, station_store, strategy)
+    for index, result in iter_search_variants(train_schedule, shift_minutes, final_model, le_dict,
+                                              weather_store, station_store, strategy, prune,
+                                              group_size, cancel_event=cancel_event, stats=stats,
+                                              surface=surface):
+        yield index, len(shift_minutes), result
+
+def simulate_all_variants(train_number: int, final_model, le_dict,
+                          interval_minutes: int = 15,
+                          total_hours: int = 4,
+                          weather_store: WeatherForecastStore | None = None,
+                          station_store: StationContextStore | None = None,
+                          mode: str = "lockstep",
+                          progress=None,
+                          cancel_event: threading.Event | None = None,
+                          strategy: str = "grid",
+                          prune: str = "bound") -> dict:
+    """
+    Simulate schedule variants every `interval_minutes` over a
+    `total_hours` window and return the one with the least cumulative
+    delay, plus summary of all evaluated ones.
+
+    strategy="grid" evaluates every variant; strategy="adaptive" runs the
+    coarse-to-fine search of `iter_search_variants`. `search` in the
+    result reports how many station evaluations were saved.
+
+    mode="lockstep" batches variants into one predict per station;
+    mode="surface" predicts each reachable weather/context slot once per
+    station (see DelaySurface) and turns variants into table lookups;
+    mode="sequential" simulates the grid variants one after another.
+
+    `progress(variant_index, stations_done, stations_total)` reports
+    per-variant progress; setting `cancel_event` aborts the run with
+    SimulationCancelled.
+    """
+    weather_store = weather_store or _weather_store
+    station_store = station_store or _station_store
+    encoder = CategoricalEncoder.coerce(le_dict)
+    train_schedule, shift_minutes = _prepare_simulation(train_number, interval_minutes, total_hours,
+                                                        weather_store, station_store, cancel_event)
+
+    stats = {}
+    if mode in ("lockstep", "surface"):
+        surface = _build_surface(mode, train_schedule, shift_minutes, final_model, encoder,
+                                 weather_store, station_store, strategy)
+        visited = iter_search_variants(train_schedule, shift_minutes, final_model, encoder,
+                                       weather_store, station_store, strategy, prune,
+                                       progress=progress, cancel_event=cancel_event, stats=stats,
+                                       surface=surface)
+        results = [result for _, result in sorted(visited, key=lambda kr: kr[0])]
+    elif mode == "sequential":
+        if strategy != "grid":
+            raise ValueError("sequential mode only supports the grid strategy")
+        results = [
+            simulate_schedule_variant(_shift_schedule(train_schedule, m), train_schedule,
+                                      final_model, encoder, weather_store, station_store,
+                                      None if progress is None else partial(progress, v),
+                                      cancel_event)
+            for v, m in enumerate(shift_minutes)
+        ]
+        stops = int(train_schedule["scheduled_arrival"].notna().sum())
+        stats = {"strategy": "grid", "prune": "none", "variants_total": len(results),
+                 "variants_evaluated": len(results), "variants_abandoned": 0,
+                 "station_evaluations": len(results) * stops,
+                 "full_grid_station_evaluations": len(results) * stops,
+                 "station_evaluations_saved": 0,
+                 "model_rows_predicted": len(results) * stops, "model_rows_saved": 0}
+    else:
+        raise ValueError(f"Unknown simulation mode: {mode}")
+
+    summary = _summarize_variants(train_number, results)
+    summary["search"] = stats
+    return summary
+
+def _summarize_variants(train_number: int, results: list) -> dict:
     # sort variants by total delay
     summary_df = pd.DataFrame([
         {"start_time_variant": r["start_time_variant"], "total_delay": r["total_delay"]}
@@ -229,6 +1267,124 @@ def simulate_all_variants(train_number: int, final_model, le_dict,
         "train_number": train_number,
         "best_variant": best,
         "all_variants": summary_df.to_dict(orient="records"),
-        "best_detail": next((r["detail_df"] for r in results
+        "best_detail": next((r.detail_df() for r in results
                              if not summary_df.empty and r["start_time_variant"] == best["start_time_variant"]), None)
     }
+
+class IncrementalSimulation:
+    """
+    A train's full grid of variants, kept between runs.
+
+    Every `run` refetches the schedule and reads the (TTL-refreshed)
+    stores. When the schedule and grid are unchanged, each variant's
+    per-stop state from the last run (forecast time, weather/context
+    inputs, predicted and cumulative delay) is kept up to the first stop
+    whose inputs changed. Only the stops from there on are simulated
+    again, and only changed (weather slot, context slot) cells reach the
+    model. Results equal a fresh `simulate_all_variants(mode="surface")`.
+
+    The result carries a `diff` report of which variants and stations
+    were recomputed.
+    """
+
+    def __init__(self, train_number: int, final_model, le_dict,
+                 interval_minutes: float = 15,
+                 total_hours: float = 4,
+                 weather_store: WeatherForecastStore | None = None,
+                 station_store: StationContextStore | None = None):
+        self.train_number = train_number
+        self.final_model = final_model
+        self.encoder = CategoricalEncoder.coerce(le_dict)
+        self.interval_minutes = interval_minutes
+        self.total_hours = total_hours
+        self.weather_store = weather_store or _weather_store
+        self.station_store = station_store or _station_store
+        self._state = None             # (train_schedule, shift_minutes, surface, scan, totals)
+        self._lock = threading.Lock()
+
+    def _reason_for_full_run(self, train_schedule: pd.DataFrame, shift_minutes: list) -> str | None:
+        if self._state is None:
+            return "first run"
+        old_schedule, old_shifts = self._state[0], self._state[1]
+        if old_shifts != shift_minutes:
+            return "variant grid changed"
+        if not train_schedule.equals(old_schedule):
+            return "schedule changed"
+        return None
+
+    @staticmethod
+    def _first_changed(surface: DelaySurface, prior: dict) -> np.ndarray:
+        """Per variant, the first stop whose inputs differ at its previous forecast time."""
+        n_stops, n_variants = prior["delays"].shape
+        first = np.full(n_variants, n_stops)
+        pending = np.arange(n_variants)
+        for k in range(n_stops):
+            if len(pending) == 0:
+                break
+            now = surface.inputs_at(k, prior["forecast"][k, pending])
+            changed = ~(now == prior["inputs"][k, pending]).all(axis=1)
+            first[pending[changed]] = k
+            pending = pending[~changed]
+        return first
+
+    def run(self, progress=None, cancel_event: threading.Event | None = None) -> dict:
+        with self._lock:
+            train_schedule, shift_minutes = _prepare_simulation(
+                self.train_number, self.interval_minutes, self.total_hours,
+                self.weather_store, self.station_store, cancel_event)
+            reason = self._reason_for_full_run(train_schedule, shift_minutes)
+            previous = None if reason else self._state[2]
+            surface = DelaySurface(train_schedule, shift_minutes, self.final_model, self.encoder,
+                                   self.weather_store, self.station_store, previous=previous)
+            n_stops = len(surface.stops)
+            if reason:
+                first = np.zeros(len(shift_minutes), dtype=np.int64)
+                scan = surface._scan(shift_minutes, progress, cancel_event)
+            else:
+                first = self._first_changed(surface, self._state[3])
+                scan = surface._scan(shift_minutes, progress, cancel_event,
+                                     resume=(first, self._state[3]))
+            results = surface.results(shift_minutes, scan)
+            totals = [r["total_delay"] for r in results]
+            diff = self._diff(surface, results, first, reason,
+                              None if reason else self._state[4])
+            self._state = (train_schedule, shift_minutes, surface, scan, totals)
+
+        full_grid = len(shift_minutes) * n_stops
+        summary = _summarize_variants(self.train_number, results)
+        summary["search"] = {"strategy": "grid", "prune": "none", "variants_total": len(shift_minutes),
+                             "variants_evaluated": len(shift_minutes), "variants_abandoned": 0,
+                             "station_evaluations": full_grid, "full_grid_station_evaluations": full_grid,
+                             "station_evaluations_saved": 0, "model_rows_predicted": surface.rows_predicted,
+                             "model_rows_saved": full_grid - surface.rows_predicted}
+        summary["diff"] = diff
+        return summary
+
+    @staticmethod
+    def _diff(surface: DelaySurface, results: list, first: np.ndarray, reason, old_totals) -> dict:
+        n_stops = len(surface.stops)
+        codes = surface.stops["station_code"].tolist()
+        indices = surface.stops.index.tolist()
+        recomputed = np.flatnonzero(first < n_stops)
+        return {
+            "full": reason is not None,
+            "reason": reason,
+            "variants_total": len(results),
+            "variants_recomputed": len(recomputed),
+            "station_evaluations": int((n_stops - first).sum()),
+            "station_evaluations_reused": int(first.sum()),
+            "model_rows_predicted": surface.rows_predicted,
+            "variants": [{
+                "variant": int(v),
+                "start_time_variant": results[v]["start_time_variant"],
+                "from_station_index": int(indices[first[v]]),
+                "from_station_code": codes[first[v]],
+                "total_delay_before": None if old_totals is None else old_totals[v],
+                "total_delay_after": results[v]["total_delay"]
+            } for v in recomputed],
+            "stations": [{
+                "station_index": int(indices[k]),
+                "station_code": codes[k],
+                "variants_recomputed": int((first <= k).sum())
+            } for k in range(n_stops) if (first <= k).any()]
+        }
@@ -0,0 +1,343 @@
+# providers.py
+import abc
+import atexit
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import requests
+import openmeteo_requests
+from requests.adapters import HTTPAdapter
+from retry_requests import retry
+
+from timing import span
+
+# --- endpoints (override per deployment)
+RRAS_API_URL = os.environ.get("RRAS_API_URL",
+                              "https://railway-rescheduling-automation-system.onrender.com/api")
+OPEN_METEO_URL = os.environ.get("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+WEATHER_VARIABLES = [
+    "temperature_2m", "apparent_temperature", "relative_humidity_2m",
+    "pressure_msl", "windspeed_10m", "winddirection_10m",
+    "visibility", "cloudcover", "dew_point_2m", "weathercode"
+]
+# column names used by the model, in WEATHER_VARIABLES order
+WEATHER_FIELDS = [
+    "temp", "feels_like", "humidity", "pressure", "wind_speed",
+    "wind_deg", "visibility", "clouds", "dew_point", "weather_code"
+]
+
+
+def _decode_minutely_15(response) -> tuple[np.ndarray, dict]:
+    """Decode an Open-Meteo response into (epoch_ns, {field: values}) arrays."""
+    with span("weather_decode"):
+        m15 = response.Minutely15()
+        epochs = np.arange(m15.Time(), m15.TimeEnd(), m15.Interval(), dtype=np.int64) * 1_000_000_000
+        values = {name: m15.Variables(i).ValuesAsNumpy() for i, name in enumerate(WEATHER_FIELDS)}
+    return epochs, values
+
+def _location_key(lat: float, lon: float) -> tuple:
+    return round(float(lat), 4), round(float(lon), 4)
+
+def _window_bounds(start, end) -> tuple:
+    """[start, end] widened to whole 15-min slots, in UTC."""
+    return (pd.Timestamp(start).tz_convert("UTC").floor("15min"),
+            pd.Timestamp(end).tz_convert("UTC").ceil("15min"))
+
+def _slice_window(series: tuple, start, end) -> tuple:
+    """The slots of a full-horizon series that fall inside the [start, end] window."""
+    start, end = _window_bounds(start, end)
+    epochs, values = series
+    lo, hi = np.searchsorted(epochs, [start.value, end.value], side="left")
+    hi += int(hi < len(epochs) and epochs[hi] == end.value)
+    return epochs[lo:hi], {name: column[lo:hi] for name, column in values.items()}
+
+
+class BundleUnavailable(Exception):
+    """Raised by `train_bundle` when the provider has no bulk path; callers fetch per document instead."""
+
+
+class DataProvider(abc.ABC):
+    """
+    Where simulations get their inputs from.
+
+    Required:
+    train_schedule(train_number) -> train payload (dict with "schedule")
+    station(station_code)        -> station payload (dict with "forecasts")
+    weather(lat, lon)            -> (epoch_ns, {field: values}), full horizon
+    weather_batch(coords, start, end)
+                                 -> [(epoch_ns, {field: values}), ...] per
+                                    (lat, lon), limited to [start, end]
+                                    (full horizon when start is None)
+
+    Optional:
+    train_bundle(train_number, after_minutes)
+                                 -> {"train", "stations", "window"}: the train
+                                    payload plus the station payloads of all
+                                    its stops, forecasts trimmed to the window;
+                                    BundleUnavailable when not supported
+    list_trains(page, limit)     -> one page of the Node API's /trains listing
+    list_stations(page, limit)   -> one page of its /stations listing
+                                    ({"totalPages", "trains" | "stations"})
+    """
+
+    @abc.abstractmethod
+    def train_schedule(self, train_number: int) -> dict: ...
+
+    @abc.abstractmethod
+    def station(self, station_code: str) -> dict: ...
+
+    @abc.abstractmethod
+    def weather(self, lat: float, lon: float) -> tuple[np.ndarray, dict]: ...
+
+    @abc.abstractmethod
+    def weather_batch(self, coords: list, start, end) -> list: ...
+
+    def train_bundle(self, train_number: int, after_minutes: float) -> dict:
+        raise BundleUnavailable(f"{type(self).__name__} has no bulk train loader")
+
+    def list_trains(self, page: int, limit: int) -> dict:
+        raise NotImplementedError(f"{type(self).__name__} cannot list trains")
+
+    def list_stations(self, page: int, limit: int) -> dict:
+        raise NotImplementedError(f"{type(self).__name__} cannot list stations")
+
+
+class HttpProvider(DataProvider):
+    """The Node API for schedules/stations and Open-Meteo for weather."""
+
+    def __init__(self, api_url: str = RRAS_API_URL, weather_url: str = OPEN_METEO_URL,
+                 pool_maxsize: int = 8, timeout: float = 60):
+        self.api_url = api_url.rstrip("/")
+        self.weather_url = weather_url
+        self.timeout = timeout
+        self.has_bundle_route = True     # until the API answers that it has none
+        # keep-alive connection pool sized for the prefetch stage
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=pool_maxsize))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=pool_maxsize))
+        # Open-Meteo client with retries; caching is weather_cache.py's job
+        self.openmeteo = openmeteo_requests.Client(
+            session=retry(requests.Session(), retries=5, backoff_factor=0.2))
+
+    def _get_json(self, path: str) -> dict:
+        r = self.session.get(f"{self.api_url}/{path}", timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def train_schedule(self, train_number: int) -> dict:
+        return self._get_json(f"trains/{train_number}")
+
+    def station(self, station_code: str) -> dict:
+        return self._get_json(f"stations/{station_code}")
+
+    def train_bundle(self, train_number: int, after_minutes: float) -> dict:
+        if not self.has_bundle_route:
+            raise BundleUnavailable(f"{self.api_url} has no bundle route")
+        r = self.session.get(f"{self.api_url}/trains/{train_number}/bundle",
+                             params={"after_minutes": f"{after_minutes:.3f}"}, timeout=self.timeout)
+        if r.status_code == 404 and not r.headers.get("Content-Type", "").startswith("application/json"):
+            # Express's own "Cannot GET" page: an API from before the route existed
+            # (an unknown train is a JSON 404 from the controller and raises below)
+            self.has_bundle_route = False
+            raise BundleUnavailable(f"{self.api_url} has no bundle route")
+        r.raise_for_status()
+        return r.json()
+
+    def list_trains(self, page: int, limit: int) -> dict:
+        return self._get_json(f"trains?page={page}&limit={limit}")
+
+    def list_stations(self, page: int, limit: int) -> dict:
+        return self._get_json(f"stations?page={page}&limit={limit}")
+
+    def weather(self, lat: float, lon: float) -> tuple[np.ndarray, dict]:
+        params = {
+            "latitude": lat, "longitude": lon,
+            "minutely_15": WEATHER_VARIABLES,
+            "timezone": "auto"
+        }
+        responses = self.openmeteo.weather_api(self.weather_url, params=params)
+        return _decode_minutely_15(responses[0])
+
+    def weather_batch(self, coords: list, start, end) -> list:
+        params = {
+            "latitude": [float(lat) for lat, _ in coords],
+            "longitude": [float(lon) for _, lon in coords],
+            "minutely_15": WEATHER_VARIABLES,
+            "timezone": "auto"
+        }
+        if start is not None:
+            start, end = _window_bounds(start, end)
+            params.update({
+                "start_minutely_15": start.strftime("%Y-%m-%dT%H:%M"),
+                "end_minutely_15": end.strftime("%Y-%m-%dT%H:%M"),
+                "timezone": "GMT"
+            })
+        responses = self.openmeteo.weather_api(self.weather_url, params=params)
+        return [_decode_minutely_15(response) for response in responses]
+
+
+# --- snapshots
+#
+# A snapshot is a directory:
+#   manifest.json        train and station payloads, weather index {"lat,lon": [offset, length]}
+#   weather_epochs.npy   int64 epoch_ns of every recorded slot, grouped per location
+#   weather_values.npy   float32 (len(WEATHER_FIELDS), n_slots), same order
+# The .npy files are memory-mapped on replay.
+SNAPSHOT_VERSION = 1
+
+class SnapshotMiss(LookupError):
+    """Raised by ReplayProvider for anything the snapshot does not contain."""
+
+
+class SnapshotRecorder(DataProvider):
+    """
+    Passes calls through to `inner` and keeps every payload it returns;
+    `save()` writes them as a snapshot. Weather recorded for the same
+    location is merged by slot (latest fetch wins). There is no
+    `train_bundle`, so recorded station payloads are never trimmed.
+    """
+
+    def __init__(self, inner: DataProvider, path: str):
+        self.inner = inner
+        self.path = path
+        self._trains, self._stations, self._weather = {}, {}, {}
+        self._lock = threading.Lock()
+
+    def train_schedule(self, train_number: int) -> dict:
+        payload = self.inner.train_schedule(train_number)
+        with self._lock:
+            self._trains[str(train_number)] = payload
+        return payload
+
+    def station(self, station_code: str) -> dict:
+        payload = self.inner.station(station_code)
+        with self._lock:
+            self._stations[station_code] = payload
+        return payload
+
+    def list_trains(self, page: int, limit: int) -> dict:
+        return self.inner.list_trains(page, limit)
+
+    def list_stations(self, page: int, limit: int) -> dict:
+        return self.inner.list_stations(page, limit)
+
+    def _record_weather(self, lat: float, lon: float, series: tuple):
+        epochs, values = series
+        key = _location_key(lat, lon)
+        with self._lock:
+            slots = self._weather.setdefault(key, {})
+            columns = np.stack([np.asarray(values[name], dtype=np.float32) for name in WEATHER_FIELDS])
+            for j, epoch in enumerate(epochs.tolist()):
+                slots[epoch] = columns[:, j]
+
+    def weather(self, lat: float, lon: float) -> tuple[np.ndarray, dict]:
+        series = self.inner.weather(lat, lon)
+        self._record_weather(lat, lon, series)
+        return series
+
+    def weather_batch(self, coords: list, start, end) -> list:
+        fetched = self.inner.weather_batch(coords, start, end)
+        for (lat, lon), series in zip(coords, fetched):
+            self._record_weather(lat, lon, series)
+        return fetched
+
+    def save(self) -> str:
+        with self._lock:
+            index, epochs, columns, offset = {}, [], [], 0
+            for (lat, lon), slots in sorted(self._weather.items()):
+                order = sorted(slots)
+                index[f"{lat},{lon}"] = [offset, len(order)]
+                epochs.append(np.array(order, dtype=np.int64))
+                columns.append(np.stack([slots[e] for e in order], axis=1) if order
+                               else np.empty((len(WEATHER_FIELDS), 0), dtype=np.float32))
+                offset += len(order)
+            manifest = {
+                "version": SNAPSHOT_VERSION,
+                "weather_fields": WEATHER_FIELDS,
+                "trains": self._trains,
+                "stations": self._stations,
+                "weather": index
+            }
+        os.makedirs(self.path, exist_ok=True)
+        np.save(os.path.join(self.path, "weather_epochs.npy"),
+                np.concatenate(epochs) if epochs else np.empty(0, dtype=np.int64))
+        np.save(os.path.join(self.path, "weather_values.npy"),
+                np.concatenate(columns, axis=1) if columns
+                else np.empty((len(WEATHER_FIELDS), 0), dtype=np.float32))
+        with open(os.path.join(self.path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        return self.path
+
+
+class ReplayProvider(DataProvider):
+    """Serves a snapshot written by SnapshotRecorder; never touches the network."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SNAPSHOT_VERSION or manifest["weather_fields"] != WEATHER_FIELDS:
+            raise ValueError(f"{path} is not a compatible snapshot")
+        self.path = path
+        self._trains = manifest["trains"]
+        self._stations = manifest["stations"]
+        self._index = {tuple(float(x) for x in key.split(",")): extent
+                       for key, extent in manifest["weather"].items()}
+        self._epochs = np.load(os.path.join(path, "weather_epochs.npy"), mmap_mode="r")
+        self._values = np.load(os.path.join(path, "weather_values.npy"), mmap_mode="r")
+
+    def train_schedule(self, train_number: int) -> dict:
+        try:
+            return self._trains[str(train_number)]
+        except KeyError:
+            raise SnapshotMiss(f"train {train_number} is not in snapshot {self.path}") from None
+
+    def station(self, station_code: str) -> dict:
+        try:
+            return self._stations[station_code]
+        except KeyError:
+            raise SnapshotMiss(f"station {station_code} is not in snapshot {self.path}") from None
+
+    def weather(self, lat: float, lon: float) -> tuple[np.ndarray, dict]:
+        extent = self._index.get(_location_key(lat, lon))
+        if extent is None:
+            raise SnapshotMiss(f"no weather for ({lat}, {lon}) in snapshot {self.path}")
+        offset, length = extent
+        epochs = self._epochs[offset:offset + length]
+        values = {name: self._values[i, offset:offset + length] for i, name in enumerate(WEATHER_FIELDS)}
+        return epochs, values
+
+    def weather_batch(self, coords: list, start, end) -> list:
+        series = [self.weather(lat, lon) for lat, lon in coords]
+        return series if start is None else [_slice_window(s, start, end) for s in series]
+
+
+def provider_from_env(pool_maxsize: int = 8) -> DataProvider:
+    """
+    DATA_PROVIDER=http (default), record or replay; record/replay use
+    SNAPSHOT_DIR. A recorder saves its snapshot at interpreter exit.
+    Live weather goes through the grid-cell cache (weather_cache.py)
+    unless WEATHER_CACHE=off.
+    """
+    kind = os.environ.get("DATA_PROVIDER", "http")
+    snapshot_dir = os.environ.get("SNAPSHOT_DIR", "snapshot")
+
+    def live():
+        provider = HttpProvider(pool_maxsize=pool_maxsize)
+        if os.environ.get("WEATHER_CACHE", "on") == "off":
+            return provider
+        from weather_cache import CachedWeatherProvider
+        return CachedWeatherProvider(provider)
+
+    if kind == "http":
+        return live()
+    if kind == "record":
+        recorder = SnapshotRecorder(live(), snapshot_dir)
+        atexit.register(recorder.save)
+        return recorder
+    if kind == "replay":
+        return ReplayProvider(snapshot_dir)
+    raise ValueError(f"Unknown DATA_PROVIDER: {kind}")
@@ -0,0 +1,75 @@
+# result_cache.py
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import monotonic
+
+
+class SingleFlightCache:
+    """
+    TTL + size-bounded (LRU) result cache with single-flight de-duplication.
+
+    The first caller for a key runs `compute`; concurrent callers with the
+    same key wait on that in-flight computation instead of starting their
+    own. Exceptions are handed to every waiter and are not cached.
+    """
+
+    HIT, MISS, COALESCED = "HIT", "MISS", "COALESCED"
+
+    def __init__(self, ttl: float = 900.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The finished, unexpired value for `key`, or None; never waits on an in-flight computation."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or monotonic() >= entry[0]:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute) -> tuple:
+        """Return (value, status) where status is HIT, MISS or COALESCED."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and monotonic() < entry[0]:
+                self._entries.move_to_end(key)
+                return entry[1], self.HIT
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            return future.result(), self.COALESCED
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._store(key, value)
+            del self._inflight[key]
+        future.set_result(value)
+        return value, self.MISS
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import forecast_warmer
+import ml_core
+
+fcntl = pytest.importorskip("fcntl")
+
+
+class ListingProvider:
+    def __init__(self, codes):
+        self.codes = codes
+
+    def list_stations(self, page, limit):
+        stations = [{"station_code": code, "lat": 10.0 + i, "lon": 70.0,
+                     "forecasts": [{"timestamp": "2026-10-17T00:00:00Z", "tracks_on_route": 2, "trains_nearby": 7}]}
+                    for i, code in enumerate(self.codes)]
+        return {"totalPages": 1, "stations": stations}
+
+    def list_trains(self, page, limit):
+        return {"totalPages": 1, "trains": []}
+
+
+@pytest.fixture
+def listing(monkeypatch):
+    monkeypatch.setattr(ml_core, "get_provider", lambda: ListingProvider(["A", "C"]))
+
+
+def cached(code: str) -> ml_core.StationContext:
+    return ml_core.StationContext.from_station_data({"station_code": code, "forecasts": []})
+
+
+def test_station_cycle_refreshes_without_evicting(listing):
+    store = ml_core.StationContextStore(max_entries=2)
+    store.put("A", cached("A"))
+    store.put("B", cached("B"))
+    warmer = forecast_warmer.ForecastWarmer(station_store=store, max_rps=1000)
+    warmer.refresh_stations()
+
+    assert warmer.state["stations"] == 1
+    assert list(store._entries) == ["A", "B"]          # C not added, LRU order kept
+    assert store._entries["A"][1].trains_nearby.tolist() == [7]
+    assert len(warmer._coords) == 2                    # every listed station is still a weather cell
+
+
+def test_one_warmer_per_host(tmp_path, monkeypatch):
+    monkeypatch.setattr(forecast_warmer, "_lock_file", None)
+    with open(os.path.join(tmp_path, "forecast_warmer.lock"), "a") as other_worker:
+        fcntl.flock(other_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert not forecast_warmer._elect(str(tmp_path))
+    assert forecast_warmer._elect(str(tmp_path))
+    forecast_warmer._lock_file.close()
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from jobs import JobManager, SimulationJob
+from ml_core import SimulationCancelled
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_workers_share_job_state(tmp_path):
+    started = threading.Event()
+
+    def run(params, progress, cancel_event):
+        station = 0
+        while not cancel_event.is_set():
+            progress(0, station, 1000)
+            started.set()
+            station += 1
+            time.sleep(0.01)
+        raise SimulationCancelled()
+
+    owner = JobManager(run, state_dir=str(tmp_path), sync_seconds=0.05)
+    other = JobManager(run, state_dir=str(tmp_path), sync_seconds=0.05)
+    job = owner.submit({"train_number": 12})
+    try:
+        started.wait(5)
+        # the owner's progress reaches the other worker
+        wait_for(lambda: other.get(job.id).to_dict()["progress"]["variants_total"] == 1)
+        assert other.get(job.id).status == SimulationJob.RUNNING
+        # and so does a cancel from there
+        other.cancel(job.id)
+        wait_for(lambda: job.status == SimulationJob.CANCELLED)
+        wait_for(lambda: other.get(job.id).status == SimulationJob.CANCELLED)
+    finally:
+        job.cancel_event.set()
+
+
+def test_unknown_and_malformed_ids(tmp_path):
+    jobs = JobManager(lambda *args: None, state_dir=str(tmp_path))
+    assert jobs.get("0" * 32) is None
+    assert jobs.get("../../etc/passwd") is None
+    assert jobs.cancel("../../etc/passwd") is None
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    env = {"ML_WARMUP": "off", "FORECAST_WARMER": "off", "JOB_STATE_DIR": str(tmp_path_factory.mktemp("jobs")),
+           "MODEL_PATH": os.path.join(BACKEND, "final_model.pkl"),
+           "LE_DICT_PATH": os.path.join(BACKEND, "le_dict.pkl"),
+           "MODEL_ARTIFACT_DIR": os.path.join(BACKEND, "model_artifact")}
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in env.items():
+            mp.setenv(name, value)
+        import ml_api
+    return ml_api.app.test_client()
+
+
+@pytest.mark.parametrize("path", ["/api/ml/jobs", "/api/ml/simulate/stream"])
+def test_non_integer_train_number_is_a_json_400(client, path):
+    response = client.post(path, json={"train_number": "abc"})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "train_number must be an integer"}
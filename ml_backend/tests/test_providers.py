@@ -0,0 +1,59 @@
+import pytest
+import requests
+
+from providers import BundleUnavailable, DataProvider, HttpProvider
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content_type: str, payload=None):
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type}
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class FakeSession:
+    def __init__(self, response: FakeResponse):
+        self.response = response
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        return self.response
+
+
+def provider_answering(response: FakeResponse) -> tuple[HttpProvider, FakeSession]:
+    provider = HttpProvider(api_url="http://api.test/api")
+    provider.session = FakeSession(response)
+    return provider, provider.session
+
+
+def test_provider_requires_core_methods():
+    class StationsOnly(DataProvider):
+        def station(self, station_code):
+            return {}
+
+    with pytest.raises(TypeError):
+        StationsOnly()
+
+
+def test_missing_bundle_route_is_remembered():
+    provider, session = provider_answering(FakeResponse(404, "text/html; charset=utf-8"))
+    for train_number in (101, 102):
+        with pytest.raises(BundleUnavailable):
+            provider.train_bundle(train_number, 0.0)
+    assert len(session.urls) == 1
+
+
+def test_unknown_train_is_not_a_missing_route():
+    provider, session = provider_answering(FakeResponse(404, "application/json; charset=utf-8",
+                                                        {"message": "Train not found"}))
+    with pytest.raises(requests.HTTPError):
+        provider.train_bundle(101, 0.0)
+    assert provider.has_bundle_route
@@ -0,0 +1,33 @@
+import threading
+
+import pytest
+
+from result_cache import SingleFlightCache
+
+
+def test_get_put_bypass_inflight():
+    cache = SingleFlightCache(ttl=60, max_entries=2)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("cancelled")
+
+    leader = threading.Thread(target=lambda: pytest.raises(RuntimeError, cache.get_or_compute, "k", slow))
+    leader.start()
+    started.wait(5)
+    # a reader does not wait on (or inherit the failure of) the in-flight computation
+    assert cache.get("k") is None
+    cache.put("k", "value")
+    release.set()
+    leader.join(5)
+    assert cache.get_or_compute("k", lambda: "other") == ("value", SingleFlightCache.HIT)
+
+
+def test_put_evicts_lru():
+    cache = SingleFlightCache(ttl=60, max_entries=2)
+    for key in "abc":
+        cache.put(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
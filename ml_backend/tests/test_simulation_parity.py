@@ -0,0 +1,123 @@
+"""
+The simulation modes are optimizations of one computation: sequential,
+lockstep and surface runs, and incremental reruns, must give identical
+results on the synthetic trains of benchmark.py.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ml_core
+from artifact import load_model
+from benchmark import SyntheticProvider
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAIN = 12                       # SyntheticProvider: train number = number of stations
+SEARCH = {"interval_minutes": 30, "total_hours": 4}
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return pd.read_csv(os.path.join(BACKEND, "synthetic_dataset.csv"))
+
+
+@pytest.fixture
+def provider(dataset):
+    provider = SyntheticProvider(dataset)
+    previous = ml_core.set_provider(provider)
+    yield provider
+    ml_core.set_provider(previous)
+
+
+@pytest.fixture(scope="module", params=["native", "sklearn"])
+def model(request):
+    predictor, encoder, _ = load_model(request.param, os.path.join(BACKEND, "model_artifact"),
+                                       os.path.join(BACKEND, "final_model.pkl"),
+                                       os.path.join(BACKEND, "le_dict.pkl"))
+    return predictor, encoder
+
+
+def simulate(model, mode: str, **params) -> dict:
+    return ml_core.simulate_all_variants(TRAIN, *model, **{**SEARCH, **params}, mode=mode,
+                                         weather_store=ml_core.WeatherForecastStore(),
+                                         station_store=ml_core.StationContextStore())
+
+
+def assert_same_result(actual: dict, expected: dict):
+    assert actual["all_variants"] == expected["all_variants"]
+    assert actual["best_variant"] == expected["best_variant"]
+    pd.testing.assert_frame_equal(actual["best_detail"], expected["best_detail"], check_exact=True)
+
+
+def test_lockstep_matches_sequential(provider, model):
+    assert_same_result(simulate(model, "lockstep"), simulate(model, "sequential"))
+
+
+@pytest.mark.parametrize("strategy", ml_core.SEARCH_STRATEGIES)
+def test_surface_matches_lockstep(provider, model, strategy):
+    # a fine grid, so the adaptive search refines and prunes
+    surface = simulate(model, "surface", strategy=strategy, interval_minutes=5)
+    lockstep = simulate(model, "lockstep", strategy=strategy, interval_minutes=5)
+    assert_same_result(surface, lockstep)
+    for key in ("variants_evaluated", "variants_abandoned", "station_evaluations"):
+        assert surface["search"][key] == lockstep["search"][key]
+
+
+def test_variant_details_match_sequential(provider, model):
+    weather_store, station_store = ml_core.WeatherForecastStore(), ml_core.StationContextStore()
+    schedule, shifts = ml_core._prepare_simulation(TRAIN, SEARCH["interval_minutes"], SEARCH["total_hours"],
+                                                   weather_store, station_store)
+    lockstep = ml_core.simulate_variants_lockstep(schedule, shifts, *model, weather_store, station_store)
+    surface = ml_core.DelaySurface(schedule, shifts, *model, weather_store, station_store).simulate(shifts)
+    for shift, a, b in zip(shifts, lockstep, surface):
+        expected = ml_core.simulate_schedule_variant(ml_core._shift_schedule(schedule, shift), schedule,
+                                                     *model, weather_store, station_store)
+        for result in (a, b):
+            assert result["total_delay"] == expected["total_delay"]
+            pd.testing.assert_frame_equal(result.detail_df(), expected.detail_df(), check_exact=True)
+
+
+def test_incremental_matches_fresh_run(provider, model, monkeypatch):
+    weather_store, station_store = ml_core.WeatherForecastStore(), ml_core.StationContextStore()
+    incremental = ml_core.IncrementalSimulation(TRAIN, *model, **SEARCH, weather_store=weather_store,
+                                                station_store=station_store)
+    first = incremental.run()
+    assert first["diff"]["full"]
+
+    weather_store.clear(), station_store.clear()
+    unchanged = incremental.run()
+    assert not unchanged["diff"]["full"]
+    assert unchanged["diff"]["variants_recomputed"] == 0
+    assert_same_result(unchanged, first)
+
+    # new station context at one stop and new weather at another, as after a forecast refresh
+    stops = provider.train_schedule(TRAIN)["schedule"]
+    for forecast in provider.station(stops[8]["station_code"])["forecasts"]:
+        forecast["trains_nearby"] = (forecast["trains_nearby"] + 3) % 10
+    changed_at = (stops[4]["lat"], stops[4]["lon"])
+    weather_values = provider._weather_values
+
+    def shifted_weather(lat, lon):
+        values = weather_values(lat, lon)
+        if (lat, lon) == changed_at:
+            values[0] += np.float32(4)
+        return values
+
+    monkeypatch.setattr(provider, "_weather_values", shifted_weather)
+    weather_store.clear(), station_store.clear()
+    changed = incremental.run()
+    assert 0 < changed["diff"]["variants_recomputed"] <= changed["diff"]["variants_total"]
+    assert changed["diff"]["station_evaluations_reused"] > 0
+    assert_same_result(changed, simulate(model, "surface"))
+
+
+def test_search_reports_model_rows(provider, model):
+    lockstep = simulate(model, "lockstep", strategy="adaptive", interval_minutes=5)["search"]
+    surface = simulate(model, "surface", strategy="adaptive", interval_minutes=5)["search"]
+    assert lockstep["model_rows_predicted"] == lockstep["station_evaluations"]
+    # the adaptive surface only predicts cells the visited offsets reach
+    assert 0 < surface["model_rows_predicted"] <= lockstep["model_rows_predicted"]
+    assert surface["model_rows_saved"] == (surface["full_grid_station_evaluations"]
+                                           - surface["model_rows_predicted"])
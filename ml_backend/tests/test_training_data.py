@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from training_data import read_arrival_logs
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_unlisted_string_columns_are_categorical(tmp_path):
+    raw = pd.read_csv(os.path.join(BACKEND, "synthetic_dataset.csv"), nrows=60)
+    raw["coach_class"] = np.where(np.arange(len(raw)) % 3, "sleeper", "ac")
+    raw["platform"] = np.arange(len(raw)) % 5
+    raw["rake_note"] = np.nan                  # empty in every row
+    path = tmp_path / "logs.csv"
+    raw.to_csv(path, index=False)
+
+    df = read_arrival_logs(str(path), chunk_rows=25)
+    assert isinstance(df["coach_class"].dtype, pd.CategoricalDtype)
+    assert set(df["coach_class"].cat.categories) >= {"sleeper", "ac"}
+    assert isinstance(df["rake_note"].dtype, pd.CategoricalDtype)
+    assert (df["rake_note"] == "NA").all()
+    assert df["platform"].dtype == np.float64
+    for col in ("weather_main", "day_of_week", "maintenance_type"):
+        assert isinstance(df[col].dtype, pd.CategoricalDtype)
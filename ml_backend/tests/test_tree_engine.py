@@ -0,0 +1,87 @@
+"""FlatTreeEnsemble must reproduce sklearn/XGBoost predictions on the training data."""
+import os
+
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.preprocessing import LabelEncoder
+
+from encoders import CategoricalEncoder
+from training_data import read_arrival_logs
+from tree_engine import FlatTreeEnsemble, ParityError, build_engine, check_parity
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSV = os.path.join(BACKEND, "synthetic_dataset.csv")
+
+xgboost = pytest.importorskip("xgboost")
+
+
+@pytest.fixture(scope="module")
+def training():
+    """Encoded features and target, as train_model.py builds them."""
+    df = read_arrival_logs(CSV)
+    cat_cols = [c for c in df.select_dtypes(include="category").columns if c != "overall_delay_minutes"]
+    le_dict = {col: LabelEncoder().fit(df[col].astype(str)) for col in cat_cols}
+    df = CategoricalEncoder.from_le_dict(le_dict).transform(df)
+    return df.drop(columns=["overall_delay_minutes"]).astype(float), df["overall_delay_minutes"], le_dict
+
+
+def with_missing(X, fraction: float = 0.1, seed: int = 0):
+    X = X.copy()
+    rng = np.random.default_rng(seed)
+    for col in ("temp", "humidity", "trains_nearby"):
+        X.loc[rng.random(len(X)) < fraction, col] = np.nan
+    return X
+
+
+MODELS = {
+    "random_forest": lambda: RandomForestRegressor(n_estimators=20, max_depth=8, random_state=0),
+    "gradient_boosting": lambda: GradientBoostingRegressor(n_estimators=30, max_depth=4, random_state=0),
+    "xgboost": lambda: xgboost.XGBRegressor(n_estimators=30, max_depth=5, random_state=0, verbosity=0),
+}
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_predictions_match(training, name):
+    X, y, le_dict = training
+    model = MODELS[name]().fit(X, y)
+    engine = build_engine(model, "native")
+    assert isinstance(engine, FlatTreeEnsemble)
+    if name == "xgboost":
+        # float32 accumulation: same as XGBoost to rounding
+        np.testing.assert_allclose(engine.predict(X), model.predict(X), rtol=0, atol=1e-4)
+        assert check_parity(model, le_dict, CSV, atol=1e-4) <= 1e-4
+    else:
+        np.testing.assert_array_equal(engine.predict(X), model.predict(X))
+        assert check_parity(model, le_dict, CSV) == 0.0
+
+
+# GradientBoostingRegressor does not accept NaN
+@pytest.mark.parametrize("name", ["random_forest", "xgboost"])
+def test_missing_values_follow_the_model(training, name):
+    X, y, _ = training
+    X_train = with_missing(X, seed=1)
+    model = MODELS[name]().fit(X_train, y)
+    engine = FlatTreeEnsemble.from_model(model)
+    X_test = with_missing(X, fraction=0.3, seed=2)
+    np.testing.assert_allclose(engine.predict(X_test), model.predict(X_test),
+                               rtol=0, atol=1e-4 if name == "xgboost" else 0)
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_lower_bound_never_exceeds_predictions(training, name):
+    X, y, _ = training
+    engine = FlatTreeEnsemble.from_model(MODELS[name]().fit(X, y))
+    sample = X.iloc[:200]
+    free = sample.copy()
+    free[["temp", "humidity", "tracks_on_route", "trains_nearby"]] = np.nan
+    assert (engine.lower_bound(free) <= engine.predict(sample)).all()
+
+
+def test_parity_error_raised(training, monkeypatch):
+    X, y, le_dict = training
+    model = MODELS["gradient_boosting"]().fit(X, y)
+    predict = model.predict
+    monkeypatch.setattr(model, "predict", lambda X: predict(X) + 1e-3)
+    with pytest.raises(ParityError):
+        check_parity(model, le_dict, CSV)
@@ -0,0 +1,101 @@
+# timing.py
+import contextvars
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# collectors of the current context; copied into worker threads via `propagate`
+_collectors = contextvars.ContextVar("timing_collectors", default=())
+# process-wide (stage, seconds) and (counter, n, labels) callbacks
+_sinks = []
+_counter_sinks = []
+
+
+def _counter_key(counter: str, labels: dict) -> str:
+    if not labels:
+        return counter
+    return counter + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+class StageTimes:
+    """Call count and total seconds per stage, plus counters, for one measured block."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, key: str, n: int):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {stage: {"count": count, "seconds": total}
+                    for stage, (count, total) in sorted(self.stages.items())}
+
+    def counters_dict(self) -> dict:
+        with self._lock:
+            return dict(sorted(self.counters.items()))
+
+
+@contextmanager
+def span(stage: str):
+    """Time the block as `stage` for every active collector and sink."""
+    collectors = _collectors.get()
+    if not collectors and not _sinks:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        for collector in collectors:
+            collector.add(stage, elapsed)
+        for sink in _sinks:
+            sink(stage, elapsed)
+
+
+def count(counter: str, n: int = 1, **labels):
+    """Add `n` to `counter` (e.g. cache hits) for every active collector and sink."""
+    collectors = _collectors.get()
+    if collectors:
+        key = _counter_key(counter, labels)
+        for collector in collectors:
+            collector.count(key, n)
+    for sink in _counter_sinks:
+        sink(counter, n, labels)
+
+
+@contextmanager
+def collect_stages():
+    """Yield a StageTimes filled by every span inside the block (spans may nest)."""
+    times = StageTimes()
+    token = _collectors.set(_collectors.get() + (times,))
+    try:
+        yield times
+    finally:
+        _collectors.reset(token)
+
+
+def add_sink(sink, counter_sink=None):
+    """
+    Register `sink(stage, seconds)` for every span in the process and,
+    optionally, `counter_sink(counter, n, labels)` for every `count`.
+    """
+    _sinks.append(sink)
+    if counter_sink is not None:
+        _counter_sinks.append(counter_sink)
+
+
+def propagate(fn):
+    """Wrap `fn` to run in a copy of the caller's context (for thread pools)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
@@ -0,0 +1,175 @@
+# training_data.py
+"""
+Arrival-log CSV -> cleaned training frame for train_model.py.
+
+The CSV is read in chunks with explicit dtypes (numeric features as
+float64, string features as `category`, columns the model never uses
+skipped; columns not listed here are typed from a sample of rows),
+times are parsed with one fixed ISO-8601 parser and the target is
+computed with column arithmetic. The cleaned frame is cached
+in TRAIN_CACHE_DIR as Parquet (pickle when no Parquet engine is
+installed), keyed by the CSV's path, size and mtime, so reruns on the
+same logs skip parsing entirely.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype, union_categoricals
+
+# bump when the cleaning below changes, so stale caches are ignored
+PIPELINE_VERSION = 2
+CHUNK_ROWS = int(os.environ.get("TRAIN_CHUNK_ROWS", "250000"))
+SAMPLE_ROWS = 10_000
+CACHE_DIR = os.environ.get("TRAIN_CACHE_DIR", ".train_cache")
+
+NUMERIC_COLUMNS = [
+    "temp", "feels_like", "temp_min", "temp_max", "humidity", "pressure", "wind_speed",
+    "wind_deg", "visibility", "lat", "lon", "altitude", "sea_level", "dew_point", "clouds",
+    "dwell_minutes", "day_of_journey", "tracks_on_route", "trains_nearby"
+]
+CATEGORICAL_COLUMNS = ["weather_main", "day_of_week", "maintenance_type"]
+# compared with each other for the origin-station rule, then dropped
+STATION_COLUMNS = ["origin_code", "dest_code", "curr_station_code"]
+TIME_COLUMNS = ["scheduled_arr_time", "scheduled_dept_time", "actual_arr_time", "actual_dept_time"]
+# never read
+SKIP_COLUMNS = {"train_number", "train_name", "origin_name", "dest_name", "weather_desc"}
+# read, used for the target, then dropped
+DROP_COLUMNS = ["temp_min", "temp_max", "origin_code", "dest_code", "scheduled_arr_time", "actual_arr_time",
+                "scheduled_dept_time", "actual_dept_time", "dwell_minutes", "curr_station_code"]
+
+CSV_DTYPES = {**{c: "float64" for c in NUMERIC_COLUMNS},
+              **{c: "category" for c in CATEGORICAL_COLUMNS},
+              **{c: "str" for c in STATION_COLUMNS + TIME_COLUMNS}}
+
+
+def csv_dtypes(path: str, sample_rows: int = SAMPLE_ROWS) -> dict:
+    """
+    CSV_DTYPES plus every other column that is read: float64 when its
+    first `sample_rows` values are numbers, `category` otherwise (also when
+    they are all empty), so a feature added to the logs is encoded too.
+    """
+    known = set(CSV_DTYPES) | SKIP_COLUMNS
+    sample = pd.read_csv(path, nrows=sample_rows, usecols=lambda c: c not in known)
+    extra = {}
+    for col in sample.columns:
+        values = sample[col]
+        numeric = is_numeric_dtype(values) and not is_bool_dtype(values) and values.notna().any()
+        extra[col] = "float64" if numeric else "category"
+    return {**CSV_DTYPES, **extra}
+
+
+def _total_seconds(td: pd.Series) -> np.ndarray:
+    """
+    `Timedelta.total_seconds()` per element (NaT -> NaN): whole seconds plus
+    whole microseconds / 1e6. `.dt.total_seconds()` divides once instead and
+    can differ from it in the last bit.
+    """
+    us = td.to_numpy("timedelta64[ns]").view(np.int64) // 1000
+    seconds = us // 1_000_000
+    out = seconds + (us - seconds * 1_000_000) / 1e6
+    out[td.isna().to_numpy()] = np.nan
+    return out
+
+def overall_delay_minutes(df: pd.DataFrame) -> np.ndarray:
+    """
+    Departure delay at the origin station, else the larger of arrival and
+    departure delay, in minutes. Same values as the old row-wise
+    `max(arr_delay, dept_delay)`: `max` keeps its first argument unless
+    the second is strictly greater, NaN included.
+    """
+    arr_delay = _total_seconds(df["actual_arr_time"] - df["scheduled_arr_time"]) / 60
+    dept_delay = _total_seconds(df["actual_dept_time"] - df["scheduled_dept_time"]) / 60
+    at_origin = (df["origin_code"] == df["curr_station_code"]).to_numpy(dtype=bool)
+    return np.where(at_origin, dept_delay, np.where(dept_delay > arr_delay, dept_delay, arr_delay))
+
+
+def _prepare_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Parse times and compute the target; row filtering waits for the whole file."""
+    for col in TIME_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = pd.to_datetime(chunk[col], format="ISO8601", errors="coerce")
+    if all(c in chunk.columns for c in TIME_COLUMNS + ["origin_code", "curr_station_code"]):
+        chunk["overall_delay_minutes"] = overall_delay_minutes(chunk)
+    return chunk.drop(columns=[c for c in DROP_COLUMNS if c in chunk.columns and c != "dwell_minutes"])
+
+
+def _concat(chunks: list) -> pd.DataFrame:
+    """Concatenate chunks, merging per-chunk categories instead of falling back to object."""
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = [c for c in chunks[0].columns if isinstance(chunks[0][c].dtype, pd.CategoricalDtype)]
+    merged = {c: union_categoricals([chunk[c] for chunk in chunks]) for c in categorical}
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for c in categorical:
+        df[c] = merged[c]
+    return df[chunks[0].columns]
+
+
+def read_arrival_logs(path: str, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Clean the raw CSV into the training frame: model features (categoricals
+    still as strings, missing ones as "NA") plus `overall_delay_minutes`.
+    """
+    reader = pd.read_csv(path, dtype=csv_dtypes(path), usecols=lambda c: c not in SKIP_COLUMNS,
+                         chunksize=chunk_rows)
+    df = _concat([_prepare_chunk(chunk) for chunk in reader])
+
+    # means over every row, before the dwell filter
+    if "humidity" in df.columns:
+        df["humidity"] = df["humidity"].fillna(round(df["humidity"].mean()))
+    if "altitude" in df.columns:
+        df["altitude"] = df["altitude"].fillna(round(df["altitude"].mean(), 2))
+    if "dwell_minutes" in df.columns:
+        df = df[df["dwell_minutes"] >= 0]
+
+    if "overall_delay_minutes" in df.columns:
+        df["overall_delay_minutes"] = df["overall_delay_minutes"].clip(lower=0)
+    else:
+        df["overall_delay_minutes"] = df.get("dwell_minutes", pd.Series(np.zeros(len(df)), index=df.index))
+    df = df.drop(columns=[c for c in DROP_COLUMNS if c in df.columns])
+
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if "NA" not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories("NA")
+            df[col] = df[col].fillna("NA")
+    return df.reset_index(drop=True)
+
+
+def _parquet_engine() -> str | None:
+    for module in ("pyarrow", "fastparquet"):
+        try:
+            __import__(module)
+            return module
+        except ImportError:
+            continue
+    return None
+
+def cache_path(path: str, cache_dir: str = CACHE_DIR) -> str:
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{PIPELINE_VERSION}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    ext = ".parquet" if _parquet_engine() else ".pkl"
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest}{ext}")
+
+def load_training_frame(path: str, use_cache: bool = True, cache_dir: str = CACHE_DIR,
+                        chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """`read_arrival_logs`, served from / written to the on-disk cache."""
+    if not use_cache:
+        return read_arrival_logs(path, chunk_rows)
+    cached = cache_path(path, cache_dir)
+    if os.path.exists(cached):
+        return pd.read_parquet(cached) if cached.endswith(".parquet") else pd.read_pickle(cached)
+
+    df = read_arrival_logs(path, chunk_rows)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    if cached.endswith(".parquet"):
+        df.to_parquet(tmp, engine=_parquet_engine(), index=False)
+    else:
+        df.to_pickle(tmp)
+    os.replace(tmp, cached)
+    return df
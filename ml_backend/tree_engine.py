@@ -0,0 +1,231 @@
+# tree_engine.py
+import json
+import numpy as np
+import pandas as pd
+
+
+class ParityError(Exception):
+    """Raised when the native engine does not reproduce the model's predictions."""
+
+
+class FlatTreeEnsemble:
+    """
+    A fitted tree ensemble exported into flat NumPy node arrays.
+
+    All trees live in one set of arrays (feature, threshold, left, right,
+    value), indexed by global node id; leaves point to themselves so every
+    sample can be walked `max_depth` steps in lockstep. Predictions skip
+    sklearn's input validation and DataFrame handling, which dominate the
+    cost of the small batches the simulator sends.
+
+    Leaf values are summed in tree order (init first), so sklearn
+    RandomForest/GradientBoosting predictions are reproduced bit for bit.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, missing_left, roots,
+                 max_depth: int, base_score: float, divisor: float,
+                 feature_names, strict_less: bool = False, source: str = ""):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.missing_left = np.asarray(missing_left, dtype=bool)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+        self.base_score = float(base_score)
+        self.divisor = float(divisor)
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.n_features_in_ = len(self.feature_names_in_)
+        self.strict_less = bool(strict_less)
+        self.source = source
+
+    # ---- export
+    @classmethod
+    def from_model(cls, model) -> "FlatTreeEnsemble":
+        name = type(model).__name__
+        if name == "RandomForestRegressor":
+            trees = [est.tree_ for est in model.estimators_]
+            return cls._from_sklearn_trees(trees, 1.0, 0.0, len(trees), model.feature_names_in_, name)
+        if name == "GradientBoostingRegressor":
+            if model.init_ != "zero" and type(model.init_).__name__ != "DummyRegressor":
+                raise TypeError("only constant init estimators are supported")
+            base = 0.0 if model.init_ == "zero" else float(np.ravel(model.init_.constant_)[0])
+            trees = [est.tree_ for est in model.estimators_[:, 0]]
+            return cls._from_sklearn_trees(trees, model.learning_rate, base, 1.0,
+                                           model.feature_names_in_, name)
+        if name == "XGBRegressor":
+            return cls._from_xgboost(model)
+        raise TypeError(f"{name} is not a supported tree ensemble")
+
+    @classmethod
+    def _from_sklearn_trees(cls, trees, scale, base_score, divisor, feature_names, source):
+        feature, threshold, left, right, value, missing_left, roots = [], [], [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            ids = np.arange(tree.node_count, dtype=np.int32) + offset
+            is_leaf = tree.children_left < 0
+            roots.append(offset)
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, 0.0, tree.threshold))
+            left.append(np.where(is_leaf, ids, tree.children_left + offset))
+            right.append(np.where(is_leaf, ids, tree.children_right + offset))
+            value.append(scale * tree.value[:, 0, 0])
+            missing_left.append(getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=bool)).astype(bool))
+            offset += tree.node_count
+        max_depth = max(tree.max_depth for tree in trees)
+        return cls(np.concatenate(feature), np.concatenate(threshold), np.concatenate(left),
+                   np.concatenate(right), np.concatenate(value), np.concatenate(missing_left),
+                   roots, max_depth, base_score, divisor, feature_names, source=source)
+
+    @classmethod
+    def _from_xgboost(cls, model):
+        booster = model.get_booster()
+        feature_names = getattr(model, "feature_names_in_", None)
+        feature_names = list(booster.feature_names if feature_names is None else feature_names)
+        index = {name: i for i, name in enumerate(feature_names)}
+        config = json.loads(booster.save_config())
+        base_score = float(str(config["learner"]["learner_model_param"]["base_score"]).strip("[]"))
+
+        feature, threshold, left, right, value, missing_left, roots = [], [], [], [], [], [], []
+        max_depth = 0
+        for dump in booster.get_dump(dump_format="json"):
+            nodes = {}
+            stack = [(json.loads(dump), 0)]
+            while stack:
+                node, depth = stack.pop()
+                nodes[node["nodeid"]] = node
+                max_depth = max(max_depth, depth)
+                stack.extend((child, depth + 1) for child in node.get("children", []))
+            offset = len(feature)
+            roots.append(offset)
+            for nid in range(len(nodes)):
+                node = nodes[nid]
+                if "leaf" in node:
+                    feature.append(0); threshold.append(0.0)
+                    left.append(offset + nid); right.append(offset + nid)
+                    value.append(float(node["leaf"])); missing_left.append(False)
+                else:
+                    split = node["split"]
+                    feature.append(index[split] if split in index else int(split.lstrip("f")))
+                    threshold.append(float(np.float32(node["split_condition"])))
+                    left.append(offset + node["yes"]); right.append(offset + node["no"])
+                    value.append(0.0); missing_left.append(node["missing"] == node["yes"])
+        return cls(feature, threshold, left, right, value, missing_left, roots, max_depth,
+                   base_score, 1.0, feature_names, strict_less=True, source="XGBRegressor")
+
+    # ---- inference
+    def _as_matrix(self, X) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            X = X.reindex(columns=self.feature_names_in_, fill_value=0).to_numpy(dtype=np.float32)
+        return np.ascontiguousarray(X, dtype=np.float32)
+
+    def apply(self, X) -> np.ndarray:
+        """Global leaf id reached in every tree, shape (n_samples, n_trees)."""
+        X = self._as_matrix(X)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[nodes]].astype(np.float64)
+            thr = self.threshold[nodes]
+            go_left = (x < thr) if self.strict_less else (x <= thr)
+            go_left |= np.isnan(x) & self.missing_left[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        if self.strict_less:
+            # XGBoost accumulates in float32
+            margin = self.value[leaves].astype(np.float32).sum(axis=1, dtype=np.float32)
+            return (np.float32(self.base_score) + margin).astype(np.float64)
+        # accumulate sequentially in tree order, exactly like sklearn
+        terms = np.empty((leaves.shape[1] + 1, leaves.shape[0]))
+        terms[0] = self.base_score
+        terms[1:] = self.value[leaves].T
+        return np.add.accumulate(terms, axis=0)[-1] / self.divisor
+
+    def lower_bound(self, X) -> np.ndarray:
+        """
+        A value no prediction can fall below, per row, when NaN entries of
+        `X` may take any value: splits on a NaN feature follow both
+        children and each tree contributes its smallest reachable leaf.
+        """
+        X = self._as_matrix(X)
+        ids = np.arange(len(self.feature))
+        is_leaf = self.left == ids
+        internal = ids[~is_leaf]
+        reachable = np.zeros((X.shape[0], len(ids)), dtype=bool)
+        reachable[:, self.roots] = True
+        for _ in range(self.max_depth):
+            x = X[:, self.feature[internal]].astype(np.float64)
+            thr = self.threshold[internal]
+            free = np.isnan(x)
+            go_left = (x < thr) if self.strict_less else (x <= thr)
+            nxt = reachable & is_leaf
+            nxt[:, self.left[internal]] |= reachable[:, internal] & (go_left | free)
+            nxt[:, self.right[internal]] |= reachable[:, internal] & (~go_left | free)
+            reachable = nxt
+        leaf_values = np.where(reachable & is_leaf, self.value, np.inf)
+        per_tree = np.minimum.reduceat(leaf_values, self.roots, axis=1)
+        if self.strict_less:
+            # float32 accumulation can round below the exact sum
+            total = self.base_score + per_tree.sum(axis=1)
+            return total - 1e-4 * np.maximum(1.0, np.abs(total))
+        terms = np.empty((per_tree.shape[1] + 1, per_tree.shape[0]))
+        terms[0] = self.base_score
+        terms[1:] = per_tree.T
+        return np.add.accumulate(terms, axis=0)[-1] / self.divisor
+
+
+def build_engine(model, engine: str = "native"):
+    """
+    Return the object used for `predict`: the flat engine for supported
+    tree ensembles when engine="native", otherwise the model itself.
+    """
+    if engine == "sklearn":
+        return model
+    if engine != "native":
+        raise ValueError(f"Unknown inference engine: {engine}")
+    try:
+        return FlatTreeEnsemble.from_model(model)
+    except TypeError:
+        return model
+
+
+def check_parity(model, le_dict, csv_path: str = "synthetic_dataset.csv", atol: float = 0.0) -> float:
+    """
+    Compare FlatTreeEnsemble against `model.predict` on the training CSV and
+    return the max absolute difference; raises ParityError above `atol`.
+    """
+    from encoders import CategoricalEncoder
+
+    df = pd.read_csv(csv_path)
+    X = df.reindex(columns=model.feature_names_in_)
+    encoder = CategoricalEncoder.from_le_dict(le_dict)
+    for col in X.columns:
+        if col in encoder:
+            X[col] = encoder.encode(col, X[col].fillna("NA"))
+    X = X.astype(float)
+
+    engine = FlatTreeEnsemble.from_model(model)
+    diff = float(np.max(np.abs(engine.predict(X) - model.predict(X))))
+    if not diff <= atol:
+        raise ParityError(f"native engine differs from {type(model).__name__}.predict by {diff}")
+    return diff
+
+
+if __name__ == "__main__":
+    import pickle
+    import sys
+
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "final_model.pkl"
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    with open("le_dict.pkl", "rb") as f:
+        le_dict = pickle.load(f)
+    atol = 1e-4 if type(model).__name__ == "XGBRegressor" else 0.0
+    try:
+        print(f"parity OK, max abs diff = {check_parity(model, le_dict, atol=atol)}")
+    except ParityError as e:
+        sys.exit(f"parity FAILED: {e}")
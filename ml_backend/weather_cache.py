@@ -0,0 +1,339 @@
+# weather_cache.py
+"""
+Two-level cache of decoded Open-Meteo forecasts, shared by all stations
+that fall in the same grid cell.
+
+A cell is a location rounded to 4 decimals (about 10 m), so stops that
+share coordinates share one fetch. WEATHER_GRID_DEGREES > 0 snaps to a
+coarser grid of cell centres instead: fewer fetches, but every station
+in a cell gets the forecast at the centre rather than its own, which
+changes predictions, so it is off by default. A cache key is (forecast
+run, cell), where the run is the WEATHER_RUN_MINUTES wall-clock bucket
+of the fetch: everything fetched during a run is served until the next
+one starts, then refetched.
+
+Misses are fetched for the full forecast horizon, not the simulation's
+window: one entry then answers every train and search that reads the
+cell during the run, at the price of the smaller windowed payloads
+HttpProvider.weather_batch sends when the cache is off (WEATHER_CACHE=off).
+
+    L1  in-process LRU of decoded arrays (WEATHER_L1_SIZE cells)
+    L2  shared between processes (WEATHER_L2):
+          "disk"       (default) one .npz per cell under WEATHER_CACHE_DIR
+                       (default ml_backend/.weather_cache, whatever the
+                       working directory, so the API, main.py and gunicorn
+                       share it), written to a temp file and renamed into
+                       place, so concurrent workers never read a partial entry
+          "redis://…"  any Redis server (needs the `redis` package)
+          "off"        L1 only
+
+`CachedWeatherProvider` puts the cache in front of another provider's
+weather calls; lookups are counted as cache_lookups{cache="weather_l1"|
+"weather_l2"} and summarised by `WeatherCache.stats()`.
+"""
+import io
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from providers import DataProvider, WEATHER_FIELDS, _slice_window
+from timing import count
+
+GRID_DEGREES = float(os.environ.get("WEATHER_GRID_DEGREES", "0"))
+RUN_MINUTES = float(os.environ.get("WEATHER_RUN_MINUTES", "60"))
+L1_SIZE = int(os.environ.get("WEATHER_L1_SIZE", "4096"))
+L2_SPEC = os.environ.get("WEATHER_L2", "disk")
+CACHE_DIR = os.environ.get("WEATHER_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".weather_cache"))
+
+
+def snap(lat: float, lon: float, grid: float = GRID_DEGREES) -> tuple:
+    """Centre of the grid cell containing (lat, lon); grid <= 0 keeps the coordinates (to 4 decimals)."""
+    if grid <= 0:
+        return round(float(lat), 4), round(float(lon), 4)
+    # + 0.0 folds -0.0 into 0.0, so both name the same cell
+    return (round(round(float(lat) / grid) * grid, 4) + 0.0,
+            round(round(float(lon) / grid) * grid, 4) + 0.0)
+
+def _dumps(series: tuple) -> bytes:
+    epochs, values = series
+    buffer = io.BytesIO()
+    np.savez(buffer, epochs=np.asarray(epochs, dtype=np.int64),
+             values=np.stack([np.asarray(values[name], dtype=np.float32) for name in WEATHER_FIELDS]))
+    return buffer.getvalue()
+
+def _loads(data: bytes) -> tuple:
+    with np.load(io.BytesIO(data)) as npz:
+        epochs, columns = npz["epochs"], npz["values"]
+    return _frozen((epochs, {name: columns[i] for i, name in enumerate(WEATHER_FIELDS)}))
+
+def _frozen(series: tuple) -> tuple:
+    """Mark the arrays read-only: one cached series is handed to every caller."""
+    epochs, values = series
+    for array in (epochs, *values.values()):
+        if isinstance(array, np.ndarray):
+            array.setflags(write=False)
+    return series
+
+
+# --- L2 backends: get(run, cell) -> bytes | None, put(run, cell, bytes)
+class DiskL2:
+    """One file per cell under <path>/<run>/; older runs are deleted as new ones start."""
+
+    def __init__(self, path: str = CACHE_DIR):
+        self.path = path
+        self._current_run = None
+
+    def _file(self, run: int, cell: tuple) -> str:
+        return os.path.join(self.path, str(run), f"{cell[0]:.4f}_{cell[1]:.4f}.npz")
+
+    def get(self, run: int, cell: tuple) -> bytes | None:
+        try:
+            with open(self._file(run, cell), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, run: int, cell: tuple, data: bytes):
+        path = self._file(run, cell)
+        if self._current_run != run:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._prune(run)
+            self._current_run = run
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _prune(self, run: int):
+        # keep the previous run for workers still finishing a simulation on it
+        for name in os.listdir(self.path):
+            if name.isdigit() and int(name) < run - 1:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+class RedisL2:
+    """
+    Entries in a Redis-compatible store; `client` needs get(key) and
+    set(key, value, ex=seconds), so redis.Redis or any stand-in with the
+    same two methods works.
+    """
+
+    def __init__(self, client, ttl_seconds: float, prefix: str = "ml:weather"):
+        self.client = client
+        self.ttl = max(1, int(ttl_seconds))
+        self.prefix = prefix
+
+    def _key(self, run: int, cell: tuple) -> str:
+        return f"{self.prefix}:{run}:{cell[0]:.4f},{cell[1]:.4f}"
+
+    def get(self, run: int, cell: tuple) -> bytes | None:
+        return self.client.get(self._key(run, cell))
+
+    def put(self, run: int, cell: tuple, data: bytes):
+        self.client.set(self._key(run, cell), data, ex=self.ttl)
+
+
+def l2_from_env(spec: str = L2_SPEC, run_minutes: float = RUN_MINUTES):
+    if spec == "off":
+        return None
+    if spec == "disk":
+        return DiskL2(CACHE_DIR)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("WEATHER_L2=redis://... needs the `redis` package") from None
+        return RedisL2(redis.Redis.from_url(spec), ttl_seconds=2 * run_minutes * 60)
+    raise ValueError(f"Unknown WEATHER_L2: {spec}")
+
+
+class WeatherCache:
+    """L1 + optional L2 of full-horizon series keyed by (run, cell)."""
+
+    def __init__(self, l2=None, max_cells: int = L1_SIZE, run_minutes: float = RUN_MINUTES,
+                 clock=time.time):
+        self.l2 = l2
+        self.max_cells = max_cells
+        self.run_seconds = run_minutes * 60
+        self.clock = clock
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"l1_hits": 0, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0, "l2_errors": 0,
+                       "fetched": 0, "requested": 0, "warmed": 0}
+
+    def run(self) -> int:
+        return int(self.clock() // self.run_seconds)
+
+    def run_start(self, run: int) -> float:
+        """Wall-clock time (`clock` seconds) at which `run` begins."""
+        return run * self.run_seconds
+
+    def record_requests(self, n: int):
+        """Locations asked for (before cell dedup), for the overall hit rate."""
+        self._add(requested=n)
+
+    def _add(self, **n):
+        with self._lock:
+            for name, value in n.items():
+                self._stats[name] += value
+
+    def get(self, run: int, cell: tuple) -> tuple | None:
+        with self._lock:
+            series = self._l1.get((run, cell))
+            if series is not None:
+                self._l1.move_to_end((run, cell))
+        if series is not None:
+            self._add(l1_hits=1)
+            count("cache_lookups", cache="weather_l1", result="hit")
+            return series
+        self._add(l1_misses=1)
+        count("cache_lookups", cache="weather_l1", result="miss")
+        if self.l2 is None:
+            return None
+        try:
+            data = self.l2.get(run, cell)
+        except Exception:
+            # a broken shared tier degrades to fetching, never fails a simulation
+            self._add(l2_errors=1)
+            data = None
+        if data is None:
+            self._add(l2_misses=1)
+            count("cache_lookups", cache="weather_l2", result="miss")
+            return None
+        self._add(l2_hits=1)
+        count("cache_lookups", cache="weather_l2", result="hit")
+        series = _loads(data)
+        self._remember(run, cell, series)
+        return series
+
+    def has(self, run: int, cell: tuple) -> bool:
+        """Whether (run, cell) is cached, without counting a lookup; L2 entries are pulled into L1."""
+        with self._lock:
+            if (run, cell) in self._l1:
+                return True
+        if self.l2 is None:
+            return False
+        try:
+            data = self.l2.get(run, cell)
+        except Exception:
+            self._add(l2_errors=1)
+            return False
+        if data is None:
+            return False
+        self._remember(run, cell, _loads(data))
+        return True
+
+    def put(self, run: int, cell: tuple, series: tuple, warmed: bool = False):
+        series = _frozen(series)
+        self._remember(run, cell, series)
+        self._add(**{"warmed" if warmed else "fetched": 1})
+        if self.l2 is not None:
+            try:
+                self.l2.put(run, cell, _dumps(series))
+            except Exception:
+                self._add(l2_errors=1)
+
+    def _remember(self, run: int, cell: tuple, series: tuple):
+        with self._lock:
+            if self._l1 and next(iter(self._l1))[0] < run - 1:
+                # runs before the previous one are never served again (the
+                # previous one still is until the clock reaches `run`)
+                for key in [key for key in self._l1 if key[0] < run - 1]:
+                    del self._l1[key]
+            self._l1[(run, cell)] = series
+            self._l1.move_to_end((run, cell))
+            while len(self._l1) > self.max_cells:
+                self._l1.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, cells=len(self._l1))
+        lookups = stats["l1_hits"] + stats["l1_misses"]
+        stats["l1_hit_rate"] = stats["l1_hits"] / lookups if lookups else None
+        l2_lookups = stats["l2_hits"] + stats["l2_misses"]
+        stats["l2_hit_rate"] = stats["l2_hits"] / l2_lookups if l2_lookups else None
+        # share of requested locations served without an upstream fetch
+        stats["hit_rate"] = 1 - stats["fetched"] / stats["requested"] if stats["requested"] else None
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+
+
+class CachedWeatherProvider(DataProvider):
+    """
+    `inner` with weather served from a WeatherCache. Misses are fetched
+    per distinct cell, full horizon (so one entry answers any window), in
+    multi-location requests; schedules and stations pass straight through.
+    """
+
+    def __init__(self, inner: DataProvider, cache: WeatherCache | None = None,
+                 grid_degrees: float = GRID_DEGREES):
+        self.inner = inner
+        self.cache = cache or WeatherCache(l2_from_env())
+        self.grid = grid_degrees
+
+    def train_schedule(self, train_number: int) -> dict:
+        return self.inner.train_schedule(train_number)
+
+    def station(self, station_code: str) -> dict:
+        return self.inner.station(station_code)
+
+    def _cells(self, coords: list) -> dict:
+        """{cell: series} for every cell of `coords`, fetching only the misses."""
+        run = self.cache.run()
+        self.cache.record_requests(len(coords))
+        found = {}
+        for lat, lon in coords:
+            cell = snap(lat, lon, self.grid)
+            if cell not in found:
+                found[cell] = self.cache.get(run, cell)
+        missing = [cell for cell, series in found.items() if series is None]
+        if not missing:
+            return found
+        if len(missing) == 1:
+            fetched = [self.inner.weather(*missing[0])]
+        else:
+            fetched = self.inner.weather_batch(missing, None, None)
+        for cell, series in zip(missing, fetched):
+            self.cache.put(run, cell, series)
+            found[cell] = series
+        return found
+
+    def train_bundle(self, train_number: int, after_minutes: float) -> dict:
+        return self.inner.train_bundle(train_number, after_minutes)
+
+    def list_trains(self, page: int, limit: int) -> dict:
+        return self.inner.list_trains(page, limit)
+
+    def list_stations(self, page: int, limit: int) -> dict:
+        return self.inner.list_stations(page, limit)
+
+    def uncached(self, coords: list, run: int) -> list:
+        """Distinct cells of `coords` with no entry for `run` in either tier."""
+        cells = dict.fromkeys(snap(lat, lon, self.grid) for lat, lon in coords)
+        return [cell for cell in cells if not self.cache.has(run, cell)]
+
+    def warm(self, coords: list, run: int) -> int:
+        """Fetch the uncached cells of `coords` into `run` (which may be the next one); returns how many."""
+        missing = self.uncached(coords, run)
+        if missing:
+            for cell, series in zip(missing, self.inner.weather_batch(missing, None, None)):
+                self.cache.put(run, cell, series, warmed=True)
+        return len(missing)
+
+    def weather(self, lat: float, lon: float) -> tuple[np.ndarray, dict]:
+        return self._cells([(lat, lon)])[snap(lat, lon, self.grid)]
+
+    def weather_batch(self, coords: list, start, end) -> list:
+        found = self._cells(coords)
+        series = [found[snap(lat, lon, self.grid)] for lat, lon in coords]
+        if start is None:
+            return series
+        return [_slice_window(s, start, end) for s in series]
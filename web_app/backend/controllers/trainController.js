@@ -1,4 +1,5 @@
 import TrainSchedule from "../models/TrainSchedule.js";
+import StationData from "../models/StationData.js";
 
 // @desc    Get all train schedules (with pagination and optional date filter)
 // @route   GET /api/trains?page=1&limit=10&date=YYYY-MM-DD
@@ -53,6 +54,80 @@ export const getTrainByNumber = async (req, res) => {
 };
 
 
+// Latest forecast before `from` (ties: the last one) or earliest after `to` (ties: the first one)
+const nearestOutside = (side, bound) => ({
+  $reduce: {
+    input: {
+      $filter: {
+        input: { $ifNull: ["$forecasts", []] },
+        as: "f",
+        cond: { [side === "before" ? "$lt" : "$gt"]: ["$$f.timestamp", bound] }
+      }
+    },
+    initialValue: null,
+    in: {
+      $cond: [
+        {
+          $or: [
+            { $eq: ["$$value", null] },
+            { [side === "before" ? "$gte" : "$lt"]: ["$$this.timestamp", "$$value.timestamp"] }
+          ]
+        },
+        "$$this",
+        "$$value"
+      ]
+    }
+  }
+});
+
+// @desc    Train schedule plus the StationData of every stop in one response. With
+//          after_minutes, forecasts are trimmed to [first arrival, last arrival +
+//          after_minutes], keeping the nearest forecast on either side of that window
+// @route   GET /api/trains/:train_number/bundle?after_minutes=960
+export const getTrainBundle = async (req, res) => {
+  try {
+    const train = await TrainSchedule.findOne({ train_number: req.params.train_number }).lean();
+    if (!train) return res.status(404).json({ message: "Train not found" });
+
+    const stops = train.schedule || [];
+    const codes = [...new Set(stops.map((s) => s.station_code).filter(Boolean))];
+    const arrivals = stops.filter((s) => s.scheduled_arrival).map((s) => new Date(s.scheduled_arrival).getTime());
+    const afterMinutes = Number(req.query.after_minutes);
+
+    const projection = { station_code: 1, station_name: 1, lat: 1, lon: 1, altitude: 1, forecasts: 1 };
+    let window = null;
+    if (arrivals.length && Number.isFinite(afterMinutes)) {
+      window = {
+        from: new Date(Math.min(...arrivals)),
+        to: new Date(Math.max(...arrivals) + afterMinutes * 60000)
+      };
+      projection.forecasts = {
+        $filter: {
+          input: { $ifNull: ["$forecasts", []] },
+          as: "f",
+          cond: { $and: [{ $gte: ["$$f.timestamp", window.from] }, { $lte: ["$$f.timestamp", window.to] }] }
+        }
+      };
+      projection.forecast_before = nearestOutside("before", window.from);
+      projection.forecast_after = nearestOutside("after", window.to);
+    }
+
+    const docs = await StationData.find({ station_code: { $in: codes } }, projection).lean();
+    // one document per code, the one getStationByCode's findOne would return
+    const byCode = new Map();
+    for (const { forecast_before, forecast_after, ...station } of docs) {
+      if (byCode.has(station.station_code)) continue;
+      station.forecasts = [forecast_before, ...(station.forecasts || []), forecast_after].filter(Boolean);
+      byCode.set(station.station_code, station);
+    }
+    const stations = [...byCode.values()];
+    res.json({ train, stations, window });
+  } catch (error) {
+    res.status(500).json({ error: error.message });
+  }
+};
+
+
 // @desc    Add a new train schedule
 // @route   POST /api/trains
 export const createTrainSchedule = async (req, res) => {
@@ -8,7 +8,7 @@ const forecastSchema = new mongoose.Schema({
 });
 
 const stationDataSchema = new mongoose.Schema({
-  station_code: { type: String, required: true },
+  station_code: { type: String, required: true, index: true },
   station_name: { type: String, required: true },
   lat: Number,
   lon: Number,
@@ -14,7 +14,7 @@ const stationSchema = new mongoose.Schema({
 });
 
 const trainScheduleSchema = new mongoose.Schema({
-  train_number: { type: Number, required: true },
+  train_number: { type: Number, required: true, index: true },
   train_name: { type: String, required: true },
   origin_code: { type: String, required: true },
   origin_name: { type: String, required: true },
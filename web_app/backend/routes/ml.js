@@ -3,6 +3,30 @@ import axios from "axios";
 
 const router = express.Router();
 const ML_BASE_URL = process.env.ML_BASE_URL; // set this on Render
+// a blocking simulation can take a while; job calls should answer fast
+const ML_SIMULATE_TIMEOUT_MS = parseInt(process.env.ML_SIMULATE_TIMEOUT_MS) || 120000;
+const ML_JOB_TIMEOUT_MS = parseInt(process.env.ML_JOB_TIMEOUT_MS) || 10000;
+
+const ml = axios.create({ baseURL: ML_BASE_URL });
+
+// optional search parameters forwarded to the ML service (validated there)
+const SEARCH_PARAMS = ["interval_minutes", "total_hours", "strategy", "prune"];
+const simulationBody = (body) => {
+  const out = { train_number: body.train_number };
+  for (const key of SEARCH_PARAMS) {
+    if (body[key] !== undefined) out[key] = body[key];
+  }
+  return out;
+};
+
+// forward the ML service's status/body when it answered, 500 otherwise
+const proxyError = (res, err, message) => {
+  console.error("ML proxy error:", err?.response?.data || err.message);
+  if (err?.response) {
+    return res.status(err.response.status).json(err.response.data);
+  }
+  res.status(500).json({ error: message });
+};
 
 router.post("/simulate", async (req, res) => {
   try {
@@ -10,11 +34,76 @@ router.post("/simulate", async (req, res) => {
     if (!train_number) {
       return res.status(400).json({ error: "train_number is required" });
     }
-    const { data } = await axios.post(`${ML_BASE_URL}/api/ml/simulate`, { train_number });
+    const debug = req.get("X-Debug-Timings");
+    const { data } = await ml.post("/api/ml/simulate", simulationBody(req.body), {
+      timeout: ML_SIMULATE_TIMEOUT_MS,
+      headers: debug ? { "X-Debug-Timings": debug } : {}
+    });
+    res.json(data);
+  } catch (err) {
+    proxyError(res, err, "ML simulation failed");
+  }
+});
+
+// @route   POST /api/ml/simulate/stream  -> NDJSON (or SSE) piped through as variants finish
+router.post("/simulate/stream", async (req, res) => {
+  try {
+    const { train_number } = req.body;
+    if (!train_number) {
+      return res.status(400).json({ error: "train_number is required" });
+    }
+    const upstream = await ml.post("/api/ml/simulate/stream", simulationBody(req.body), {
+      responseType: "stream",
+      timeout: ML_SIMULATE_TIMEOUT_MS,
+      headers: { Accept: req.get("Accept") || "application/x-ndjson" }
+    });
+    res.status(upstream.status);
+    res.set({
+      "Content-Type": upstream.headers["content-type"],
+      "Cache-Control": "no-cache",
+      "X-Accel-Buffering": "no"
+    });
+    res.flushHeaders();
+    req.on("close", () => upstream.data.destroy());
+    upstream.data.pipe(res);
+  } catch (err) {
+    console.error("ML proxy error:", err.message);
+    const status = err?.response?.status || 500;
+    res.status(status).json({ error: "ML simulation stream failed" });
+  }
+});
+
+// @route   POST /api/ml/jobs  -> 202 { job_id, status }
+router.post("/jobs", async (req, res) => {
+  try {
+    const { train_number } = req.body;
+    if (!train_number) {
+      return res.status(400).json({ error: "train_number is required" });
+    }
+    const { status, data } = await ml.post("/api/ml/jobs", simulationBody(req.body), { timeout: ML_JOB_TIMEOUT_MS });
+    res.status(status).json(data);
+  } catch (err) {
+    proxyError(res, err, "ML job submission failed");
+  }
+});
+
+// @route   GET /api/ml/jobs/:job_id  -> status, per-variant progress, result when done
+router.get("/jobs/:job_id", async (req, res) => {
+  try {
+    const { data } = await ml.get(`/api/ml/jobs/${encodeURIComponent(req.params.job_id)}`, { timeout: ML_JOB_TIMEOUT_MS });
+    res.json(data);
+  } catch (err) {
+    proxyError(res, err, "ML job lookup failed");
+  }
+});
+
+// @route   DELETE /api/ml/jobs/:job_id  -> cancel
+router.delete("/jobs/:job_id", async (req, res) => {
+  try {
+    const { data } = await ml.delete(`/api/ml/jobs/${encodeURIComponent(req.params.job_id)}`, { timeout: ML_JOB_TIMEOUT_MS });
     res.json(data);
   } catch (err) {
-    console.error("ML proxy error:", err?.response?.data || err.message);
-    res.status(500).json({ error: "ML simulation failed" });
+    proxyError(res, err, "ML job cancellation failed");
   }
 });
 
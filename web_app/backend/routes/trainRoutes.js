@@ -2,6 +2,7 @@ import express from "express";
 import {
   getAllTrains,
   getTrainByNumber,
+  getTrainBundle,
   createTrainSchedule,
   updateTrainSchedule
 } from "../controllers/trainController.js";
@@ -11,6 +12,8 @@ const router = express.Router();
 // @route   GET /api/trains?page=1&limit=10
 router.get("/", getAllTrains);
 router.get("/:train_number", getTrainByNumber);
+// @route   GET /api/trains/:train_number/bundle?after_minutes=960 (ML service bulk loader)
+router.get("/:train_number/bundle", getTrainBundle);
 router.post("/", createTrainSchedule);
 router.put("/:train_number", updateTrainSchedule);
 
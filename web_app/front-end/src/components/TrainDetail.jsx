@@ -34,11 +34,42 @@ export default function TrainDetail({ train, goBack }) {
   const fetchSimulation = async () => {
     setAnalyzing(true);
     try {
-      const res = await axios.post(
-        `https://rras-ml.onrender.com/api/ml/simulate`,
-        { train_number: train.train_number }
-      );
-      setResult(res.data);
+      // NDJSON stream: one line per finished variant, then a final "done" line
+      const res = await fetch(`https://rras-ml.onrender.com/api/ml/simulate/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ train_number: train.train_number }),
+      });
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      const variants = [];
+      let buffer = "";
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const msg = JSON.parse(line);
+          if (msg.type === "variant") {
+            if (msg.total_delay != null) variants.push(msg);
+            if (msg.best_so_far) {
+              setResult({
+                best_variant: msg.best_so_far,
+                all_variants: [...variants].sort((a, b) => a.total_delay - b.total_delay),
+                detail_df: [],
+              });
+            }
+          } else if (msg.type === "done") {
+            setResult(msg);
+          } else if (msg.type === "error") {
+            throw new Error(msg.error);
+          }
+        }
+      }
     } catch (err) {
       console.error("Simulation fetch error:", err);
     } finally {